@@ -0,0 +1,64 @@
+import datetime
+from typing import Dict, List, Literal, Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+from pydantic import BaseModel
+
+from app.auth import AuthorizedUser
+from app.apis.expense_api import ExpenseSheetStatus, sheet_catalog, sheet_repository
+from app.libs.expense_analytics import ExpenseAnalytics
+
+router = APIRouter(prefix="/analytics", tags=["Analytics"])
+
+AnalyticsDimension = Literal["user", "company", "project", "location", "month", "currency"]
+
+# Entry columns are cached per sheet revision, so repeated reports only reload the sheets that changed
+expense_analytics = ExpenseAnalytics.from_env(sheet_repository)
+
+class ExpenseAnalyticsGroup(BaseModel):
+    key: Dict[str, Optional[str]] # Label of every group_by dimension; null for entries without a value
+    entry_count: int
+    totals: Dict[str, float] # Sum of every amount field (and kilometers) of the group's entries
+
+class ExpenseAnalyticsResponse(BaseModel):
+    group_by: List[AnalyticsDimension]
+    sheet_count: int
+    entry_count: int
+    totals: Dict[str, float]
+    groups: List[ExpenseAnalyticsGroup]
+
+@router.get("/expenses", response_model=ExpenseAnalyticsResponse)
+def get_expense_analytics(
+    user: AuthorizedUser,
+    group_by: List[AnalyticsDimension] = Query(default=[], description="Dimensions to group by, e.g. group_by=company&group_by=month."),
+    user_id: Optional[str] = Query(default=None, description="Owner of the sheets. Defaults to the authenticated user."),
+    all_users: bool = Query(default=False, description="Report on the sheets of every user, ignoring user_id."),
+    date_from: Optional[datetime.date] = Query(default=None, description="First entry date included."),
+    date_to: Optional[datetime.date] = Query(default=None, description="Last entry date included."),
+    status_filter: Optional[ExpenseSheetStatus] = Query(default=None, alias="status"),
+    currency: Optional[str] = None,
+    company: Optional[str] = Query(default=None, description="Only entries of this company."),
+    project: Optional[str] = Query(default=None, description="Only entries of this project."),
+) -> ExpenseAnalyticsResponse:
+    """Totals of every amount category across all matching sheets, grouped by any of user, company,
+    project, location, month and currency. Entries are filtered by entry date, not by sheet month.
+    """
+    if len(set(group_by)) != len(group_by):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each dimension may appear only once in group_by.")
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date_from must not be after date_to.")
+    filters = {dimension: value for dimension, value in (("company", company), ("project", project)) if value is not None}
+    try:
+        # The catalog gives the matching sheets and their revisions with a single read
+        records, _ = sheet_catalog.query(
+            user_id=None if all_users else (user_id or user.sub),
+            status=status_filter,
+            currency=currency,
+        )
+        result = expense_analytics.aggregate(records, group_by=group_by, date_from=date_from, date_to=date_to, filters=filters)
+        return ExpenseAnalyticsResponse(group_by=group_by, **result)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[ANALYTICS_API] Error computing expense analytics: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to compute expense analytics: {str(e)}") from e
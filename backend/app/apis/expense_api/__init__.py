@@ -1,14 +1,34 @@
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, ValidationError
 
 DEFAULT_KM_RATE = 0.14
-from typing import List, Literal, Optional
+# Response header listing likely duplicates of a saved entry, as "<sheet_id>/<entry_id>, ..."
+DUPLICATE_ENTRIES_HEADER = "X-Duplicate-Entries"
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, TypeVar, Union
 import uuid
 import datetime
-import re  # Added for sanitize_storage_key
-import databutton as db  # Added for Databutton SDK
-from fastapi import APIRouter, HTTPException, status  # Added status for HTTP status codes
-import json  # Added for loading JSON strings
+import hashlib
+import json
+from fastapi import APIRouter, Header, HTTPException, Query, Response, status  # Added status for HTTP status codes
 from app.auth import AuthorizedUser  # Ensure AuthorizedUser is imported at the top
+from app.libs.expense_storage import (
+    CorruptSheetError,
+    ExpenseSheetRepository,
+    RevisionConflictError,
+    SheetNotFoundError,
+    get_expense_sheet_storage_key,
+    get_storage_backend,
+    start_write_batch_recovery,
+)
+from app.libs.expense_cache import SheetCache
+from app.libs.sheet_locks import SheetLockManager
+from app.libs.expense_catalog import CATALOG_FIELDS, InvalidCursorError, SheetCatalog
+from app.libs.expense_rollups import ExpenseRollups
+from app.libs.expense_duplicates import ExpenseDuplicates
+from app.libs.expense_search import ExpenseSearch
+from app.libs.expense_migrations import SHEET_SCHEMA_VERSION, upgrade_sheet_document
+from app.libs.field_projection import parse_field_projection, project_document
+from app.libs.sheet_totals import add_entry_to_totals, remove_entry_from_totals
+from app.libs.storage_codec import get_codec
 # Attempt to import Firestore client and initialization status from user_deletion_service
 # This is not ideal, but it's where the initialization currently resides.
 # A better approach would be to have a central firebase_setup module.
@@ -24,15 +44,6 @@ except ImportError:
 # Define allowed statuses for ExpenseSheet
 ExpenseSheetStatus = Literal["pending_validation", "validated", "rejected"]
 
-# --- Helper function for storage keys ---
-def sanitize_storage_key(key: str) -> str:
-    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
-    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
-
-def get_expense_sheet_storage_key(sheet_id: str) -> str:
-    """Returns the db.storage key for an expense sheet."""
-    return sanitize_storage_key(f"expense_sheet_{sheet_id}.json")
-
 class ExpenseEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     expense_sheet_id: str # This will be the ID of the parent ExpenseSheet
@@ -68,23 +79,12 @@ class ExpenseEntry(BaseModel):
     km_amount: Optional[float] = Field(default=None, description="Calculated: kilometers * km_rate")
     daily_total: Optional[float] = Field(default=None, description="Calculated: sum of all category amounts + km_amount")
     
-    # For backward compatibility with old data that used purchase_date
+    # Old data used purchase_date; stored legacy sheets get entry_date from it when loaded (see app.libs.expense_migrations)
     purchase_date: Optional[datetime.date] = None 
 
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
     updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
 
-    @model_validator(mode='before')
-    def _handle_date_compatibility(cls, data):
-        if isinstance(data, dict):
-            if 'entry_date' not in data and 'purchase_date' in data:
-                data['entry_date'] = data['purchase_date']
-            # Ensure essential fields for calculation have defaults if completely missing, Pydantic handles Optional for most
-            # For example, if payment_method was critical and missing, you could default it here:
-            # if 'payment_method' not in data or data['payment_method'] is None:
-            #     data['payment_method'] = "unknown" # Or some sensible default
-        return data
-
 class ExpenseEntryUpdateRequest(BaseModel):
     """Request model for updating an expense entry. All fields are optional."""
     new_sheet_id: Optional[str] = Field(default=None, description="If provided and different from current sheet_id, the entry will be moved to this new sheet.") # MYA-32: Allow moving entry
@@ -150,6 +150,51 @@ class ExpenseEntryCreateRequest(BaseModel):
     km_rate: Optional[float] = None # If not provided by client, DEFAULT_KM_RATE will be used for calculation
     # Calculated fields (km_amount, daily_total) are not part of create request, they are derived.
 
+class ExpenseEntryBatchCreateRequest(BaseModel):
+    """Request model for adding several entries to a sheet at once.
+    Items are validated one by one (as ExpenseEntryCreateRequest), so one invalid item does not reject the batch.
+    """
+    entries: List[Dict[str, Any]]
+
+class ExpenseDuplicateEntry(BaseModel):
+    entry_id: str
+    sheet_id: str
+    entry_date: Optional[datetime.date] = None
+    merchant_name: Optional[str] = None
+    daily_total: float = 0.0
+
+class ExpenseDuplicateMatch(ExpenseDuplicateEntry):
+    matched_on: List[Literal["content", "receipt"]] # Fingerprints in common (see app.libs.expense_duplicates)
+
+class ExpenseDuplicateGroup(BaseModel):
+    matched_on: Literal["content", "receipt"]
+    entries: List[ExpenseDuplicateEntry]
+
+class ExpenseEntryBatchItemResult(BaseModel):
+    index: int # Position of the item in the request
+    status: Literal["created", "invalid"]
+    entry: Optional[ExpenseEntry] = None
+    errors: Optional[List[Dict[str, Any]]] = None # Pydantic validation errors for invalid items
+    duplicates: Optional[List[ExpenseDuplicateMatch]] = None # Likely duplicates of a created entry, a warning only
+
+class ExpenseEntryBatchCreateResponse(BaseModel):
+    sheet_id: str
+    revision: int
+    total_amount: float
+    created_count: int
+    invalid_count: int
+    results: List[ExpenseEntryBatchItemResult]
+
+class ExpenseEntryBatchUpdateItem(ExpenseEntryUpdateRequest):
+    """One entry update within a batch; new_sheet_id moves the entry like the single-entry endpoint."""
+    entry_id: str
+
+class ExpenseEntryBatchUpdateRequest(BaseModel):
+    updates: List[ExpenseEntryBatchUpdateItem] = Field(min_length=1)
+
+class ExpenseEntryBatchDeleteRequest(BaseModel):
+    entry_ids: List[str] = Field(min_length=1)
+
 class ExpenseSheetUpdateRequest(BaseModel):
     """Request model for updating an expense sheet. Fields are optional for partial updates,
        but if payment_method_filter is provided, it must conform to the Literal.
@@ -170,6 +215,18 @@ class ExpenseSheetUpdateRequest(BaseModel):
     user_name: Optional[str] = None  # MYA-31: Add user name for update
     anticipo: Optional[float] = None   # MYA-31: Add advance payment for update
 
+class ExpenseSheetSubtotals(BaseModel):
+    """Per-category sums over the entries of a sheet, kept up to date with total_amount (see app.libs.sheet_totals)."""
+    parking_amount: float = 0.0
+    taxi_amount: float = 0.0
+    kilometers: float = 0.0 # Total kilometers, not an amount
+    km_amount: float = 0.0
+    transport_amount: float = 0.0
+    hotel_amount: float = 0.0
+    lunch_amount: float = 0.0
+    dinner_amount: float = 0.0
+    miscellaneous_amount: float = 0.0
+
 class ExpenseSheet(BaseModel):
     creator_first_name: Optional[str] = None # MYA-37.1: Store creator's first name
     creator_last_name: Optional[str] = None  # MYA-37.1: Store creator's last name
@@ -185,10 +242,288 @@ class ExpenseSheet(BaseModel):
     anticipo: float = Field(default=0.0) # MYA-31: Add advance payment to main model
     user_id: Optional[str] = None # To store the Firebase UID of the creator. IMPORTANT: This will be populated.
     total_amount: float = 0.0 # Calculated sum of its entries
+    subtotals: ExpenseSheetSubtotals = Field(default_factory=ExpenseSheetSubtotals)
+    entry_count: int = 0
     entries: List[ExpenseEntry] = [] # Holds the actual expense entries
+    revision: int = 0 # Incremented by the repository on every save; exposed as the ETag
+    schema_version: int = 0 # Version of the stored document (see app.libs.expense_migrations); 0 for legacy sheets
     created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
     updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
 
+
+class ExpenseSheetTotals(BaseModel):
+    sheet_id: str
+    revision: int
+    total_amount: float
+    subtotals: ExpenseSheetSubtotals
+    entry_count: int
+
+class ExpenseEntryDelta(ExpenseSheetTotals):
+    """Minimal response of a single-entry mutation (Prefer: return=minimal): the affected entry and
+    the new totals and revision of its sheet, instead of the whole sheet."""
+    entry: Optional[ExpenseEntry] = None # The added, updated or moved entry; None on delete
+    deleted_entry_id: Optional[str] = None
+    moved_from: Optional[ExpenseSheetTotals] = None # The original sheet, when the entry was moved
+
+class ExpenseSheetSummary(BaseModel):
+    """Sheet-level fields only, as rendered by the dashboard. Entries are fetched with get_expense_sheet_by_id."""
+    id: str
+    name: str
+    month: int
+    year: int
+    currency: str
+    payment_method_filter: Optional[str] = None
+    status: ExpenseSheetStatus = "pending_validation"
+    user_id: Optional[str] = None
+    total_amount: float = 0.0
+    subtotals: ExpenseSheetSubtotals = Field(default_factory=ExpenseSheetSubtotals)
+    entry_count: int = 0
+    revision: int = 0
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class ExpenseSheetSummaryPage(BaseModel):
+    """One page of sheet summaries. Pass next_cursor back as `cursor` to get the next page."""
+    items: List[ExpenseSheetSummary]
+    next_cursor: Optional[str] = None
+
+class ExpenseRollupSheet(BaseModel):
+    id: str
+    name: Optional[str] = None
+    status: Optional[str] = None
+    currency: Optional[str] = None
+    total_amount: float = 0.0
+    subtotals: ExpenseSheetSubtotals = Field(default_factory=ExpenseSheetSubtotals)
+    entry_count: int = 0
+    revision: int = 0
+
+class ExpenseRollupTotals(BaseModel):
+    sheet_count: int
+    entry_count: int
+    total_amount: float
+    subtotals: ExpenseSheetSubtotals
+
+class ExpenseMonthlyRollup(BaseModel):
+    """What one user's sheets of a month add up to, per currency (see app.libs.expense_rollups)."""
+    user_id: str
+    year: int
+    month: int
+    totals: Dict[str, ExpenseRollupTotals] # Keyed by currency
+    sheets: List[ExpenseRollupSheet]
+
+class ExpenseSearchHit(BaseModel):
+    entry_id: str
+    sheet_id: str
+    entry_date: Optional[datetime.date] = None
+    merchant_name: Optional[str] = None
+    project: Optional[str] = None
+    company: Optional[str] = None
+    location: Optional[str] = None
+    daily_total: float = 0.0
+    categories: List[str] = [] # Amount fields the entry has a value in, e.g. "parking_amount"
+
+class ExpenseSearchResult(BaseModel):
+    total: int # Matching entries, including those beyond limit
+    items: List[ExpenseSearchHit]
+
+# All sheet I/O goes through the repository; the backend is chosen by EXPENSE_STORAGE_BACKEND.
+# Legacy documents are upgraded in memory while loading, so the models need no compatibility validators.
+sheet_repository = ExpenseSheetRepository(
+    get_storage_backend(),
+    ExpenseSheet,
+    cache=SheetCache.from_env(),
+    upgrade_document=lambda document: upgrade_sheet_document(document, DEFAULT_KM_RATE),
+)
+# Sheet-level catalog, kept up to date on every repository write
+sheet_catalog = SheetCatalog(sheet_repository.backend, sheet_repository)
+sheet_repository.add_listener(sheet_catalog)
+# Monthly rollups per user; registered after the catalog, which they rebuild from
+sheet_rollups = ExpenseRollups(sheet_repository.backend, sheet_repository, sheet_catalog)
+sheet_repository.add_listener(sheet_rollups)
+# Per-user inverted index of entry texts; also rebuilt through the catalog, so registered after it
+sheet_search = ExpenseSearch.from_env(sheet_repository.backend, sheet_repository, sheet_catalog)
+sheet_repository.add_listener(sheet_search)
+# Per-user index of entry fingerprints, for duplicate warnings
+sheet_duplicates = ExpenseDuplicates.from_env(sheet_repository.backend, sheet_repository, sheet_catalog)
+sheet_repository.add_listener(sheet_duplicates)
+# Serialises writers of the same sheet within this worker; revisions still guard across workers
+sheet_locks = SheetLockManager.from_env()
+# Completes or rolls back multi-sheet write batches interrupted by a crash
+start_write_batch_recovery(sheet_repository.backend)
+
+def _get_sheet_or_404(sheet_id: str, not_found_detail: Optional[str] = None) -> ExpenseSheet:
+    """Loads a sheet through the repository, mapping missing/corrupt data to HTTP errors.
+    The sheet may be shared with other readers through the cache; modify sheets with _update_sheet_or_http_error.
+    """
+    try:
+        sheet = sheet_repository.get(sheet_id)
+    except CorruptSheetError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) from e
+    if sheet is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found_detail or f"Expense sheet with ID {sheet_id} not found.")
+    return sheet
+
+MutationResult = TypeVar("MutationResult")
+
+def _update_sheet_or_http_error(
+    sheet_id: str,
+    mutate: Callable[[ExpenseSheet], MutationResult],
+    expected_revision: Optional[int] = None,
+    not_found_detail: Optional[str] = None,
+) -> Tuple[ExpenseSheet, MutationResult]:
+    """Runs an optimistic read-modify-write through the repository (retried on revision conflicts),
+    mapping storage errors to HTTP errors. HTTPExceptions raised by mutate abort the write.
+    Holds the sheet's lock for the whole cycle.
+    """
+    try:
+        with sheet_locks.hold(sheet_id):
+            return sheet_repository.update(sheet_id, mutate, expected_revision=expected_revision)
+    except SheetNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=not_found_detail or f"Expense sheet with ID {sheet_id} not found.") from None
+    except CorruptSheetError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) from e
+    except RevisionConflictError as e:
+        if expected_revision is not None:
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=f"Expense sheet {sheet_id} was modified (current revision {e.current_revision}).") from e
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Expense sheet {sheet_id} is being modified concurrently, please retry.") from e
+
+def _update_sheets_or_http_error(
+    mutations: Dict[str, Callable[[ExpenseSheet], Any]],
+    expected_revisions: Optional[Dict[str, int]] = None,
+    not_found_details: Optional[Dict[str, str]] = None,
+) -> Dict[str, Tuple[ExpenseSheet, Any]]:
+    """Like _update_sheet_or_http_error for several sheets, written together or not at all."""
+    try:
+        with sheet_locks.hold(*mutations):
+            return sheet_repository.update_many(mutations, expected_revisions=expected_revisions)
+    except SheetNotFoundError as e:
+        missing_sheet_id = e.args[0]
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=(not_found_details or {}).get(missing_sheet_id) or f"Expense sheet with ID {missing_sheet_id} not found.") from None
+    except CorruptSheetError as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)) from e
+    except RevisionConflictError as e:
+        if expected_revisions and e.sheet_id in expected_revisions:
+            raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=f"Expense sheet {e.sheet_id} was modified (current revision {e.current_revision}).") from e
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Expense sheets are being modified concurrently, please retry.") from e
+
+# --- ETag helpers ---
+def _projection_digest(projection: Dict[str, Any]) -> str:
+    """Short digest of a normalized `fields=` projection, so every projection has its own ETags."""
+    return hashlib.sha1(json.dumps(projection, sort_keys=True).encode()).hexdigest()[:16]
+
+def _sheet_etag(sheet_id: str, revision: int, projection: Optional[Dict[str, Any]] = None) -> str:
+    """"{id}.{revision}", or "{id}.{revision}.{projection digest}" for a projected representation."""
+    if projection is not None:
+        return f'"{sheet_id}.{revision}.{_projection_digest(projection)}"'
+    return f'"{sheet_id}.{revision}"'
+
+def _listing_etag(records: List[dict], next_cursor: Optional[str], projection: Optional[Dict[str, Any]] = None) -> str:
+    """ETag of a listing page, derived from the catalog so it can be checked without loading any sheet."""
+    digest = hashlib.sha1()
+    for record in records:
+        digest.update(f"{record['id']}.{record.get('revision', 0)};".encode())
+    digest.update((next_cursor or "").encode())
+    if projection is not None:
+        digest.update(f";{_projection_digest(projection)}".encode())
+    return f'"{digest.hexdigest()}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as used for If-None-Match (RFC 9110 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+def _find_duplicate_entries(sheet: ExpenseSheet, entries: List[ExpenseEntry]) -> Dict[str, List[dict]]:
+    """Likely duplicates of entries just saved to sheet, among all of the owner's entries.
+    Runs after the save, outside the sheet lock, so it never delays or blocks the write: entries are
+    saved whether or not they have duplicates, and the check excludes the saved entries themselves.
+    Only a warning: a failed check is logged and reports no duplicates.
+    """
+    if not sheet.user_id or not entries:
+        return {}
+    try:
+        return sheet_duplicates.find_duplicates(sheet.user_id, [entry.model_dump(mode='json') for entry in entries])
+    except Exception as e:
+        print(f"Error checking sheet {sheet.id} for duplicate entries: {e}")
+        return {}
+
+def _report_duplicate_entries(response: Response, sheet: ExpenseSheet, entries: List[ExpenseEntry]) -> Dict[str, List[dict]]:
+    """Checks entries just written to sheet for duplicates (see _find_duplicate_entries) and lists
+    them all in the X-Duplicate-Entries header, as "<sheet_id>/<entry_id>". Returns the duplicates."""
+    duplicates = _find_duplicate_entries(sheet, entries)
+    matches = dict.fromkeys(f"{duplicate['sheet_id']}/{duplicate['entry_id']}" for matches in duplicates.values() for duplicate in matches)
+    if matches:
+        response.headers[DUPLICATE_ENTRIES_HEADER] = ", ".join(matches)
+    return duplicates
+
+def _wants_minimal_response(prefer: Optional[str], response_mode: Optional[str]) -> bool:
+    """Whether the client asked for a delta instead of the whole sheet: ?response_mode= wins over
+    the Prefer header (RFC 7240, "return=minimal" / "return=representation")."""
+    if response_mode is not None:
+        return response_mode == "minimal"
+    preferences = [preference.strip().lower().replace('"', '') for preference in (prefer or "").split(",")]
+    return "return=minimal" in preferences
+
+def _sheet_totals(sheet: ExpenseSheet) -> ExpenseSheetTotals:
+    return ExpenseSheetTotals(sheet_id=sheet.id, revision=sheet.revision, total_amount=sheet.total_amount, subtotals=sheet.subtotals, entry_count=sheet.entry_count)
+
+def _entry_mutation_response(
+    sheet: ExpenseSheet,
+    response: Response,
+    minimal: bool,
+    entry_id: Optional[str] = None,
+    deleted_entry_id: Optional[str] = None,
+    moved_from: Optional[ExpenseSheet] = None,
+) -> Union[ExpenseSheet, ExpenseEntryDelta]:
+    """The whole sheet, or its delta when minimal; entry_id names the affected entry in sheet."""
+    if not minimal:
+        return sheet
+    response.headers["Preference-Applied"] = "return=minimal"
+    entry_index = _find_entry_index(sheet, entry_id) if entry_id is not None else -1
+    return ExpenseEntryDelta(
+        **_sheet_totals(sheet).model_dump(),
+        entry=sheet.entries[entry_index] if entry_index >= 0 else None,
+        deleted_entry_id=deleted_entry_id,
+        moved_from=_sheet_totals(moved_from) if moved_from is not None else None,
+    )
+
+ENTRY_RESPONSE_MODE_QUERY = Query(default=None, description="minimal: return only the affected entry, the sheet totals and revision (like Prefer: return=minimal); full: the whole sheet.")
+
+FIELDS_QUERY_DESCRIPTION = "Comma-separated fields to return, e.g. name,total_amount,entries.id; dotted names select fields of nested items. All fields when omitted."
+
+def _parse_fields(fields: Optional[str], model: type) -> Optional[Dict[str, Any]]:
+    if fields is None:
+        return None
+    try:
+        return parse_field_projection(fields, model)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
+def _projected_response(content: Any, response: Response) -> Response:
+    """Serializes an already projected body directly, skipping response-model validation,
+    with the headers set on the endpoint's response (ETag, X-Next-Cursor)."""
+    return Response(content=get_codec().encode(content), media_type="application/json", headers=dict(response.headers))
+
+def _parse_if_match(if_match: Optional[str], sheet_id: str) -> Optional[int]:
+    """Returns the revision required by an If-Match header, or None when any revision is acceptable.
+    The ETag of a projected read names the same revision as that of the full sheet."""
+    if not if_match or if_match.strip() == "*":
+        return None
+    for candidate in if_match.split(","):
+        tag = candidate.strip().removeprefix("W/").strip('"')
+        if not tag.startswith(f"{sheet_id}."):
+            continue
+        tag_revision = tag[len(sheet_id) + 1:].split(".", 1)[0]
+        if tag_revision.isdigit():
+            return int(tag_revision)
+    raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=f"If-Match does not match expense sheet {sheet_id}.")
+
 router = APIRouter(
     prefix="/expense-management",
     tags=["Expense Management"]
@@ -234,132 +569,225 @@ def create_expense_sheet(sheet_data: ExpenseSheetCreateRequest, user: Authorized
         creator_last_name=final_creator_last_name,   # MYA-37.1
         anticipo=sheet_data.anticipo if sheet_data.anticipo is not None else 0.0,
         # user_name is effectively removed from active population
+        schema_version=SHEET_SCHEMA_VERSION,
     )
-    storage_key = get_expense_sheet_storage_key(expense_sheet.id)
     try:
-        db.storage.json.put(storage_key, expense_sheet.model_dump(mode='json'))
-        print(f"Expense sheet {expense_sheet.id} created and saved to {storage_key}")
+        sheet_repository.create(expense_sheet)
+        print(f"Expense sheet {expense_sheet.id} created and saved to {get_expense_sheet_storage_key(expense_sheet.id)}")
         return expense_sheet
     except Exception as e:
-        print(f"Error saving expense sheet {expense_sheet.id} to {storage_key}: {e}")
+        print(f"Error saving expense sheet {expense_sheet.id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to create expense sheet: {str(e)}") from e
 
+MAX_PAGE_SIZE = 500
+
+def _query_catalog(
+    user: AuthorizedUser,
+    user_id: Optional[str],
+    all_users: bool,
+    year: Optional[int],
+    month: Optional[int],
+    status_filter: Optional[ExpenseSheetStatus],
+    payment_method_filter: Optional[str],
+    currency: Optional[str],
+    cursor: Optional[str],
+    limit: Optional[int],
+):
+    """Applies the listing filters to the sheet catalog. user_id defaults to the authenticated user."""
+    try:
+        return sheet_catalog.query(
+            user_id=None if all_users else (user_id or user.sub),
+            year=year,
+            month=month,
+            status=status_filter,
+            payment_method_filter=payment_method_filter,
+            currency=currency,
+            cursor=cursor,
+            limit=limit,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+
 @router.get("/expense-sheets", response_model=List[ExpenseSheet])
-def list_expense_sheets() -> List[ExpenseSheet]:
-    """Lists all expense sheets."""
-    expense_sheets: List[ExpenseSheet] = []
+def list_expense_sheets(
+    user: AuthorizedUser,
+    response: Response,
+    user_id: Optional[str] = Query(default=None, description="Owner of the sheets. Defaults to the authenticated user."),
+    all_users: bool = Query(default=False, description="List sheets of every user, ignoring user_id."),
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    status_filter: Optional[ExpenseSheetStatus] = Query(default=None, alias="status"),
+    payment_method_filter: Optional[str] = None,
+    currency: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE, description="Page size. All matching sheets are returned when omitted."),
+    fields: Optional[str] = Query(default=None, description=FIELDS_QUERY_DESCRIPTION),
+    if_none_match: Optional[str] = Header(default=None),
+) -> List[ExpenseSheet]:
+    """Lists expense sheets, most recently updated first.
+    When the result is paginated, the cursor for the next page is returned in the X-Next-Cursor header.
+    Returns 304 Not Modified when If-None-Match matches the ETag of the page.
+    With `fields`, each sheet only has the requested fields; when they are all in the sheet catalog
+    (no entries), the sheets themselves are not read.
+    """
+    projection = _parse_fields(fields, ExpenseSheet)
     try:
-        sheet_files = db.storage.json.list()
-        for sheet_file in sheet_files:
-            # Basic filtering to ensure we only process expected expense sheet files
-            if sheet_file.name.startswith("expense_sheet_") and sheet_file.name.endswith(".json"):
-                try:
-                    sheet_file_data_raw = db.storage.json.get(sheet_file.name)
-                    if sheet_file_data_raw:
-                        if isinstance(sheet_file_data_raw, str):
-                            # Data is a JSON string, needs parsing
-                            sheet_data_dict = json.loads(sheet_file_data_raw)
-                        elif isinstance(sheet_file_data_raw, dict):
-                            # Data is already a dictionary
-                            sheet_data_dict = sheet_file_data_raw
-                        else:
-                            # Unexpected data type
-                            print(f"Warning: Unexpected data type for {sheet_file.name}: {type(sheet_file_data_raw)}")
-                            continue # Skip this file
-                        expense_sheets.append(ExpenseSheet(**sheet_data_dict))
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON for {sheet_file.name}: {e}. Content was: {sheet_file_data_raw[:500]}") # Log part of the content
-                except Exception as e:
-                    # Log other errors for this specific file but continue with others
-                    print(f"Error processing expense sheet file {sheet_file.name}: {e}")
-        return expense_sheets
+        # The catalog gives the matching sheet ids with a single read, instead of listing every key in the bucket.
+        records, next_cursor = _query_catalog(user, user_id, all_users, year, month, status_filter, payment_method_filter, currency, cursor, limit)
+        etag = _listing_etag(records, next_cursor, projection)
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        response.headers["ETag"] = etag
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        if projection is not None and set(projection) <= set(CATALOG_FIELDS):
+            # Catalog records hold these fields in their JSON form already
+            return _projected_response([project_document(record, projection) for record in records], response)
+        # Unreadable sheets are logged and skipped by the repository.
+        sheets = sheet_repository.list_all([record["id"] for record in records])
+        if projection is not None:
+            return _projected_response([sheet.model_dump(mode='json', include=projection) for sheet in sheets], response)
+        return sheets
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error listing expense sheets: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to list expense sheets: {str(e)}") from e
 
-@router.get("/expense-sheets/{sheet_id}", response_model=ExpenseSheet)
-def get_expense_sheet_by_id(sheet_id: str) -> ExpenseSheet:
-    """Retrieves a specific expense sheet by its ID. 
-    If the stored total_amount is inconsistent with the sum of its entries' daily_totals,
-    it recalculates, saves, and returns the updated sheet.
+# Declared before /expense-sheets/{sheet_id} so "summary" is not taken as a sheet id
+@router.get("/expense-sheets/summary", response_model=ExpenseSheetSummaryPage)
+def list_expense_sheet_summaries(
+    user: AuthorizedUser,
+    response: Response,
+    user_id: Optional[str] = Query(default=None, description="Owner of the sheets. Defaults to the authenticated user."),
+    all_users: bool = Query(default=False, description="List sheets of every user, ignoring user_id."),
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+    status_filter: Optional[ExpenseSheetStatus] = Query(default=None, alias="status"),
+    payment_method_filter: Optional[str] = None,
+    currency: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(default=None),
+) -> ExpenseSheetSummaryPage:
+    """Lists expense sheets without their entries, most recently updated first,
+    from a single read of the sheet catalog. Supports If-None-Match like the full listing.
     """
-    storage_key = get_expense_sheet_storage_key(sheet_id)
     try:
-        sheet_data_raw = db.storage.json.get(storage_key)
-        if not sheet_data_raw:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.")
-        
-        sheet_data_dict: dict
-        if isinstance(sheet_data_raw, str):
-            try:
-                sheet_data_dict = json.loads(sheet_data_raw)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON for sheet {sheet_id}: {e}. Content: {sheet_data_raw[:500]}")
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Invalid JSON format for sheet {sheet_id}.") from e
-        elif isinstance(sheet_data_raw, dict):
-            sheet_data_dict = sheet_data_raw
+        records, next_cursor = _query_catalog(user, user_id, all_users, year, month, status_filter, payment_method_filter, currency, cursor, limit)
+        etag = _listing_etag(records, next_cursor)
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        response.headers["ETag"] = etag
+        return ExpenseSheetSummaryPage(items=[ExpenseSheetSummary(**record) for record in records], next_cursor=next_cursor)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error listing expense sheet summaries: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to list expense sheet summaries: {str(e)}") from e
+
+@router.get("/rollups/{year}/{month}", response_model=List[ExpenseMonthlyRollup])
+def get_monthly_rollups(
+    year: int,
+    month: int,
+    user: AuthorizedUser,
+    user_id: Optional[str] = Query(default=None, description="User to report on. Defaults to the authenticated user."),
+    all_users: bool = Query(default=False, description="Report on every user with sheets in the month, ignoring user_id."),
+) -> List[ExpenseMonthlyRollup]:
+    """Per-category totals of each user's sheets of a month, read from the materialized rollups
+    instead of the sheets. Users without sheets in the month are left out.
+    """
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="month must be between 1 and 12.")
+    try:
+        if all_users:
+            rollups = sheet_rollups.get_month_for_all_users(year, month)
         else:
-            print(f"Warning: Unexpected data type for sheet {sheet_id}: {type(sheet_data_raw)}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected data type for sheet {sheet_id}.")
+            owner_id = user_id or user.sub
+            rollup = sheet_rollups.get_month(owner_id, year, month)
+            rollups = {owner_id: rollup} if rollup is not None else {}
+        return [
+            ExpenseMonthlyRollup(user_id=owner_id, year=year, month=month, totals=rollup["totals"], sheets=list(rollup["sheets"].values()))
+            for owner_id, rollup in sorted(rollups.items())
+        ]
+    except Exception as e:
+        print(f"Error reading monthly rollups for {year}-{month}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to read monthly rollups: {str(e)}") from e
 
-        sheet = ExpenseSheet(**sheet_data_dict)
-        
-        # Check for inconsistency: if any entry has daily_total=None but sheet.total_amount is not 0,
-        # or if the sum of daily_totals doesn't match sheet.total_amount.
-        # This handles old sheets that haven't had their totals recalculated since daily_total was introduced.
-        expected_total = sum(entry.daily_total for entry in sheet.entries if entry.daily_total is not None)
+@router.get("/search", response_model=ExpenseSearchResult)
+def search_expense_entries(
+    user: AuthorizedUser,
+    q: str = Query(min_length=1, description="Words to find in the merchant, project, company or location; each matches as a prefix, ignoring case and accents."),
+    user_id: Optional[str] = Query(default=None, description="Owner of the entries. Defaults to the authenticated user."),
+    date_from: Optional[datetime.date] = Query(default=None, description="First entry date to include."),
+    date_to: Optional[datetime.date] = Query(default=None, description="Last entry date to include."),
+    category: Optional[str] = Query(default=None, description="Only entries with an amount in this field, e.g. parking_amount."),
+    limit: int = Query(default=50, ge=1, le=500),
+) -> ExpenseSearchResult:
+    """Finds entries across all of a user's sheets through the search index, newest first."""
+    try:
+        hits = sheet_search.search(user_id or user.sub, q, date_from=date_from, date_to=date_to, category=category)
+        return ExpenseSearchResult(total=len(hits), items=hits[:limit])
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+    except Exception as e:
+        print(f"Error searching expense entries for '{q}': {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to search expense entries: {str(e)}") from e
+
+@router.get("/duplicates", response_model=List[ExpenseDuplicateGroup])
+def find_duplicate_entries(
+    user: AuthorizedUser,
+    user_id: Optional[str] = Query(default=None, description="Owner of the entries. Defaults to the authenticated user."),
+) -> List[ExpenseDuplicateGroup]:
+    """Every group of a user's entries that look like the same expense (same date, merchant and
+    amounts, or the same Drive receipt), across all of the user's sheets, largest group first.
+    """
+    try:
+        return sheet_duplicates.duplicate_groups(user_id or user.sub)
+    except Exception as e:
+        print(f"Error finding duplicate expense entries: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to find duplicate entries: {str(e)}") from e
+
+@router.get("/expense-sheets/{sheet_id}", response_model=ExpenseSheet)
+def get_expense_sheet_by_id(
+    sheet_id: str,
+    response: Response,
+    fields: Optional[str] = Query(default=None, description=FIELDS_QUERY_DESCRIPTION),
+    if_none_match: Optional[str] = Header(default=None),
+) -> ExpenseSheet:
+    """Retrieves a specific expense sheet by its ID. Read-only: legacy sheets are upgraded in memory
+    and migrated offline by app.libs.expense_migrations, so the response can be cached.
+    The sheet revision is returned as the ETag; a matching If-None-Match gives 304 Not Modified.
+    With `fields`, only the requested fields are serialized; the ETag then also names the projection,
+    and still works as If-Match on writes to the sheet.
+    """
+    projection = _parse_fields(fields, ExpenseSheet)
+    try:
+        sheet = _get_sheet_or_404(sheet_id)
         
-        # Trigger recalculation and save if: 
-        # 1. The stored total_amount is different from the expected_total.
-        # 2. A more subtle case: if all entries have daily_total=None (so expected_total is 0), 
-        #    but the sheet.total_amount is still some old non-zero value.
-        needs_recalculation_and_save = False
-        if sheet.total_amount != expected_total:
-            needs_recalculation_and_save = True
-        elif expected_total == 0 and sheet.total_amount != 0 and any(entry.daily_total is None for entry in sheet.entries):
-            # This specifically catches old sheets with non-zero totals where all entries now effectively have zero daily_total
-            needs_recalculation_and_save = True
-
-        if needs_recalculation_and_save:
-            print(f"Recalculating total for sheet {sheet_id}. Old total: {sheet.total_amount}, New expected: {expected_total}")
-            _recalculate_sheet_total(sheet) # This updates sheet.total_amount in memory
-            sheet.updated_at = datetime.datetime.utcnow() # Update timestamp as data changed
-            db.storage.json.put(storage_key, sheet.model_dump(mode='json')) # Save the corrected sheet
-            print(f"Sheet {sheet_id} updated with new total: {sheet.total_amount}")
-            
+        etag = _sheet_etag(sheet.id, sheet.revision, projection)
+        if _etag_matches(if_none_match, etag):
+            return _not_modified(etag)
+        response.headers["ETag"] = etag
+        if projection is not None:
+            return _projected_response(sheet.model_dump(mode='json', include=projection), response)
         return sheet
 
-    except FileNotFoundError: 
-        print(f"File not found for expense sheet {sheet_id} at {storage_key} - this should ideally be caught by the check above.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.") from None
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error retrieving expense sheet {sheet_id} from {storage_key}: {e}")
+        print(f"Error retrieving expense sheet {sheet_id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve expense sheet: {str(e)}") from e
 
 @router.put("/expense-sheets/{sheet_id}", response_model=ExpenseSheet)
-def update_expense_sheet(sheet_id: str, sheet_update_data: ExpenseSheetUpdateRequest, user: AuthorizedUser) -> ExpenseSheet:
-    """Updates an existing expense sheet."""
-    storage_key = get_expense_sheet_storage_key(sheet_id)
-    try:
-        current_sheet_data_raw = db.storage.json.get(storage_key)
-        if not current_sheet_data_raw:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found for update.")
-        
-        current_sheet_dict: dict
-        if isinstance(current_sheet_data_raw, str):
-            try:
-                current_sheet_dict = json.loads(current_sheet_data_raw)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON for sheet {sheet_id} during update: {e}. Content: {current_sheet_data_raw[:500]}")
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Invalid JSON format for sheet {sheet_id}.") from e
-        elif isinstance(current_sheet_data_raw, dict):
-            current_sheet_dict = current_sheet_data_raw
-        else:
-            print(f"Warning: Unexpected data type for sheet {sheet_id} during update: {type(current_sheet_data_raw)}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected data type for sheet {sheet_id}.")
+def update_expense_sheet(sheet_id: str, sheet_update_data: ExpenseSheetUpdateRequest, user: AuthorizedUser, response: Response, if_match: Optional[str] = Header(default=None)) -> ExpenseSheet:
+    """Updates an existing expense sheet.
+    With an If-Match header the update only applies to that revision of the sheet (412 otherwise).
+    """
+    expected_revision = _parse_if_match(if_match, sheet_id)
+    update_data = sheet_update_data.model_dump(exclude_unset=True)
 
-        updated_sheet = ExpenseSheet(**current_sheet_dict)
-        update_data = sheet_update_data.model_dump(exclude_unset=True)
+    def apply_update(updated_sheet: ExpenseSheet) -> None:
         for key, value in update_data.items():
             if key == "user_name":
                 # For now, allow explicit update of user_name via payload if provided
@@ -367,198 +795,42 @@ def update_expense_sheet(sheet_id: str, sheet_update_data: ExpenseSheetUpdateReq
                 setattr(updated_sheet, key, value if value else f"Usuario (payload update, UID: {user.sub[:8]}...)")
             elif hasattr(updated_sheet, key):
                 setattr(updated_sheet, key, value)
-        
         updated_sheet.updated_at = datetime.datetime.utcnow()
-        
-        db.storage.json.put(storage_key, updated_sheet.model_dump(mode='json'))
-        print(f"Expense sheet {updated_sheet.id} updated and saved to {storage_key}")
+
+    try:
+        updated_sheet, _ = _update_sheet_or_http_error(sheet_id, apply_update, expected_revision, f"Expense sheet with ID {sheet_id} not found for update.")
+        print(f"Expense sheet {updated_sheet.id} updated and saved.")
+        response.headers["ETag"] = _sheet_etag(updated_sheet.id, updated_sheet.revision)
         return updated_sheet
-    except FileNotFoundError: 
-        print(f"File not found for expense sheet {sheet_id} at {storage_key} during update - this should be caught by the check above.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.") from None
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error updating expense sheet {sheet_id} at {storage_key}: {e}")
+        print(f"Error updating expense sheet {sheet_id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to update expense sheet: {str(e)}") from e
 
 @router.delete("/expense-sheets/{sheet_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_expense_sheet(sheet_id: str):
     """Deletes an expense sheet by its ID."""
-    storage_key = get_expense_sheet_storage_key(sheet_id)
     try:
-        # Check if sheet exists before attempting delete
-        sheet_data_raw = db.storage.json.get(storage_key, default=None)
-        if not sheet_data_raw:
-            print(f"Expense sheet {sheet_id} not found for deletion at {storage_key}.")
+        # No need to parse the sheet's content if we're just deleting.
+        with sheet_locks.hold(sheet_id):
+            deleted = sheet_repository.delete(sheet_id)
+        if not deleted:
+            print(f"Expense sheet {sheet_id} not found for deletion.")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.")
-
-        # At this point, we know the file exists, so we can proceed to delete.
-        # No need to parse its content fully if we're just deleting.
-        db.storage.json.delete(storage_key)
-        print(f"Expense sheet {sheet_id} deleted from {storage_key}")
+        print(f"Expense sheet {sheet_id} deleted.")
         return # For 204 No Content, FastAPI expects no return body
-    except FileNotFoundError: # Defensive, as get should catch it.
-        print(f"Expense sheet {sheet_id} not found (FileNotFound) at {storage_key} during delete.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.") from None
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error deleting expense sheet {sheet_id} from {storage_key}: {e}")
+        print(f"Error deleting expense sheet {sheet_id}: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to delete expense sheet: {str(e)}") from e
 
-# --- Helper function to recalculate total ---
-def _recalculate_sheet_total(sheet: ExpenseSheet) -> None:
-    """Recalculates the total_amount of an expense sheet based on its entries."""
-    sheet.total_amount = sum(entry.daily_total for entry in sheet.entries if entry.daily_total is not None)
-
-# --- Endpoints for Expense Entries ---
-@router.post("/expense-sheets/{sheet_id}/entries", response_model=ExpenseSheet, status_code=status.HTTP_201_CREATED)
-def add_expense_entry_to_sheet(sheet_id: str, entry_data: ExpenseEntryCreateRequest) -> ExpenseSheet:
-    """Adds a new expense entry to a specific expense sheet."""
-    storage_key = get_expense_sheet_storage_key(sheet_id)
-    try:
-        current_sheet_data_raw = db.storage.json.get(storage_key)
-        if not current_sheet_data_raw:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.")
-        
-        current_sheet_dict: dict
-        if isinstance(current_sheet_data_raw, str):
-            try:
-                current_sheet_dict = json.loads(current_sheet_data_raw)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON for sheet {sheet_id} when adding entry: {e}. Content: {current_sheet_data_raw[:500]}")
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Invalid JSON format for sheet {sheet_id}.") from e
-        elif isinstance(current_sheet_data_raw, dict):
-            current_sheet_dict = current_sheet_data_raw
-        else:
-            print(f"Warning: Unexpected data type for sheet {sheet_id} when adding entry: {type(current_sheet_data_raw)}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected data type for sheet {sheet_id}.")
-
-        sheet = ExpenseSheet(**current_sheet_dict)
-        
-        new_entry_id = str(uuid.uuid4())
-        
-        # Calculate km_amount
-        km_amount_calculated = 0.0
-        current_km_rate = entry_data.km_rate if entry_data.km_rate is not None else DEFAULT_KM_RATE
-        if entry_data.kilometers is not None and entry_data.kilometers > 0:
-            km_amount_calculated = entry_data.kilometers * current_km_rate
-        
-        # Calculate daily_total
-        category_amounts = [
-            entry_data.parking_amount,
-            entry_data.taxi_amount,
-            entry_data.transport_amount,
-            entry_data.hotel_amount,
-            entry_data.lunch_amount,
-            entry_data.dinner_amount,
-            entry_data.miscellaneous_amount
-        ]
-        daily_total_calculated = sum(amount for amount in category_amounts if amount is not None) + km_amount_calculated
-        
-        expense_entry = ExpenseEntry(
-            id=new_entry_id,
-            expense_sheet_id=sheet_id, 
-            merchant_name=entry_data.merchant_name,
-            entry_date=entry_data.entry_date, # Changed from purchase_date
-            payment_method=entry_data.payment_method,
-            project=entry_data.project,
-            company=entry_data.company,
-            location=entry_data.location,
-            receipt_google_drive_id=entry_data.receipt_google_drive_id,
-            receipt_google_drive_web_view_link=entry_data.receipt_google_drive_web_view_link,
-            receipt_google_drive_web_content_link=entry_data.receipt_google_drive_web_content_link,
-            receipt_google_drive_file_name=entry_data.receipt_google_drive_file_name, # MYA-31: Add field
-            parking_amount=entry_data.parking_amount,
-            taxi_amount=entry_data.taxi_amount,
-            transport_amount=entry_data.transport_amount,
-            hotel_amount=entry_data.hotel_amount,
-            lunch_amount=entry_data.lunch_amount,
-            dinner_amount=entry_data.dinner_amount,
-            miscellaneous_amount=entry_data.miscellaneous_amount,
-            kilometers=entry_data.kilometers,
-            km_rate=current_km_rate, # Store the rate used for calculation
-            km_amount=km_amount_calculated,
-            daily_total=daily_total_calculated
-        )
-        
-        sheet.entries.append(expense_entry)
-        _recalculate_sheet_total(sheet) # This will now use entry.daily_total
-        sheet.updated_at = datetime.datetime.utcnow()
-        
-        db.storage.json.put(storage_key, sheet.model_dump_json())
-        print(f"Expense entry {expense_entry.id} added to sheet {sheet.id}. Sheet updated.")
-        return sheet
-        
-    except FileNotFoundError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.") from None
-    except Exception as e:
-        print(f"Error adding expense entry to sheet {sheet_id}: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to add entry: {str(e)}") from e
-
-@router.get("/expense-sheets/{sheet_id}/entries/{entry_id}", response_model=ExpenseEntry)
-def get_expense_entry_from_sheet(sheet_id: str, entry_id: str) -> ExpenseEntry:
-    """Retrieves a specific expense entry from an expense sheet."""
-    storage_key = get_expense_sheet_storage_key(sheet_id)
-    try:
-        current_sheet_data_raw = db.storage.json.get(storage_key)
-        if not current_sheet_data_raw:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.")
-        
-        current_sheet_dict: dict
-        if isinstance(current_sheet_data_raw, str):
-            try:
-                current_sheet_dict = json.loads(current_sheet_data_raw)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON for sheet {sheet_id} when getting entry: {e}. Content: {current_sheet_data_raw[:500]}")
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Invalid JSON format for sheet {sheet_id}.") from e
-        elif isinstance(current_sheet_data_raw, dict):
-            current_sheet_dict = current_sheet_data_raw
-        else:
-            print(f"Warning: Unexpected data type for sheet {sheet_id} when getting entry: {type(current_sheet_data_raw)}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected data type for sheet {sheet_id}.")
-
-        sheet = ExpenseSheet(**current_sheet_dict)
-        found_entry = next((entry for entry in sheet.entries if entry.id == entry_id), None)
-        
-        if not found_entry:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense entry with ID {entry_id} not found in sheet {sheet_id}.")
-        return found_entry
-
-    except FileNotFoundError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.") from None
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to get entry: {str(e)}") from e
-
-@router.put("/expense-sheets/{sheet_id}/entries/{entry_id}", response_model=ExpenseSheet)
-def update_expense_entry_in_sheet(sheet_id: str, entry_id: str, entry_update_data: ExpenseEntryUpdateRequest) -> ExpenseSheet:
-    """Updates an existing expense entry. If entry_update_data.new_sheet_id is provided 
-       and is different from the current sheet_id, the entry will be moved to the new sheet."""
-    
-    # Get the original sheet
-    original_storage_key = get_expense_sheet_storage_key(sheet_id)
-    try:
-        original_sheet_data = db.storage.json.get(original_storage_key)
-        if not original_sheet_data:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Original expense sheet with ID {sheet_id} not found.")
-        original_sheet = ExpenseSheet(**original_sheet_data)
-    except FileNotFoundError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Original expense sheet {sheet_id} not found (FileNotFound).") from None
-    except Exception as e:
-        print(f"Error retrieving original sheet {sheet_id}: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error retrieving original sheet: {str(e)}") from e
-
-    # Find the entry to update in the original sheet
-    entry_to_update = None
-    entry_index_in_original = -1
-    for i, entry in enumerate(original_sheet.entries):
-        if entry.id == entry_id:
-            entry_to_update = entry
-            entry_index_in_original = i
-            break
-    
-    if not entry_to_update:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense entry ID {entry_id} not found in original sheet {sheet_id}.")
-
+def _apply_entry_update(entry_to_update: ExpenseEntry, entry_update_data: ExpenseEntryUpdateRequest) -> None:
+    """Applies an update request to an entry in place and recalculates its km_amount and daily_total."""
     # --- Apply updates to the entry object ---
     update_payload_dict = entry_update_data.model_dump(exclude_unset=True, exclude={"new_sheet_id"}) # Exclude new_sheet_id for direct field update
+    previous_receipt_google_drive_id = entry_to_update.receipt_google_drive_id
     for key, value in update_payload_dict.items():
         if hasattr(entry_to_update, key):
             setattr(entry_to_update, key, value)
@@ -595,7 +867,7 @@ def update_expense_entry_in_sheet(sheet_id: str, entry_id: str, entry_update_dat
         else:
             if "receipt_google_drive_web_view_link" not in update_payload_dict: entry_to_update.receipt_google_drive_web_view_link = None
             if "receipt_google_drive_web_content_link" not in update_payload_dict: entry_to_update.receipt_google_drive_web_content_link = None
-            if "receipt_google_drive_file_name" not in update_payload_dict and entry_to_update.receipt_google_drive_id != update_payload_dict["receipt_google_drive_id"]:
+            if "receipt_google_drive_file_name" not in update_payload_dict and previous_receipt_google_drive_id != update_payload_dict["receipt_google_drive_id"]:
                 entry_to_update.receipt_google_drive_file_name = None 
     elif "receipt_google_drive_file_name" in update_payload_dict and update_payload_dict["receipt_google_drive_file_name"] is None:
         if entry_to_update.receipt_google_drive_id is None:
@@ -604,98 +876,448 @@ def update_expense_entry_in_sheet(sheet_id: str, entry_id: str, entry_update_dat
 
     entry_to_update.updated_at = datetime.datetime.utcnow()
 
-    # --- Handle moving the entry if new_sheet_id is provided and different ---
-    if entry_update_data.new_sheet_id and entry_update_data.new_sheet_id != sheet_id:
-        new_sheet_id_from_payload = entry_update_data.new_sheet_id
-        new_storage_key = get_expense_sheet_storage_key(new_sheet_id_from_payload)
+def _find_entry_index(sheet: ExpenseSheet, entry_id: str) -> int:
+    """Index of the entry in sheet.entries, or -1."""
+    return next((i for i, entry in enumerate(sheet.entries) if entry.id == entry_id), -1)
 
-        # Get the new sheet
-        try:
-            new_sheet_data = db.storage.json.get(new_storage_key)
-            if not new_sheet_data:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Destination expense sheet with ID {new_sheet_id_from_payload} not found.")
-            new_sheet = ExpenseSheet(**new_sheet_data)
-        except FileNotFoundError:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Destination sheet {new_sheet_id_from_payload} not found (FileNotFound).") from None
-        except Exception as e:
-            print(f"Error retrieving destination sheet {new_sheet_id_from_payload}: {e}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error retrieving destination sheet: {str(e)}") from e
+def _replace_entries(sheet: ExpenseSheet, entries: List[ExpenseEntry]) -> None:
+    """Adds entries moved into the sheet, replacing any copy with the same id, and updates its totals."""
+    ids_to_add = {entry.id for entry in entries}
+    remaining_entries = []
+    for entry in sheet.entries:
+        if entry.id in ids_to_add:
+            remove_entry_from_totals(sheet, entry)
+        else:
+            remaining_entries.append(entry)
+    sheet.entries = remaining_entries
+    for entry in entries:
+        sheet.entries.append(entry)
+        add_entry_to_totals(sheet, entry)
 
-        # Remove entry from original sheet
-        original_sheet.entries.pop(entry_index_in_original)
-        _recalculate_sheet_total(original_sheet)
-        original_sheet.updated_at = datetime.datetime.utcnow()
+def _move_entry(
+    sheet_id: str,
+    entry_id: str,
+    new_sheet_id_from_payload: str,
+    entry_update_data: ExpenseEntryUpdateRequest,
+    response: Response,
+    expected_revision: Optional[int],
+) -> Tuple[ExpenseSheet, ExpenseSheet]:
+    """Applies the update to the entry and moves it to new_sheet_id_from_payload.
+    Both sheets are written as one batch, so the entry is never lost or duplicated. Caller holds both sheet locks.
+    Returns (destination sheet, original sheet).
+    """
+    moved_entries: List[ExpenseEntry] = []
 
-        # Update entry's own sheet ID and add to new sheet
+    def remove_from_origin(sheet: ExpenseSheet) -> None:
+        entry_index_in_original = _find_entry_index(sheet, entry_id)
+        if entry_index_in_original < 0:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense entry ID {entry_id} not found in original sheet {sheet_id}.")
+        entry_to_update = sheet.entries.pop(entry_index_in_original)
+        remove_entry_from_totals(sheet, entry_to_update)
+        _apply_entry_update(entry_to_update, entry_update_data)
+        # Update entry's own sheet ID
         entry_to_update.expense_sheet_id = new_sheet_id_from_payload
-        new_sheet.entries.append(entry_to_update)
-        _recalculate_sheet_total(new_sheet)
+        moved_entries[:] = [entry_to_update]
+        sheet.updated_at = datetime.datetime.utcnow()
+
+    def add_to_destination(new_sheet: ExpenseSheet) -> None:
+        _replace_entries(new_sheet, moved_entries)
         new_sheet.updated_at = datetime.datetime.utcnow()
 
-        # Save both sheets
-        try:
-            db.storage.json.put(original_storage_key, original_sheet.model_dump_json())
-            db.storage.json.put(new_storage_key, new_sheet.model_dump_json())
-            print(f"Expense entry {entry_id} moved from sheet {sheet_id} to {new_sheet_id_from_payload}. Both sheets updated.")
-            return new_sheet # Return the sheet where the entry was moved to
-        except Exception as e:
-            # This is a critical state, as one sheet might have saved and the other not.
-            # Ideally, a transaction would be used if the storage supported it.
-            print(f"CRITICAL: Error saving sheets during move of entry {entry_id}: {e}")
-            # For now, re-raise, but the data might be inconsistent.
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Critical error during entry move: {str(e)}") from e
-    else:
-        # Not moving, just update entry in the original sheet
-        original_sheet.entries[entry_index_in_original] = entry_to_update # Replace the entry in the list
-        _recalculate_sheet_total(original_sheet)
-        original_sheet.updated_at = datetime.datetime.utcnow()
-        
-        try:
-            db.storage.json.put(original_storage_key, original_sheet.model_dump_json())
-            print(f"Expense entry {entry_id} in sheet {sheet_id} updated. Sheet re-saved.")
-            return original_sheet
-        except Exception as e:
-            print(f"Error saving updated sheet {sheet_id}: {e}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error saving updated sheet: {str(e)}") from e
+    results = _update_sheets_or_http_error(
+        {sheet_id: remove_from_origin, new_sheet_id_from_payload: add_to_destination},
+        expected_revisions={sheet_id: expected_revision} if expected_revision is not None else None,
+        not_found_details={
+            sheet_id: f"Original expense sheet with ID {sheet_id} not found.",
+            new_sheet_id_from_payload: f"Destination expense sheet with ID {new_sheet_id_from_payload} not found.",
+        },
+    )
+    new_sheet = results[new_sheet_id_from_payload][0]
+    print(f"Expense entry {entry_id} moved from sheet {sheet_id} to {new_sheet_id_from_payload}. Both sheets updated.")
+    response.headers["ETag"] = _sheet_etag(new_sheet.id, new_sheet.revision)
+    return new_sheet, results[sheet_id][0]
+
+def _build_expense_entry(sheet_id: str, entry_data: ExpenseEntryCreateRequest) -> ExpenseEntry:
+    """Creates a new entry for the sheet, calculating km_amount and daily_total."""
+    new_entry_id = str(uuid.uuid4())
+
+    # Calculate km_amount
+    km_amount_calculated = 0.0
+    current_km_rate = entry_data.km_rate if entry_data.km_rate is not None else DEFAULT_KM_RATE
+    if entry_data.kilometers is not None and entry_data.kilometers > 0:
+        km_amount_calculated = entry_data.kilometers * current_km_rate
 
-@router.delete("/expense-sheets/{sheet_id}/entries/{entry_id}", response_model=ExpenseSheet)
-def delete_expense_entry_from_sheet(sheet_id: str, entry_id: str) -> ExpenseSheet:
-    """Deletes an expense entry from an expense sheet."""
-    storage_key = get_expense_sheet_storage_key(sheet_id)
+    # Calculate daily_total
+    category_amounts = [
+        entry_data.parking_amount,
+        entry_data.taxi_amount,
+        entry_data.transport_amount,
+        entry_data.hotel_amount,
+        entry_data.lunch_amount,
+        entry_data.dinner_amount,
+        entry_data.miscellaneous_amount
+    ]
+    daily_total_calculated = sum(amount for amount in category_amounts if amount is not None) + km_amount_calculated
+
+    expense_entry = ExpenseEntry(
+        id=new_entry_id,
+        expense_sheet_id=sheet_id, 
+        merchant_name=entry_data.merchant_name,
+        entry_date=entry_data.entry_date, # Changed from purchase_date
+        payment_method=entry_data.payment_method,
+        project=entry_data.project,
+        company=entry_data.company,
+        location=entry_data.location,
+        receipt_google_drive_id=entry_data.receipt_google_drive_id,
+        receipt_google_drive_web_view_link=entry_data.receipt_google_drive_web_view_link,
+        receipt_google_drive_web_content_link=entry_data.receipt_google_drive_web_content_link,
+        receipt_google_drive_file_name=entry_data.receipt_google_drive_file_name, # MYA-31: Add field
+        parking_amount=entry_data.parking_amount,
+        taxi_amount=entry_data.taxi_amount,
+        transport_amount=entry_data.transport_amount,
+        hotel_amount=entry_data.hotel_amount,
+        lunch_amount=entry_data.lunch_amount,
+        dinner_amount=entry_data.dinner_amount,
+        miscellaneous_amount=entry_data.miscellaneous_amount,
+        kilometers=entry_data.kilometers,
+        km_rate=current_km_rate, # Store the rate used for calculation
+        km_amount=km_amount_calculated,
+        daily_total=daily_total_calculated
+    )
+    return expense_entry
+
+# --- Endpoints for Expense Entries ---
+@router.post("/expense-sheets/{sheet_id}/entries", response_model=Union[ExpenseSheet, ExpenseEntryDelta], status_code=status.HTTP_201_CREATED)
+def add_expense_entry_to_sheet(
+    sheet_id: str,
+    entry_data: ExpenseEntryCreateRequest,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    prefer: Optional[str] = Header(default=None),
+    response_mode: Optional[Literal["full", "minimal"]] = ENTRY_RESPONSE_MODE_QUERY,
+) -> Union[ExpenseSheet, ExpenseEntryDelta]:
+    """Adds a new expense entry to a specific expense sheet.
+    Concurrent additions are safe: the write is retried on top of the latest revision of the sheet.
+    If the entry looks like one the user already submitted, the X-Duplicate-Entries header lists
+    those entries as "<sheet_id>/<entry_id>"; the entry is saved all the same.
+    With Prefer: return=minimal (or ?response_mode=minimal) only the new entry and the sheet totals are returned.
+    """
+    expected_revision = _parse_if_match(if_match, sheet_id)
     try:
-        current_sheet_data_raw = db.storage.json.get(storage_key)
-        if not current_sheet_data_raw:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet with ID {sheet_id} not found.")
+        expense_entry = _build_expense_entry(sheet_id, entry_data)
+
+        def append_entry(sheet: ExpenseSheet) -> None:
+            sheet.entries.append(expense_entry.model_copy())
+            add_entry_to_totals(sheet, expense_entry)
+            sheet.updated_at = datetime.datetime.utcnow()
+
+        sheet, _ = _update_sheet_or_http_error(sheet_id, append_entry, expected_revision)
+        print(f"Expense entry {expense_entry.id} added to sheet {sheet.id}. Sheet updated.")
+        response.headers["ETag"] = _sheet_etag(sheet.id, sheet.revision)
+        _report_duplicate_entries(response, sheet, [expense_entry])
+        return _entry_mutation_response(sheet, response, _wants_minimal_response(prefer, response_mode), entry_id=expense_entry.id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error adding expense entry to sheet {sheet_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to add entry: {str(e)}") from e
+
+MAX_BATCH_ENTRIES = 500
 
-        current_sheet_dict: dict
-        if isinstance(current_sheet_data_raw, str):
+@router.post("/expense-sheets/{sheet_id}/entries/batch", response_model=ExpenseEntryBatchCreateResponse)
+def add_expense_entries_to_sheet(sheet_id: str, batch: ExpenseEntryBatchCreateRequest, response: Response, if_match: Optional[str] = Header(default=None)) -> ExpenseEntryBatchCreateResponse:
+    """Adds several expense entries to a sheet with a single read-modify-write.
+    Each item is validated on its own; valid items are all saved together and invalid ones are
+    reported in `results` with their validation errors. Returns per-item results instead of the whole sheet;
+    created items that look like entries the user already submitted (or like each other) list them in `duplicates`,
+    and all of those entries are listed in the X-Duplicate-Entries header.
+    """
+    if len(batch.entries) > MAX_BATCH_ENTRIES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"A batch may contain at most {MAX_BATCH_ENTRIES} entries.")
+    expected_revision = _parse_if_match(if_match, sheet_id)
+    try:
+        results: List[ExpenseEntryBatchItemResult] = []
+        new_entries: List[ExpenseEntry] = []
+        for index, item in enumerate(batch.entries):
             try:
-                current_sheet_dict = json.loads(current_sheet_data_raw)
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON for sheet {sheet_id} when deleting entry: {e}. Content: {current_sheet_data_raw[:500]}")
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Invalid JSON format for sheet {sheet_id}.") from e
-        elif isinstance(current_sheet_data_raw, dict):
-            current_sheet_dict = current_sheet_data_raw
+                entry_data = ExpenseEntryCreateRequest.model_validate(item)
+            except ValidationError as e:
+                results.append(ExpenseEntryBatchItemResult(index=index, status="invalid", errors=e.errors(include_url=False, include_context=False)))
+                continue
+            expense_entry = _build_expense_entry(sheet_id, entry_data)
+            new_entries.append(expense_entry)
+            results.append(ExpenseEntryBatchItemResult(index=index, status="created", entry=expense_entry))
+
+        def append_entries(sheet: ExpenseSheet) -> None:
+            for entry in new_entries:
+                sheet.entries.append(entry.model_copy())
+                add_entry_to_totals(sheet, entry)
+            sheet.updated_at = datetime.datetime.utcnow()
+
+        if new_entries:
+            sheet, _ = _update_sheet_or_http_error(sheet_id, append_entries, expected_revision)
+            print(f"{len(new_entries)} expense entries added to sheet {sheet.id} in one write.")
+            duplicates = _report_duplicate_entries(response, sheet, new_entries)
+            for result in results:
+                if result.entry is not None and result.entry.id in duplicates:
+                    result.duplicates = [ExpenseDuplicateMatch(**duplicate) for duplicate in duplicates[result.entry.id]]
+        else:
+            # Nothing to write; still report the sheet's current state
+            sheet = _get_sheet_or_404(sheet_id)
+        response.headers["ETag"] = _sheet_etag(sheet.id, sheet.revision)
+        return ExpenseEntryBatchCreateResponse(
+            sheet_id=sheet.id,
+            revision=sheet.revision,
+            total_amount=sheet.total_amount,
+            created_count=len(new_entries),
+            invalid_count=len(results) - len(new_entries),
+            results=results,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error adding expense entries to sheet {sheet_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to add entries: {str(e)}") from e
+
+def _check_batch_entry_ids(entry_ids: List[str]) -> None:
+    if len(entry_ids) > MAX_BATCH_ENTRIES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"A batch may contain at most {MAX_BATCH_ENTRIES} entries.")
+    if len(set(entry_ids)) != len(entry_ids):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Each entry may appear only once in a batch.")
+
+def _missing_entries_error(sheet_id: str, missing_entry_ids: List[str]) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense entries not found in sheet {sheet_id}: {', '.join(missing_entry_ids)}.")
+
+def _apply_entry_batch(
+    sheet_id: str,
+    in_place_updates: List[ExpenseEntryBatchUpdateItem],
+    moves: Dict[str, List[ExpenseEntryBatchUpdateItem]],
+    expected_revision: Optional[int],
+) -> Tuple[ExpenseSheet, List[ExpenseEntry]]:
+    """Applies a batch of entry updates to a sheet. Moved entries go to their destinations in the same
+    write batch as the origin, so either every sheet is updated or none is.
+    Caller holds the locks of the sheet and all destinations.
+    Returns (original sheet, the updated and moved entries as saved).
+    """
+    moved_entry_ids = {item.entry_id for items in moves.values() for item in items}
+    moved_entries: Dict[str, List[ExpenseEntry]] = {}
+
+    def update_origin(sheet: ExpenseSheet) -> None:
+        entries_by_id = {entry.id: entry for entry in sheet.entries}
+        missing_entry_ids = [item.entry_id for item in in_place_updates if item.entry_id not in entries_by_id]
+        missing_entry_ids.extend(entry_id for entry_id in moved_entry_ids if entry_id not in entries_by_id)
+        if missing_entry_ids:
+            raise _missing_entries_error(sheet_id, missing_entry_ids)
+        for item in in_place_updates:
+            entry = entries_by_id[item.entry_id]
+            remove_entry_from_totals(sheet, entry)
+            _apply_entry_update(entry, item)
+            add_entry_to_totals(sheet, entry)
+        for destination_sheet_id, items in moves.items():
+            for item in items:
+                entry = entries_by_id[item.entry_id]
+                remove_entry_from_totals(sheet, entry)
+                _apply_entry_update(entry, item)
+                entry.expense_sheet_id = destination_sheet_id
+            moved_entries[destination_sheet_id] = [entries_by_id[item.entry_id] for item in items]
+        if moved_entry_ids:
+            sheet.entries = [entry for entry in sheet.entries if entry.id not in moved_entry_ids]
+        sheet.updated_at = datetime.datetime.utcnow()
+
+    in_place_entry_ids = {item.entry_id for item in in_place_updates}
+    if not moves:
+        sheet, _ = _update_sheet_or_http_error(sheet_id, update_origin, expected_revision)
+        return sheet, [entry for entry in sheet.entries if entry.id in in_place_entry_ids]
+
+    def add_to_destination(new_sheet: ExpenseSheet) -> None:
+        _replace_entries(new_sheet, moved_entries[new_sheet.id])
+        new_sheet.updated_at = datetime.datetime.utcnow()
+
+    # The origin runs first and collects the moved entries; all sheets are then written as one batch
+    mutations: Dict[str, Callable[[ExpenseSheet], None]] = {sheet_id: update_origin}
+    mutations.update((destination_sheet_id, add_to_destination) for destination_sheet_id in moves)
+    not_found_details = {destination_sheet_id: f"Destination expense sheet with ID {destination_sheet_id} not found." for destination_sheet_id in moves}
+    not_found_details[sheet_id] = f"Original expense sheet with ID {sheet_id} not found."
+    results = _update_sheets_or_http_error(
+        mutations,
+        expected_revisions={sheet_id: expected_revision} if expected_revision is not None else None,
+        not_found_details=not_found_details,
+    )
+    print(f"{len(moved_entry_ids)} expense entries moved from sheet {sheet_id} to {len(moves)} sheets.")
+    sheet = results[sheet_id][0]
+    written_entries = [entry for entry in sheet.entries if entry.id in in_place_entry_ids]
+    written_entries.extend(entry for entries in moved_entries.values() for entry in entries)
+    return sheet, written_entries
+
+@router.patch("/expense-sheets/{sheet_id}/entries/batch", response_model=ExpenseSheet)
+def update_expense_entries_in_sheet(sheet_id: str, batch: ExpenseEntryBatchUpdateRequest, response: Response, if_match: Optional[str] = Header(default=None)) -> ExpenseSheet:
+    """Updates several entries of a sheet in one load/save. The batch is atomic for the sheet:
+    if any entry is missing nothing is written. Entries with a new_sheet_id are moved, with one
+    write per destination sheet. Returns the original sheet; If-Match applies to it.
+    Updated entries that look like ones the user already submitted are listed in X-Duplicate-Entries.
+    """
+    _check_batch_entry_ids([item.entry_id for item in batch.updates])
+    expected_revision = _parse_if_match(if_match, sheet_id)
+    in_place_updates: List[ExpenseEntryBatchUpdateItem] = []
+    moves: Dict[str, List[ExpenseEntryBatchUpdateItem]] = {}
+    for item in batch.updates:
+        if item.new_sheet_id and item.new_sheet_id != sheet_id:
+            moves.setdefault(item.new_sheet_id, []).append(item)
         else:
-            print(f"Warning: Unexpected data type for sheet {sheet_id} when deleting entry: {type(current_sheet_data_raw)}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected data type for sheet {sheet_id}.")
+            in_place_updates.append(item)
+    try:
+        with sheet_locks.hold(sheet_id, *moves):
+            sheet, written_entries = _apply_entry_batch(sheet_id, in_place_updates, moves, expected_revision)
+        print(f"{len(batch.updates)} expense entries in sheet {sheet_id} updated in one write.")
+        response.headers["ETag"] = _sheet_etag(sheet.id, sheet.revision)
+        _report_duplicate_entries(response, sheet, written_entries)
+        return sheet
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error updating expense entries in sheet {sheet_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to update entries: {str(e)}") from e
+
+@router.post("/expense-sheets/{sheet_id}/entries/batch-delete", response_model=ExpenseSheet)
+def delete_expense_entries_from_sheet(sheet_id: str, batch: ExpenseEntryBatchDeleteRequest, response: Response, if_match: Optional[str] = Header(default=None)) -> ExpenseSheet:
+    """Deletes several entries of a sheet in one load/save. If any entry is missing nothing is deleted.
+    A POST rather than a DELETE with a body, which proxies and clients may drop.
+    """
+    _check_batch_entry_ids(batch.entry_ids)
+    expected_revision = _parse_if_match(if_match, sheet_id)
+    entry_ids_to_delete = set(batch.entry_ids)
+
+    def remove_entries(sheet: ExpenseSheet) -> None:
+        present_entry_ids = {entry.id for entry in sheet.entries}
+        missing_entry_ids = [entry_id for entry_id in batch.entry_ids if entry_id not in present_entry_ids]
+        if missing_entry_ids:
+            raise _missing_entries_error(sheet_id, missing_entry_ids)
+        remaining_entries = []
+        for entry in sheet.entries:
+            if entry.id in entry_ids_to_delete:
+                remove_entry_from_totals(sheet, entry)
+            else:
+                remaining_entries.append(entry)
+        sheet.entries = remaining_entries
+        sheet.updated_at = datetime.datetime.utcnow()
+
+    try:
+        sheet, _ = _update_sheet_or_http_error(sheet_id, remove_entries, expected_revision)
+        print(f"{len(entry_ids_to_delete)} expense entries deleted from sheet {sheet_id} in one write.")
+        response.headers["ETag"] = _sheet_etag(sheet.id, sheet.revision)
+        return sheet
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to delete entries: {str(e)}") from e
 
-        sheet = ExpenseSheet(**current_sheet_dict)
-        original_entries_count = len(sheet.entries)
-        sheet.entries = [entry for entry in sheet.entries if entry.id != entry_id]
+@router.get("/expense-sheets/{sheet_id}/entries/{entry_id}", response_model=ExpenseEntry)
+def get_expense_entry_from_sheet(
+    sheet_id: str,
+    entry_id: str,
+    response: Response,
+    fields: Optional[str] = Query(default=None, description=FIELDS_QUERY_DESCRIPTION),
+) -> ExpenseEntry:
+    """Retrieves a specific expense entry from an expense sheet. With `fields`, only the requested fields are returned."""
+    projection = _parse_fields(fields, ExpenseEntry)
+    try:
+        sheet = _get_sheet_or_404(sheet_id)
+        found_entry = next((entry for entry in sheet.entries if entry.id == entry_id), None)
         
-        if len(sheet.entries) == original_entries_count:
+        if not found_entry:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense entry with ID {entry_id} not found in sheet {sheet_id}.")
+        if projection is not None:
+            return _projected_response(found_entry.model_dump(mode='json', include=projection), response)
+        return found_entry
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to get entry: {str(e)}") from e
+
+@router.put("/expense-sheets/{sheet_id}/entries/{entry_id}", response_model=Union[ExpenseSheet, ExpenseEntryDelta])
+def update_expense_entry_in_sheet(
+    sheet_id: str,
+    entry_id: str,
+    entry_update_data: ExpenseEntryUpdateRequest,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    prefer: Optional[str] = Header(default=None),
+    response_mode: Optional[Literal["full", "minimal"]] = ENTRY_RESPONSE_MODE_QUERY,
+) -> Union[ExpenseSheet, ExpenseEntryDelta]:
+    """Updates an existing expense entry. If entry_update_data.new_sheet_id is provided 
+       and is different from the current sheet_id, the entry will be moved to the new sheet.
+       If-Match applies to the original sheet.
+       If the updated entry looks like one the user already submitted, X-Duplicate-Entries lists them.
+       With Prefer: return=minimal (or ?response_mode=minimal) only the entry and the sheet totals
+       are returned; for a move, those of the new sheet plus the totals of the original one."""
+    expected_revision = _parse_if_match(if_match, sheet_id)
+    minimal = _wants_minimal_response(prefer, response_mode)
+    entry_not_found_detail = f"Expense entry ID {entry_id} not found in original sheet {sheet_id}."
+
+    # --- Handle moving the entry if new_sheet_id is provided and different ---
+    if entry_update_data.new_sheet_id and entry_update_data.new_sheet_id != sheet_id:
+        new_sheet_id_from_payload = entry_update_data.new_sheet_id
+
+        # Both sheets stay locked for the whole move; hold() orders the locks, so opposite moves cannot deadlock
+        with sheet_locks.hold(sheet_id, new_sheet_id_from_payload):
+            new_sheet, original_sheet = _move_entry(sheet_id, entry_id, new_sheet_id_from_payload, entry_update_data, response, expected_revision)
+        _report_duplicate_entries(response, new_sheet, [entry for entry in new_sheet.entries if entry.id == entry_id])
+        return _entry_mutation_response(new_sheet, response, minimal, entry_id=entry_id, moved_from=original_sheet)
+
+    # Not moving, just update entry in the original sheet
+    def update_entry(original_sheet: ExpenseSheet) -> None:
+        entry_index_in_original = _find_entry_index(original_sheet, entry_id)
+        if entry_index_in_original < 0:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=entry_not_found_detail)
+        entry = original_sheet.entries[entry_index_in_original]
+        remove_entry_from_totals(original_sheet, entry)
+        _apply_entry_update(entry, entry_update_data)
+        add_entry_to_totals(original_sheet, entry)
+        original_sheet.updated_at = datetime.datetime.utcnow()
+
+    try:
+        original_sheet, _ = _update_sheet_or_http_error(sheet_id, update_entry, expected_revision, f"Original expense sheet with ID {sheet_id} not found.")
+        print(f"Expense entry {entry_id} in sheet {sheet_id} updated. Sheet re-saved.")
+        response.headers["ETag"] = _sheet_etag(original_sheet.id, original_sheet.revision)
+        _report_duplicate_entries(response, original_sheet, [entry for entry in original_sheet.entries if entry.id == entry_id])
+        return _entry_mutation_response(original_sheet, response, minimal, entry_id=entry_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error saving updated sheet {sheet_id}: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error saving updated sheet: {str(e)}") from e
+
+@router.delete("/expense-sheets/{sheet_id}/entries/{entry_id}", response_model=Union[ExpenseSheet, ExpenseEntryDelta])
+def delete_expense_entry_from_sheet(
+    sheet_id: str,
+    entry_id: str,
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    prefer: Optional[str] = Header(default=None),
+    response_mode: Optional[Literal["full", "minimal"]] = ENTRY_RESPONSE_MODE_QUERY,
+) -> Union[ExpenseSheet, ExpenseEntryDelta]:
+    """Deletes an expense entry from an expense sheet.
+    With Prefer: return=minimal (or ?response_mode=minimal) only the sheet totals and the deleted entry id are returned.
+    """
+    expected_revision = _parse_if_match(if_match, sheet_id)
+
+    def remove_entry(sheet: ExpenseSheet) -> None:
+        entry_index = _find_entry_index(sheet, entry_id)
+        if entry_index < 0:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense entry ID {entry_id} not found in sheet {sheet_id}.")
-            
-        _recalculate_sheet_total(sheet)
+        remove_entry_from_totals(sheet, sheet.entries.pop(entry_index))
         sheet.updated_at = datetime.datetime.utcnow()
-        
-        db.storage.json.put(storage_key, sheet.model_dump_json())
+
+    try:
+        sheet, _ = _update_sheet_or_http_error(sheet_id, remove_entry, expected_revision, f"Expense sheet {sheet_id} not found.")
         print(f"Expense entry {entry_id} deleted from sheet {sheet_id}. Sheet re-saved.")
-        return sheet
+        response.headers["ETag"] = _sheet_etag(sheet.id, sheet.revision)
+        return _entry_mutation_response(sheet, response, _wants_minimal_response(prefer, response_mode), deleted_entry_id=entry_id)
 
-    except FileNotFoundError:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet {sheet_id} not found.") from None
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to delete entry: {str(e)}") from e
 
@@ -1,7 +1,7 @@
 import datetime
 from io import BytesIO
 from typing import List
-from pydantic import BaseModel # Use pydantic.BaseModel directly
+from pydantic import BaseModel, Field # Use pydantic.BaseModel directly
 from fastapi import APIRouter, HTTPException, Depends, status, File, UploadFile
 from fastapi.responses import StreamingResponse
 from openpyxl import Workbook, load_workbook
@@ -37,6 +37,10 @@ import io # For BytesIO and MediaIoBaseDownload
 
 from app.auth import AuthorizedUser # For user authentication
 from app.env import Mode, mode # For Databutton fallback logic
+from app.libs.expense_migrations import upgrade_sheet_document
+from app.libs.expense_storage import CorruptSheetError, ExpenseSheetRepository, get_storage_backend
+from app.libs.entry_amounts import EntryAmounts
+from app.libs.sheet_totals import amount_totals
 
 # Google API Client libraries
 from google.oauth2.credentials import Credentials
@@ -153,8 +157,8 @@ async def upload_excel_template(file: UploadFile):
 
 # Attempt to import models from the expense_api. 
 try:
-    from app.apis.expense_api import ExpenseSheet as ActualExpenseSheet, ExpenseEntry as ActualExpenseEntry, get_expense_sheet_storage_key
-    print("[INFO_EXPORT_SERVICE] Successfully imported ActualExpenseSheet, ActualExpenseEntry, and get_expense_sheet_storage_key from app.apis.expense_api")
+    from app.apis.expense_api import ExpenseSheet as ActualExpenseSheet, ExpenseEntry as ActualExpenseEntry, get_expense_sheet_storage_key, sheet_repository
+    print("[INFO_EXPORT_SERVICE] Successfully imported ActualExpenseSheet, ActualExpenseEntry, get_expense_sheet_storage_key and sheet_repository from app.apis.expense_api")
 except ImportError:
     print("[WARNING_EXPORT_SERVICE] Failed to import from app.apis.expense_api. Using placeholder models/functions. This may lead to inconsistencies.")
     class ActualExpenseEntry(BaseModel): # Changed from db.Pydantic
@@ -183,6 +187,17 @@ except ImportError:
         created_at: datetime.datetime
         updated_at: datetime.datetime
 
+    class ActualExpenseSheetSubtotals(BaseModel):
+        parking_amount: float = 0.0
+        taxi_amount: float = 0.0
+        kilometers: float = 0.0
+        km_amount: float = 0.0
+        transport_amount: float = 0.0
+        hotel_amount: float = 0.0
+        lunch_amount: float = 0.0
+        dinner_amount: float = 0.0
+        miscellaneous_amount: float = 0.0
+
     class ActualExpenseSheet(BaseModel): # Changed from db.Pydantic
         id: str
         name: str
@@ -194,7 +209,10 @@ except ImportError:
         comments: str | None = None
         user_name: str | None = None
         anticipo: float = 0.0
+        user_id: str | None = None
         total_amount: float = 0.0
+        subtotals: ActualExpenseSheetSubtotals = Field(default_factory=ActualExpenseSheetSubtotals) # Read by the footer (see app.libs.sheet_totals)
+        entry_count: int = 0
         entries: List[ActualExpenseEntry] = []
         created_at: datetime.datetime
         updated_at: datetime.datetime
@@ -204,6 +222,15 @@ except ImportError:
         print(f"[DEBUG_EXPORT_PLACEHOLDER] Generated storage key with placeholder: {s_key} for sheet ID: {sheet_id}")
         return s_key
 
+    DEFAULT_KM_RATE = 0.14 # Same as app.apis.expense_api.DEFAULT_KM_RATE
+
+    # Same storage and in-memory upgrades as the expense_api repository, so legacy sheets read alike
+    sheet_repository = ExpenseSheetRepository(
+        get_storage_backend(),
+        ActualExpenseSheet,
+        upgrade_document=lambda document: upgrade_sheet_document(document, DEFAULT_KM_RATE),
+    )
+
 def get_month_name(month_number: int) -> str:
     """Returns the Spanish name for a given month number."""
     months_es = [
@@ -246,42 +273,21 @@ async def export_expense_sheet_to_excel(request_body: ExportSheetRequest) -> Exp
     sheet_id = request_body.sheet_id
     print(f"[BASE64_EXPORT_DEBUG] Entered export_expense_sheet_to_excel for sheet_id: {sheet_id}")
     try:
-        storage_key = get_expense_sheet_storage_key(sheet_id)
-        print(f"[BASE64_EXPORT_DEBUG] Attempting to load sheet from storage key: {storage_key}")
-        sheet_data_from_storage = db.storage.json.get(storage_key, default=None)
-        
-        if sheet_data_from_storage is None:
-            print(f"[BASE64_EXPORT_DEBUG] Expense sheet {sheet_id} not found at {storage_key}")
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet {sheet_id} not found")
-
-        print(f"[BASE64_EXPORT_DEBUG] Data type from storage for {sheet_id}: {type(sheet_data_from_storage)}")
-
-        loaded_dict = None
-        if isinstance(sheet_data_from_storage, str):
-            try:
-                loaded_dict = json.loads(sheet_data_from_storage)
-                print(f"[BASE64_EXPORT_DEBUG] Successfully json.loads'd string data for {sheet_id}")
-            except json.JSONDecodeError as json_err:
-                print(f"[BASE64_EXPORT_DEBUG] JSONDecodeError for sheet {sheet_id} when parsing string data: {json_err}. Data was: {sheet_data_from_storage}")
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error decoding JSON string data: {json_err}") from json_err
-        elif isinstance(sheet_data_from_storage, dict):
-            loaded_dict = sheet_data_from_storage
-            print(f"[BASE64_EXPORT_DEBUG] Used dict data directly for {sheet_id}")
-        else:
-            print(f"[BASE64_EXPORT_DEBUG] Unexpected data type from storage for {sheet_id}: {type(sheet_data_from_storage)}. Data: {sheet_data_from_storage}")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Unexpected data type from storage: {type(sheet_data_from_storage)}")
-
-        if loaded_dict is None: # Should not happen if logic above is correct, but as a safeguard
-             print(f"[BASE64_EXPORT_DEBUG] loaded_dict is None for sheet {sheet_id} after attempting to process from storage. This is unexpected.")
-             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to load sheet data into a dictionary.")
-
+        print(f"[BASE64_EXPORT_DEBUG] Attempting to load sheet {sheet_id} from storage key: {get_expense_sheet_storage_key(sheet_id)}")
         try:
-            sheet = ActualExpenseSheet(**loaded_dict)
-            print(f"[BASE64_EXPORT_DEBUG] Successfully parsed/validated sheet {sheet_id} with {len(sheet.entries)} entries using ActualExpenseSheet.")
+            sheet = sheet_repository.get(sheet_id)
+        except CorruptSheetError as decode_err:
+            print(f"[BASE64_EXPORT_DEBUG] Stored data for sheet {sheet_id} could not be decoded: {decode_err}")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error decoding sheet data: {decode_err}") from decode_err
         except Exception as parse_exc: 
-            print(f"[BASE64_EXPORT_DEBUG] Error parsing/validating sheet {sheet_id} with ActualExpenseSheet: {parse_exc}. Data dictionary was: {loaded_dict}")
+            print(f"[BASE64_EXPORT_DEBUG] Error parsing/validating sheet {sheet_id} with ActualExpenseSheet: {parse_exc}")
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error parsing/validating sheet data with Pydantic model: {parse_exc}") from parse_exc
 
+        if sheet is None:
+            print(f"[BASE64_EXPORT_DEBUG] Expense sheet {sheet_id} not found")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet {sheet_id} not found")
+        print(f"[BASE64_EXPORT_DEBUG] Successfully parsed/validated sheet {sheet_id} with {len(sheet.entries)} entries using ActualExpenseSheet.")
+
         creator_first_name_to_write = "N/A"
         creator_last_name_to_write = "N/A"
         if sheet.user_id and firebase_admin_initialized_local and db_firestore_admin_client_local:
@@ -374,66 +380,22 @@ async def export_expense_sheet_to_excel(request_body: ExportSheetRequest) -> Exp
                 ws.merge_cells(start_row=data_entry_start_row, start_column=1, end_row=data_entry_start_row, end_column=len(data_table_headers))
         else:
             print(f"[EXPORT_FIXED_V2] Processing {len(sheet.entries)} entries for sheet {sheet_id}.")
-            # Initialize accumulators for partial totals
-            totals_accumulators = {
-                "PARKING": 0.0,
-                "TAXI": 0.0,
-                "KM": 0.0, # Sum of kilometers themselves
-                "IMPORTE KMs": 0.0,
-                "AVION/HOTEL/COCHE": 0.0,
-                "HOTEL": 0.0,
-                "ALMUERZO": 0.0,
-                "CENA": 0.0,
-                "VARIOS": 0.0,
-                "TOTAL DIARIO": 0.0 # Sum of all daily totals
-            }
+            # Partial totals are maintained on the sheet, so the footer does not sum the entries
+            totals_accumulators = amount_totals(sheet)
 
             for entry_idx, entry in enumerate(sheet.entries, start=data_entry_start_row):
+                amounts = EntryAmounts.from_entry(entry)
                 # Mapeo a las nuevas columnas:
                 fecha_str = entry.entry_date.strftime("%d/%m/%Y") if entry.entry_date else ""
                 proyecto_str = entry.project or ""
                 empresa_str = entry.merchant_name or ""
                 localidad_str = entry.location or ""
-                
-                parking_val = entry.parking_amount if entry.parking_amount is not None else 0.0
-                totals_accumulators["PARKING"] += parking_val
-                
-                taxi_val = entry.taxi_amount if entry.taxi_amount is not None else 0.0
-                totals_accumulators["TAXI"] += taxi_val
-                
-                km_val = entry.kilometers if entry.kilometers is not None else 0.0
-                totals_accumulators["KM"] += km_val # Accumulating actual KMs
-                
-                importe_kms_val = entry.km_amount if entry.km_amount is not None else 0.0
-                totals_accumulators["IMPORTE KMs"] += importe_kms_val
-                
-                avion_hotel_coche_val = entry.transport_amount if entry.transport_amount is not None else 0.0
-                totals_accumulators["AVION/HOTEL/COCHE"] += avion_hotel_coche_val
-                
-                hotel_val = entry.hotel_amount if entry.hotel_amount is not None else 0.0
-                totals_accumulators["HOTEL"] += hotel_val
-                
-                almuerzo_val = entry.lunch_amount if entry.lunch_amount is not None else 0.0
-                totals_accumulators["ALMUERZO"] += almuerzo_val
-                
-                cena_val = entry.dinner_amount if entry.dinner_amount is not None else 0.0
-                totals_accumulators["CENA"] += cena_val
-                
-                varios_val = entry.miscellaneous_amount if entry.miscellaneous_amount is not None else 0.0
-                totals_accumulators["VARIOS"] += varios_val
-                
-                total_diario_val = entry.daily_total if entry.daily_total is not None else 0.0
-                totals_accumulators["TOTAL DIARIO"] += total_diario_val
 
                 # Check for associated ticket
                 ticket_adjunto_val = "Sí" if entry.receipt_google_drive_id and entry.receipt_google_drive_file_name else "No"
 
-                row_data_values = [
-                    fecha_str, proyecto_str, empresa_str, localidad_str,
-                    parking_val, taxi_val, km_val, importe_kms_val,
-                    avion_hotel_coche_val, hotel_val, almuerzo_val, cena_val, varios_val,
-                    total_diario_val, ticket_adjunto_val
-                ]
+                # The amounts are in column order, from PARKING to TOTAL DIARIO
+                row_data_values = [fecha_str, proyecto_str, empresa_str, localidad_str, *amounts, ticket_adjunto_val]
                 
                 for col_idx_val, value in enumerate(row_data_values, 1):
                     cell = ws.cell(row=entry_idx, column=col_idx_val, value=value)
@@ -483,16 +445,16 @@ async def export_expense_sheet_to_excel(request_body: ExportSheetRequest) -> Exp
             col_idx_total_diario_sum = data_table_headers.index("TOTAL DIARIO") + 1
 
             partial_totals_map = [
-                (col_idx_parking, totals_accumulators["PARKING"]),
-                (col_idx_taxi, totals_accumulators["TAXI"]),
-                (col_idx_km, totals_accumulators["KM"]),
-                (col_idx_importe_kms, totals_accumulators["IMPORTE KMs"]),
-                (col_idx_avion, totals_accumulators["AVION/HOTEL/COCHE"]),
-                (col_idx_hotel, totals_accumulators["HOTEL"]),
-                (col_idx_almuerzo, totals_accumulators["ALMUERZO"]),
-                (col_idx_cena, totals_accumulators["CENA"]),
-                (col_idx_varios, totals_accumulators["VARIOS"]),
-                (col_idx_total_diario_sum, totals_accumulators["TOTAL DIARIO"])
+                (col_idx_parking, totals_accumulators["parking_amount"]),
+                (col_idx_taxi, totals_accumulators["taxi_amount"]),
+                (col_idx_km, totals_accumulators["kilometers"]),
+                (col_idx_importe_kms, totals_accumulators["km_amount"]),
+                (col_idx_avion, totals_accumulators["transport_amount"]),
+                (col_idx_hotel, totals_accumulators["hotel_amount"]),
+                (col_idx_almuerzo, totals_accumulators["lunch_amount"]),
+                (col_idx_cena, totals_accumulators["dinner_amount"]),
+                (col_idx_varios, totals_accumulators["miscellaneous_amount"]),
+                (col_idx_total_diario_sum, totals_accumulators["daily_total"])
             ]
 
             thin_border_side = Side(style='thin', color="000000")
@@ -514,7 +476,7 @@ async def export_expense_sheet_to_excel(request_body: ExportSheetRequest) -> Exp
             subtotal_label_cell = ws.cell(row=current_row, column=data_table_headers.index("VARIOS") + 1, value="SUBTOTAL") # Column M
             subtotal_label_cell.font = Font(bold=True)
             subtotal_label_cell.alignment = Alignment(horizontal="right")
-            subtotal_value_cell = ws.cell(row=current_row, column=data_table_headers.index("TOTAL DIARIO") + 1, value=totals_accumulators["TOTAL DIARIO"]) # Column N
+            subtotal_value_cell = ws.cell(row=current_row, column=data_table_headers.index("TOTAL DIARIO") + 1, value=totals_accumulators["daily_total"]) # Column N
             subtotal_value_cell.font = Font(bold=True)
             format_currency_cell(subtotal_value_cell, sheet.currency)
             subtotal_value_cell.alignment = Alignment(horizontal="right")
@@ -549,7 +511,7 @@ async def export_expense_sheet_to_excel(request_body: ExportSheetRequest) -> Exp
             current_row += 1
 
             # Row: TOTAL
-            final_total_val = totals_accumulators["TOTAL DIARIO"] + anticipo_val - devolucion_val
+            final_total_val = totals_accumulators["daily_total"] + anticipo_val - devolucion_val
             total_label_cell = ws.cell(row=current_row, column=data_table_headers.index("VARIOS") + 1, value="TOTAL") # Column M
             total_label_cell.font = Font(bold=True)
             total_label_cell.alignment = Alignment(horizontal="right")
@@ -605,18 +567,11 @@ async def export_expense_sheet_receipts_zip(sheet_id: str, user: AuthorizedUser)
 
     # 1. Get Expense Sheet Data
     try:
-        storage_key = get_expense_sheet_storage_key(sheet_id)
-        sheet_data_from_storage = db.storage.json.get(storage_key, default=None)
-        if sheet_data_from_storage is None:
-            print(f"[RECEIPT_ZIP_EXPORT] Expense sheet {sheet_id} not found at {storage_key}")
+        sheet = sheet_repository.get(sheet_id)
+        if sheet is None:
+            print(f"[RECEIPT_ZIP_EXPORT] Expense sheet {sheet_id} not found at {get_expense_sheet_storage_key(sheet_id)}")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Expense sheet {sheet_id} not found")
 
-        loaded_dict = json.loads(sheet_data_from_storage) if isinstance(sheet_data_from_storage, str) else sheet_data_from_storage
-        if not isinstance(loaded_dict, dict):
-             print(f"[RECEIPT_ZIP_EXPORT] Failed to load sheet data {sheet_id} into a dictionary.")
-             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to load sheet data into a dictionary.")
-        
-        sheet = ActualExpenseSheet(**loaded_dict)
         print(f"[RECEIPT_ZIP_EXPORT] Loaded sheet '{sheet.name}' with {len(sheet.entries)} entries.")
 
     except HTTPException:
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from pydantic import BaseModel
+from typing import Dict
+
+from app.libs import metrics
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+class MetricsResponse(BaseModel):
+    counters: Dict[str, float]
+    summaries: Dict[str, Dict[str, float]]
+
+@router.get("", response_model=MetricsResponse)
+def get_metrics() -> MetricsResponse:
+    """Returns the in-process counters and summaries of this worker (cache hits/misses, timings...)."""
+    return MetricsResponse(**metrics.snapshot())
@@ -0,0 +1,96 @@
+"""Compact numeric view of expense entries for totals and reports.
+
+ExpenseEntry models carry some 25 fields (dates, texts, Drive links) while aggregation only needs
+the amounts. EntryAmounts is a tuple-backed record of one entry's amounts; AmountColumns keeps the
+amounts of many entries as one array('d') per field, 8 bytes per value instead of a float object
+per value. Both are built from models or straight from stored documents, so reports over many
+sheets can skip model parsing (see ExpenseSheetRepository.get_document). Missing amounts are 0.0.
+
+    columns = AmountColumns.from_entries(sheet.entries)
+    columns.totals()["daily_total"]
+"""
+
+from array import array
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, NamedTuple
+
+# Numeric entry fields, in the order of the export columns
+AMOUNT_FIELDS = (
+    "parking_amount", "taxi_amount", "kilometers", "km_amount", "transport_amount",
+    "hotel_amount", "lunch_amount", "dinner_amount", "miscellaneous_amount", "daily_total",
+)
+
+
+class EntryAmounts(NamedTuple):
+    parking_amount: float
+    taxi_amount: float
+    kilometers: float
+    km_amount: float
+    transport_amount: float
+    hotel_amount: float
+    lunch_amount: float
+    dinner_amount: float
+    miscellaneous_amount: float
+    daily_total: float
+
+    @classmethod
+    def from_entry(cls, entry) -> "EntryAmounts":
+        return cls(*(value or 0.0 for value in _entry_values(entry)))
+
+    @classmethod
+    def from_document(cls, document: dict) -> "EntryAmounts":
+        return cls(*(document.get(field) or 0.0 for field in AMOUNT_FIELDS))
+
+
+_entry_values = attrgetter(*AMOUNT_FIELDS)
+
+
+class AmountColumns:
+    """Amounts of a sequence of entries, one float array per field."""
+
+    __slots__ = ("_columns",)
+
+    def __init__(self):
+        self._columns: Dict[str, array] = {field: array("d") for field in AMOUNT_FIELDS}
+
+    @classmethod
+    def from_entries(cls, entries: Iterable) -> "AmountColumns":
+        return cls._from_rows(map(_entry_values, entries))
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict]) -> "AmountColumns":
+        return cls._from_rows(tuple(map(document.get, AMOUNT_FIELDS)) for document in documents)
+
+    @classmethod
+    def _from_rows(cls, rows: Iterable[tuple]) -> "AmountColumns":
+        # One transposition for all fields instead of one append per value
+        columns = cls()
+        transposed = tuple(zip(*rows))
+        if transposed:
+            for column, values in zip(columns._columns.values(), transposed):
+                column.extend([value or 0.0 for value in values])
+        return columns
+
+    def append(self, amounts: EntryAmounts) -> None:
+        for column, value in zip(self._columns.values(), amounts):
+            column.append(value)
+
+    def extend(self, other: "AmountColumns") -> None:
+        for field, column in self._columns.items():
+            column.extend(other._columns[field])
+
+    def __len__(self) -> int:
+        return len(self._columns["daily_total"])
+
+    def column(self, field: str) -> array:
+        return self._columns[field]
+
+    def row(self, index: int) -> EntryAmounts:
+        return EntryAmounts(*(column[index] for column in self._columns.values()))
+
+    def __iter__(self) -> Iterator[EntryAmounts]:
+        return map(EntryAmounts._make, zip(*self._columns.values()))
+
+    def totals(self) -> Dict[str, float]:
+        """Sum of every field. Values are added in entry order, like a running accumulator."""
+        return {field: sum(column) for field, column in self._columns.items()}
@@ -0,0 +1,456 @@
+"""Per-user indexes over expense entries, maintained on every sheet write.
+
+An entry index is one document per user: a short record of each of the user's entries, the entry
+ids of each sheet and, per term, the ids of the entries with that term. What a record holds and
+which terms an entry has are up to the subclass of EntryIndexStore (see app.libs.expense_search
+and app.libs.expense_duplicates). The store listens to the repository (see
+ExpenseSheetRepository.add_listener); a missing or unreadable index is rebuilt from the user's
+sheets, found through the sheet catalog.
+
+Storage format of a user's index, like the sheet log (see app.libs.expense_storage):
+
+    {key_prefix}{user}.json        the index as of some revision of its log
+    {key_prefix}log_{user}.json    changes written since: the records of the changed entries and
+                                   the ids of the removed ones, per sheet
+
+An update only rewrites the log, so saving a sheet costs O(changed entries + log) instead of
+O(all of the user's entries). Every EXPENSE_ENTRY_INDEX_LOG_COMPACT_CHANGES changes the folded
+index is written and the log is truncated.
+
+Updates are not written by the sheet's writer: saves and deletes are queued and a background
+thread applies them after EXPENSE_ENTRY_INDEX_UPDATE_DELAY_SECONDS, one write per user for all the
+changes queued meanwhile. Reading a user's index first applies that user's queued changes, so a
+worker always sees its own writes; checks on the write path read the stored index and the queued
+changes side by side instead (see queued_records), so a request never writes an index itself. Changes still queued when a process dies are lost; the next
+change of the sheet re-indexes it, and a rebuild catches up everything else.
+"""
+
+import atexit
+import os
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from app.libs.expense_cache import SheetCache
+from app.libs.expense_catalog import SheetCatalog
+from app.libs.expense_storage import (
+    DEFAULT_WRITE_ATTEMPTS,
+    ExpenseSheetRepository,
+    RevisionConflictError,
+    SheetChangeListener,
+    StorageBackend,
+    document_revision,
+    list_key_ids,
+    read_versioned_document,
+    sanitize_storage_key,
+)
+from app.libs.storage_codec import get_codec
+
+INDEX_LOG_FORMAT_VERSION = 1
+# Changes kept in an index's log before they are folded into a new index document
+DEFAULT_INDEX_LOG_COMPACT_CHANGES = max(1, int(os.environ.get("EXPENSE_ENTRY_INDEX_LOG_COMPACT_CHANGES", "32")))
+# How long the background writer waits for more changes before writing the queued ones
+DEFAULT_INDEX_UPDATE_DELAY_SECONDS = float(os.environ.get("EXPENSE_ENTRY_INDEX_UPDATE_DELAY_SECONDS", "0.2"))
+
+
+class EntryIndex:
+    """In-memory form of one user's index document."""
+
+    def __init__(self, terms_of: Callable[[dict], Iterable[str]], document: Optional[dict] = None):
+        document = document or {}
+        self.terms_of = terms_of
+        self.entries: Dict[str, dict] = document.get("entries") or {}
+        self.sheets: Dict[str, dict] = document.get("sheets") or {}
+        self.terms: Dict[str, List[str]] = document.get("terms") or {}
+        # Revision of the index log whose changes the index includes
+        self.log_revision: int = document.get("log_revision") or 0
+        self._vocabulary: Optional[List[str]] = None
+
+    @property
+    def vocabulary(self) -> List[str]:
+        """The terms in order, for prefix lookups. Stored terms are already sorted (see
+        to_document), which sorting detects in linear time."""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.terms)
+        return self._vocabulary
+
+    def to_document(self, format_version: int, user_id: str, revision: int) -> dict:
+        return {
+            "format_version": format_version,
+            "revision": revision,
+            "user_id": user_id,
+            "log_revision": self.log_revision,
+            "entries": self.entries,
+            "sheets": self.sheets,
+            "terms": {term: self.terms[term] for term in sorted(self.terms)},
+        }
+
+    def _remove_entries(self, entry_ids: Iterable[str], sheet_id: Optional[str] = None) -> None:
+        """Unindexes entries; with sheet_id, only those still recorded in that sheet (an entry moved
+        to another sheet may already be indexed there)."""
+        removed: Dict[str, Set[str]] = {}
+        for entry_id in entry_ids:
+            record = self.entries.get(entry_id)
+            if record is None or (sheet_id is not None and record.get("sheet_id") != sheet_id):
+                continue
+            del self.entries[entry_id]
+            for term in set(self.terms_of(record)):
+                removed.setdefault(term, set()).add(entry_id)
+        for term, removed_ids in removed.items():
+            postings = [entry_id for entry_id in self.terms.get(term, []) if entry_id not in removed_ids]
+            if postings:
+                self.terms[term] = postings
+            else:
+                self.terms.pop(term, None)
+
+    def remove_sheet(self, sheet_id: str) -> None:
+        sheet = self.sheets.pop(sheet_id, None)
+        if sheet is None:
+            return
+        self._vocabulary = None
+        self._remove_entries(sheet["entry_ids"], sheet_id)
+
+    def add_sheet(self, sheet_id: str, revision: int, entries: Iterable[Tuple[str, dict]]) -> None:
+        """Indexes (entry_id, record) pairs as the entries of a sheet. Remove its previous entries first."""
+        self._vocabulary = None
+        entry_ids = []
+        for entry_id, record in entries:
+            entry_ids.append(entry_id)
+            self.entries[entry_id] = record
+            for term in set(self.terms_of(record)):
+                self.terms.setdefault(term, []).append(entry_id)
+        self.sheets[sheet_id] = {"revision": revision, "entry_ids": entry_ids}
+
+    def sheet_change(self, sheet_id: str, revision: int, entries: Optional[List[Tuple[str, dict]]]) -> Optional[dict]:
+        """The log change that re-indexes a sheet with entries ((entry_id, record) pairs), holding only
+        the records that differ from the indexed ones, or that removes the sheet when entries is None.
+        Returns None if there is nothing to change (e.g. a newer revision is already indexed).
+        """
+        current = self.sheets.get(sheet_id)
+        if entries is None:
+            return None if current is None else {"sheet_id": sheet_id, "deleted": True}
+        if current is not None and current["revision"] >= revision:
+            return None
+        records = dict(entries)
+        return {
+            "sheet_id": sheet_id,
+            "revision": revision,
+            "entries": {entry_id: record for entry_id, record in records.items() if self.entries.get(entry_id) != record},
+            "removed": [entry_id for entry_id in (current["entry_ids"] if current is not None else []) if entry_id not in records],
+        }
+
+    def apply_change(self, change: dict) -> None:
+        """Applies a log change (see sheet_change)."""
+        sheet_id = change["sheet_id"]
+        if change.get("deleted"):
+            self.remove_sheet(sheet_id)
+            return
+        self._vocabulary = None
+        current = self.sheets.get(sheet_id)
+        entry_ids = current["entry_ids"] if current is not None else []
+        removed = set(change["removed"])
+        self._remove_entries(removed, sheet_id)
+        # Previous records of the changed entries, wherever they were indexed
+        self._remove_entries(change["entries"])
+        for entry_id, record in change["entries"].items():
+            self.entries[entry_id] = record
+            for term in set(self.terms_of(record)):
+                self.terms.setdefault(term, []).append(entry_id)
+        known = set(entry_ids)
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id not in removed]
+        entry_ids.extend(entry_id for entry_id in change["entries"] if entry_id not in known)
+        self.sheets[sheet_id] = {"revision": change["revision"], "entry_ids": entry_ids}
+
+
+class EntryIndexStore(SheetChangeListener):
+    """Reads and maintains the per-user documents of one kind of entry index.
+
+    Updates append to the user's index log with compare-and-put on its revision and retries on
+    conflict. A sheet is only re-indexed from a newer sheet revision, so updates that arrive out of
+    order cannot undo each other. Reads go through the cache and updates write through it; updates
+    themselves always start from the stored documents.
+    """
+
+    key_prefix = "expense_entry_index_"
+    key_suffix = ".json"
+    format_version = 1
+    log_prefix = "[ENTRY_INDEX]"
+    # Prefix of the cache variables: <prefix>_MAX_ENTRIES, <prefix>_MAX_BYTES, <prefix>_TTL_SECONDS
+    cache_env_prefix = "EXPENSE_ENTRY_INDEX_CACHE"
+    # Entry fields entry_record reads
+    entry_fields: Tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        repository: ExpenseSheetRepository,
+        catalog: SheetCatalog,
+        cache: Optional[SheetCache] = None,
+        log_compact_changes: Optional[int] = None,
+        update_delay_seconds: float = DEFAULT_INDEX_UPDATE_DELAY_SECONDS,
+    ):
+        self.backend = backend
+        self.repository = repository
+        self.catalog = catalog
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.log_compact_changes = log_compact_changes or DEFAULT_INDEX_LOG_COMPACT_CHANGES
+        self.update_delay_seconds = update_delay_seconds
+        # Queued changes: {user_id: {sheet_id: (sheet revision, entries or None if deleted)}}
+        self._queued: Dict[str, Dict[str, Tuple[int, Optional[List[Tuple[str, dict]]]]]] = {}
+        self._queue_lock = threading.Lock()
+        # Serialise the updates of a user's index within this process, so a reader waits for them
+        self._user_locks = [threading.Lock() for _ in range(64)]
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    @classmethod
+    def from_env(cls, backend: StorageBackend, repository: ExpenseSheetRepository, catalog: SheetCatalog) -> "EntryIndexStore":
+        cache = SheetCache(
+            max_entries=int(os.environ.get(f"{cls.cache_env_prefix}_MAX_ENTRIES", "256")),
+            max_bytes=int(os.environ.get(f"{cls.cache_env_prefix}_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=float(os.environ.get(f"{cls.cache_env_prefix}_TTL_SECONDS", "30")),
+            name=cls.cache_env_prefix.lower(),
+        )
+        return cls(backend, repository, catalog, cache)
+
+    def entry_record(self, sheet_id: str, entry: dict) -> dict:
+        """Index record of one entry, from its JSON form. Holds the entry's "sheet_id"."""
+        raise NotImplementedError
+
+    def entry_terms(self, record: dict) -> Iterable[str]:
+        """Terms the entry of an index record is listed under."""
+        raise NotImplementedError
+
+    def storage_key(self, user_id: str) -> str:
+        return sanitize_storage_key(f"{self.key_prefix}{user_id}{self.key_suffix}")
+
+    def log_storage_key(self, user_id: str) -> str:
+        # Must not start with key_prefix, or the log would be listed as an index
+        return sanitize_storage_key(f"{self.key_prefix.rstrip('_')}log_{user_id}{self.key_suffix}")
+
+    def _read_index(self, user_id: str) -> Tuple[Optional[EntryIndex], Optional[int], Optional[dict], int]:
+        """Returns (index folded with its log, or None if missing or outdated; stored index revision for
+        compare-and-put; stored log, holding only the changes not yet in the index; stored size)."""
+        key, log_key = self.storage_key(user_id), self.log_storage_key(user_id)
+        raw, raw_log = self.backend.get(key), self.backend.get(log_key)
+        document, revision = read_versioned_document(self.backend, key, self.format_version, raw)
+        log, log_revision = read_versioned_document(self.backend, log_key, INDEX_LOG_FORMAT_VERSION, raw_log)
+        if log is None and log_revision is not None:
+            # Of another format: kept as an empty log at its revision, which the rebuild's truncation replaces
+            log = {"format_version": INDEX_LOG_FORMAT_VERSION, "revision": log_revision, "user_id": user_id, "changes": []}
+            return None, revision, log, 0
+        if document is None or (log is None and raw_log):
+            # Missing, outdated or unreadable (an unreadable log took changes not yet in the index with it)
+            return None, revision, log, 0
+        index = EntryIndex(self.entry_terms, document)
+        size = len(raw) if isinstance(raw, (str, bytes)) else len(get_codec().encode(document))
+        if log is not None:
+            log = {**log, "changes": [change for change in log["changes"] if change["log_revision"] > index.log_revision]}
+            for change in log["changes"]:
+                index.apply_change(change)
+            index.log_revision = max(index.log_revision, document_revision(log))
+            size += len(raw_log) if isinstance(raw_log, (str, bytes)) else len(get_codec().encode(log))
+        return index, revision, log, size
+
+    def _write_index(self, user_id: str, index: EntryIndex, expected_revision: Optional[int]) -> bool:
+        key = self.storage_key(user_id)
+        if not index.sheets:
+            written = expected_revision is None or self.backend.compare_and_delete(key, expected_revision)
+            if written and self.cache is not None:
+                self.cache.invalidate(user_id)
+            return written
+        document = index.to_document(self.format_version, user_id, (expected_revision or 0) + 1)
+        if not self.backend.compare_and_put(key, document, expected_revision):
+            return False
+        if self.cache is not None:
+            self.cache.put(user_id, EntryIndex(self.entry_terms, document), len(get_codec().encode(document)))
+        return True
+
+    def _truncate_log(self, user_id: str, log: Optional[dict], index: EntryIndex) -> None:
+        """Drops the changes of log once index, which includes them, is stored; deletes the log with
+        an empty index. May lose a race with a writer appending to the log; the folded index is
+        correct either way."""
+        if log is None:
+            return
+        log_key = self.log_storage_key(user_id)
+        if not index.sheets:
+            self.backend.compare_and_delete(log_key, document_revision(log))
+        else:
+            self.backend.compare_and_put(log_key, {**log, "changes": []}, document_revision(log))
+
+    def _build_index(self, documents: Iterable[dict]) -> EntryIndex:
+        index = EntryIndex(self.entry_terms)
+        for document in documents:
+            index.add_sheet(document["id"], document.get("revision") or 0, (
+                (entry["id"], self.entry_record(document["id"], entry)) for entry in document.get("entries") or []
+            ))
+        return index
+
+    def _user_documents(self, user_id: str) -> List[dict]:
+        """The stored sheets of one user, found through the sheet catalog, which already reflects
+        the writes being indexed: the catalog is notified first."""
+        records, _ = self.catalog.query(user_id=user_id)
+        return self.repository.get_documents([record["id"] for record in records])
+
+    def load(self, user_id: str, flush: bool = True) -> EntryIndex:
+        """The user's index for reading, including the changes queued so far; not to be modified.
+        With flush=False the queued changes are left to the background writer and not included."""
+        if flush:
+            self.flush(user_id)
+        index = self.cache.get(user_id) if self.cache is not None else None
+        if index is None:
+            index, _, _, size = self._read_index(user_id)
+            if index is not None and self.cache is not None:
+                self.cache.put(user_id, index, size)
+        if index is None:
+            index = self._build_index(self._user_documents(user_id))
+        return index
+
+    def _apply(self, user_id: str, sheets: Dict[str, Tuple[int, Optional[List[Tuple[str, dict]]]]]) -> None:
+        """Re-indexes sheets ({sheet_id: (revision, entries)}, entries as (entry_id, record) pairs;
+        None removes the sheet) with one write of the user's index log."""
+        log_key = self.log_storage_key(user_id)
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            index, stored_revision, log, size = self._read_index(user_id)
+            if index is None:
+                # Missing or unreadable: rebuilt from storage, which already holds these changes
+                print(f"{self.log_prefix} Rebuilding the index of user {user_id} from storage.")
+                index = self._build_index(self._user_documents(user_id))
+                index.log_revision = document_revision(log) or 0
+                if self._write_index(user_id, index, stored_revision):
+                    self._truncate_log(user_id, log, index)
+                    return
+                continue
+            changes = [
+                change for change in (index.sheet_change(sheet_id, revision, entries) for sheet_id, (revision, entries) in sheets.items())
+                if change is not None
+            ]
+            if not changes:
+                return
+            log_revision = index.log_revision + 1
+            changes = [{**change, "log_revision": log_revision} for change in changes]
+            new_log = {
+                "format_version": INDEX_LOG_FORMAT_VERSION,
+                "revision": log_revision,
+                "user_id": user_id,
+                "changes": (log["changes"] if log is not None else []) + changes,
+            }
+            if not self.backend.compare_and_put(log_key, new_log, document_revision(log)):
+                continue
+            for change in changes:
+                index.apply_change(change)
+            index.log_revision = log_revision
+            if len(new_log["changes"]) >= self.log_compact_changes or not index.sheets:
+                self._compact(user_id, index, stored_revision, new_log)
+            elif self.cache is not None:
+                self.cache.put(user_id, index, size + len(get_codec().encode(new_log)))
+            return
+        raise RevisionConflictError(log_key, None)
+
+    def _compact(self, user_id: str, index: EntryIndex, stored_revision: Optional[int], log: dict) -> None:
+        """Writes the index folded with log, then truncates the log."""
+        try:
+            if self._write_index(user_id, index, stored_revision):
+                self._truncate_log(user_id, log, index)
+            elif self.cache is not None:
+                self.cache.invalidate(user_id)
+        except Exception as e:
+            # The changes are already committed in the log; compaction is retried by the next update
+            print(f"{self.log_prefix} Compacting the index log of user {user_id} failed: {e}")
+            if self.cache is not None:
+                self.cache.invalidate(user_id)
+
+    def _queue(self, user_id: str, sheet_id: str, revision: int, entries: Optional[List[Tuple[str, dict]]]) -> None:
+        with self._queue_lock:
+            sheets = self._queued.setdefault(user_id, {})
+            queued = sheets.get(sheet_id)
+            if entries is None or queued is None or (queued[1] is not None and queued[0] < revision):
+                sheets[sheet_id] = (revision, entries)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name=f"{type(self).__name__.lower()}-writer", daemon=True)
+                self._writer.start()
+        self._wake.set()
+
+    def _run_writer(self) -> None:
+        while True:
+            self._wake.wait()
+            # Let the writes that follow queue up, so they share one index write
+            time.sleep(self.update_delay_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def queued_records(self, user_id: str) -> Tuple[Set[str], Dict[str, dict]]:
+        """The user's changes not yet written: the ids of the sheets they re-index or remove, and the
+        records of those sheets' entries. Waits for changes being written, so every change is either
+        here or in the stored index."""
+        with self._user_lock(user_id):
+            with self._queue_lock:
+                sheets = dict(self._queued.get(user_id) or {})
+        records = {entry_id: record for _, entries in sheets.values() if entries is not None for entry_id, record in entries}
+        return set(sheets), records
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        return self._user_locks[zlib.crc32(user_id.encode()) % len(self._user_locks)]
+
+    def flush(self, user_id: Optional[str] = None) -> None:
+        """Applies the queued changes of one user (all users if None) now, and waits for those already
+        being applied. Failures are logged; the index is then behind until the sheet is written again
+        or the indexes are rebuilt."""
+        with self._queue_lock:
+            user_ids = [user_id] if user_id is not None else list(self._queued)
+        for queued_user_id in user_ids:
+            with self._user_lock(queued_user_id):
+                with self._queue_lock:
+                    sheets = self._queued.pop(queued_user_id, None)
+                if not sheets:
+                    continue
+                try:
+                    self._apply(queued_user_id, sheets)
+                except Exception as e:
+                    print(f"{self.log_prefix} Updating the index of user {queued_user_id} failed: {e}")
+
+    def sheet_saved(self, sheet: BaseModel) -> None:
+        if sheet.user_id:
+            fields = set(self.entry_fields)
+            entries = [(entry.id, self.entry_record(sheet.id, entry.model_dump(mode='json', include=fields))) for entry in sheet.entries]
+            self._queue(sheet.user_id, sheet.id, sheet.revision, entries)
+
+    def sheet_deleted(self, sheet_id: str, snapshot: Optional[dict] = None) -> None:
+        if snapshot is None:
+            print(f"{self.log_prefix} Owner of deleted sheet {sheet_id} is unknown; run a rebuild to drop it from the index.")
+            return
+        if snapshot.get("user_id"):
+            self._queue(snapshot["user_id"], sheet_id, 0, None)
+
+    def list_user_ids(self) -> List[str]:
+        """Users with an index document (the sanitized user id of each key)."""
+        return list_key_ids(self.backend, self.key_prefix, self.key_suffix)
+
+    def rebuild(self) -> int:
+        """Rebuilds every index from a full scan of the stored sheets. Returns the number of users."""
+        print(f"{self.log_prefix} Rebuilding indexes from a full storage scan...")
+        users: Dict[str, List[dict]] = {}
+        for document in self.repository.get_documents(self.repository.list_sheet_ids()):
+            if document.get("user_id"):
+                users.setdefault(document["user_id"], []).append(document)
+        stale_user_ids = set(self.list_user_ids()) - {sanitize_storage_key(user_id) for user_id in users}
+        for user_id, documents in users.items():
+            self._replace(user_id, self._build_index(documents))
+        for user_id in stale_user_ids:
+            self._replace(user_id, EntryIndex(self.entry_terms))
+        print(f"{self.log_prefix} Indexes rebuilt for {len(users)} users.")
+        return len(users)
+
+    def _replace(self, user_id: str, index: EntryIndex) -> None:
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            _, stored_revision, log, _ = self._read_index(user_id)
+            # The log's changes are older than the sheets just read
+            index.log_revision = document_revision(log) or 0
+            if self._write_index(user_id, index, stored_revision):
+                self._truncate_log(user_id, log, index)
+                return
+        raise RevisionConflictError(self.storage_key(user_id), None)
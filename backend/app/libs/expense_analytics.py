@@ -0,0 +1,242 @@
+"""Columnar analytics over the entries of many expense sheets.
+
+Each sheet is converted once into an EntryBlock: its amount fields as a float64 matrix, its entry
+dates as day numbers and every grouping dimension as integer codes plus their labels. Blocks are
+cached per sheet and revision, so a query only concatenates the blocks of the matching sheets,
+filters them with boolean masks and sums every amount column per group with np.bincount, without
+building models or per-entry Python objects. Sheets whose catalog record shows no entry in the
+date range are skipped without being read:
+
+    analytics = ExpenseAnalytics(repository)
+    result = analytics.aggregate(catalog_records, group_by=["company", "month"], date_from=..., date_to=...)
+
+Dimensions: user, company, project, location, month (YYYY-MM of the entry date) and currency.
+Entries without a date count as the first day of their sheet's month.
+
+Configuration (environment variables):
+
+    EXPENSE_ANALYTICS_CACHE_MAX_ENTRIES   default 4096 sheets, 0 disables the cache
+    EXPENSE_ANALYTICS_CACHE_MAX_BYTES     default 256 MiB
+"""
+
+import datetime
+import operator
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.libs import metrics
+from app.libs.entry_amounts import AMOUNT_FIELDS
+from app.libs.expense_cache import SheetCache
+from app.libs.expense_storage import DEFAULT_FETCH_CONCURRENCY, ExpenseSheetRepository, parallel_map
+
+DIMENSIONS = ("user", "company", "project", "location", "month", "currency")
+# Entry fields that hold the entry-level dimensions
+_ENTRY_DIMENSION_FIELDS = {"company": "company", "project": "project", "location": "location"}
+# Every entry field a block is built from, read in one call per entry
+_COLUMN_FIELDS = (*AMOUNT_FIELDS, "entry_date", *_ENTRY_DIMENSION_FIELDS.values())
+_read_columns = operator.itemgetter(*_COLUMN_FIELDS)
+
+
+class EntryBlock:
+    """Columns of the entries of one sheet revision."""
+
+    __slots__ = ("revision", "amounts", "days", "codes", "labels")
+
+    def __init__(self, revision: int, amounts: np.ndarray, days: np.ndarray, codes: Dict[str, np.ndarray], labels: Dict[str, List[Optional[str]]]):
+        self.revision = revision
+        self.amounts = amounts  # shape (len(AMOUNT_FIELDS), entries)
+        self.days = days  # proleptic Gregorian ordinal of each entry date
+        self.codes = codes  # dimension -> index into labels[dimension], one per entry
+        self.labels = labels
+
+    @property
+    def nbytes(self) -> int:
+        return self.amounts.nbytes + self.days.nbytes + sum(codes.nbytes for codes in self.codes.values())
+
+
+def _encode(values: List[Optional[str]]) -> tuple:
+    """Returns (codes, labels) for a list of dimension values."""
+    labels = list(dict.fromkeys(values))
+    positions = {label: position for position, label in enumerate(labels)}
+    return np.fromiter(map(positions.__getitem__, values), dtype=np.int32, count=len(values)), labels
+
+def build_entry_block(document: dict) -> EntryBlock:
+    """Converts a stored sheet document (see ExpenseSheetRepository.get_document) into columns."""
+    entries = document.get("entries") or []
+    count = len(entries)
+    # One pass over the entries, then transposed into one tuple per field
+    try:
+        rows = list(map(_read_columns, entries))
+    except KeyError:  # Documents written before a field existed
+        rows = [tuple(map(entry.get, _COLUMN_FIELDS)) for entry in entries]
+    columns = list(zip(*rows)) if rows else [()] * len(_COLUMN_FIELDS)
+    amount_count = len(AMOUNT_FIELDS)
+    # None becomes NaN in a float array; missing amounts count as 0.0
+    amounts = np.array(columns[:amount_count], dtype=np.float64).reshape(amount_count, count)
+    np.nan_to_num(amounts, copy=False)
+
+    try:
+        default_date = datetime.date(int(document.get("year")), int(document.get("month")), 1).isoformat()
+    except (TypeError, ValueError):
+        default_date = datetime.date.min.isoformat()
+    # Dates are parsed once per distinct date
+    date_codes, dates = _encode([str(date)[:10] if date else default_date for date in columns[amount_count]])
+    ordinals = []
+    for date in dates:
+        try:
+            ordinals.append(datetime.date.fromisoformat(date).toordinal())
+        except ValueError:
+            ordinals.append(datetime.date.fromisoformat(default_date).toordinal())
+    days = np.array(ordinals, dtype=np.int32)[date_codes]
+
+    codes: Dict[str, np.ndarray] = {}
+    labels: Dict[str, List[Optional[str]]] = {}
+    for position, dimension in enumerate(_ENTRY_DIMENSION_FIELDS, start=amount_count + 1):
+        codes[dimension], labels[dimension] = _encode([value or None for value in columns[position]])
+    month_codes, labels["month"] = _encode([date[:7] for date in dates])
+    codes["month"] = month_codes[date_codes]
+    for dimension, value in (("user", document.get("user_id")), ("currency", document.get("currency"))):
+        codes[dimension], labels[dimension] = np.zeros(count, dtype=np.int32), [value]
+    return EntryBlock(document.get("revision") or 0, amounts, days, codes, labels)
+
+
+class ExpenseAnalytics:
+    def __init__(self, repository: ExpenseSheetRepository, cache: Optional[SheetCache] = None, max_workers: int = DEFAULT_FETCH_CONCURRENCY):
+        self.repository = repository
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.max_workers = max_workers
+
+    @classmethod
+    def from_env(cls, repository: ExpenseSheetRepository) -> "ExpenseAnalytics":
+        cache = SheetCache(
+            max_entries=int(os.environ.get("EXPENSE_ANALYTICS_CACHE_MAX_ENTRIES", "4096")),
+            max_bytes=int(os.environ.get("EXPENSE_ANALYTICS_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+            # Blocks are checked against the sheet revision, so they never go stale
+            ttl_seconds=float("inf"),
+            name="analytics_cache",
+        )
+        return cls(repository, cache)
+
+    def _load_block(self, sheet_id: str) -> Optional[EntryBlock]:
+        try:
+            document = self.repository.get_document(sheet_id)
+        except Exception as e:
+            print(f"[EXPENSE_ANALYTICS] Error loading expense sheet {sheet_id}: {e}")
+            return None
+        if document is None:
+            return None
+        block = build_entry_block(document)
+        if self.cache is not None:
+            self.cache.put(sheet_id, block, block.nbytes)
+        return block
+
+    @staticmethod
+    def _in_date_range(record: dict, date_from: Optional[datetime.date], date_to: Optional[datetime.date]) -> bool:
+        """False if the record's entry_date_range (see app.libs.expense_catalog) shows no entry in
+        the range; sheets without one are read."""
+        if "entry_date_range" not in record:
+            return True
+        if record["entry_date_range"] is None:
+            return False  # No entries
+        first, last = record["entry_date_range"]
+        return (date_from is None or last >= date_from.isoformat()) and (date_to is None or first <= date_to.isoformat())
+
+    def load_blocks(self, sheet_records: List[dict]) -> List[EntryBlock]:
+        """Returns the blocks of the given catalog records, loading those not cached at their revision in parallel."""
+        blocks: Dict[str, EntryBlock] = {}
+        missing_sheet_ids = []
+        for record in sheet_records:
+            block = self.cache.get(record["id"]) if self.cache is not None else None
+            if block is not None and block.revision == record.get("revision"):
+                blocks[record["id"]] = block
+            else:
+                missing_sheet_ids.append(record["id"])
+        if missing_sheet_ids:
+            blocks.update(zip(missing_sheet_ids, parallel_map(self._load_block, missing_sheet_ids, self.max_workers, "analytics-fetch")))
+        return [blocks[record["id"]] for record in sheet_records if blocks.get(record["id"]) is not None]
+
+    def aggregate(
+        self,
+        sheet_records: List[dict],
+        group_by: Sequence[str] = (),
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+        filters: Optional[Dict[str, str]] = None,
+    ) -> dict:
+        """Sums every amount field over the entries of the given sheets, per combination of the
+        group_by dimensions. Entries outside [date_from, date_to] or not matching filters
+        ({dimension: value}) are left out.
+
+        Returns {"sheet_count", "entry_count", "totals", "groups"}; sheet_count is the number of sheets
+        read, those that may have entries in the date range. Each group has "key" ({dimension: label}),
+        "entry_count" and "totals" ({amount field: sum}), ordered by key.
+        """
+        unknown_dimensions = [dimension for dimension in [*group_by, *(filters or {})] if dimension not in DIMENSIONS]
+        if unknown_dimensions:
+            raise ValueError(f"Unknown analytics dimensions: {unknown_dimensions}. Expected some of {list(DIMENSIONS)}.")
+        started = time.monotonic()
+        if date_from is not None or date_to is not None:
+            sheet_records = [record for record in sheet_records if self._in_date_range(record, date_from, date_to)]
+        loaded_blocks = self.load_blocks(sheet_records)
+        # An empty block keeps every concatenation below well defined when no sheet matches
+        blocks = loaded_blocks or [build_entry_block({})]
+        loaded = time.monotonic()
+
+        amounts = np.concatenate([block.amounts for block in blocks], axis=1)
+        mask = np.ones(amounts.shape[1], dtype=bool)
+        if date_from is not None or date_to is not None:
+            days = np.concatenate([block.days for block in blocks])
+            if date_from is not None:
+                mask &= days >= date_from.toordinal()
+            if date_to is not None:
+                mask &= days <= date_to.toordinal()
+        for dimension, value in (filters or {}).items():
+            # Per block, a lookup table from local code to "label matches"
+            mask &= np.concatenate([
+                np.array([label == value for label in block.labels[dimension]], dtype=bool)[block.codes[dimension]]
+                for block in blocks
+            ])
+
+        group_labels: List[List[Optional[str]]] = []
+        group_codes = []
+        for dimension in group_by:
+            positions: Dict[Optional[str], int] = {}
+            parts = []
+            for block in blocks:
+                # Local codes are translated to codes shared by all blocks
+                translation = np.array([positions.setdefault(label, len(positions)) for label in block.labels[dimension]], dtype=np.int32)
+                parts.append(translation[block.codes[dimension]])
+            group_codes.append(np.concatenate(parts)[mask])
+            group_labels.append(list(positions))
+
+        amounts = amounts[:, mask]
+        entry_count = amounts.shape[1]
+        if group_codes and entry_count:
+            unique_keys, inverse = np.unique(np.stack(group_codes, axis=1), axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            unique_keys, inverse = np.zeros((1 if entry_count else 0, 0), dtype=np.int32), np.zeros(entry_count, dtype=np.intp)
+        group_count = len(unique_keys)
+        counts = np.bincount(inverse, minlength=group_count)
+        sums = [np.bincount(inverse, weights=column, minlength=group_count) for column in amounts]
+
+        groups = [
+            {
+                "key": {dimension: group_labels[position][code] for position, (dimension, code) in enumerate(zip(group_by, key))},
+                "entry_count": int(counts[index]),
+                "totals": {field: float(sums[field_index][index]) for field_index, field in enumerate(AMOUNT_FIELDS)},
+            }
+            for index, key in enumerate(unique_keys.tolist())
+        ]
+        groups.sort(key=lambda group: tuple(label or "" for label in group["key"].values()))
+        metrics.observe("expense_analytics.load_seconds", loaded - started)
+        metrics.observe("expense_analytics.aggregate_seconds", time.monotonic() - loaded)
+        return {
+            "sheet_count": len(loaded_blocks),
+            "entry_count": entry_count,
+            "totals": {field: float(column.sum()) for field, column in zip(AMOUNT_FIELDS, amounts)},
+            "groups": groups,
+        }
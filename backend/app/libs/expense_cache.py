@@ -0,0 +1,101 @@
+"""Bounded in-process LRU cache of parsed expense sheets.
+
+The repository reads through the cache and writes through it on every save, so repeated reads
+of a sheet while it is being edited skip both the storage round-trip and the Pydantic parse.
+Entries expire after a TTL because other workers may write the same sheet.
+
+Configuration (environment variables):
+
+    EXPENSE_SHEET_CACHE_MAX_ENTRIES   default 256, 0 disables the cache
+    EXPENSE_SHEET_CACHE_MAX_BYTES     default 64 MiB (measured as encoded JSON size)
+    EXPENSE_SHEET_CACHE_TTL_SECONDS   default 30
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from app.libs import metrics
+
+
+class SheetCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, name: str = "sheet_cache"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        # sheet_id -> (sheet, size_bytes, expires_at), least recently used first
+        self._items: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "SheetCache":
+        return cls(
+            max_entries=int(os.environ.get("EXPENSE_SHEET_CACHE_MAX_ENTRIES", "256")),
+            max_bytes=int(os.environ.get("EXPENSE_SHEET_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=float(os.environ.get("EXPENSE_SHEET_CACHE_TTL_SECONDS", "30")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, sheet_id: str) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(sheet_id)
+            if item is not None and item[2] <= time.monotonic():
+                self._remove_locked(sheet_id)
+                item = None
+            if item is None:
+                self.misses += 1
+                metrics.increment(f"{self.name}.misses")
+                return None
+            self._items.move_to_end(sheet_id)
+            self.hits += 1
+            metrics.increment(f"{self.name}.hits")
+            return item[0]
+
+    def put(self, sheet_id: str, sheet: Any, size_bytes: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remove_locked(sheet_id)
+            if size_bytes > self.max_bytes:
+                return
+            self._items[sheet_id] = (sheet, size_bytes, time.monotonic() + self.ttl_seconds)
+            self._bytes += size_bytes
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_id = next(iter(self._items))
+                self._remove_locked(oldest_id)
+                self.evictions += 1
+                metrics.increment(f"{self.name}.evictions")
+
+    def invalidate(self, sheet_id: str) -> None:
+        with self._lock:
+            self._remove_locked(sheet_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def _remove_locked(self, sheet_id: str) -> None:
+        item = self._items.pop(sheet_id, None)
+        if item is not None:
+            self._bytes -= item[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
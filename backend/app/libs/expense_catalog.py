@@ -0,0 +1,320 @@
+"""Catalog of sheet-level fields for every expense sheet, sharded by owner.
+
+The catalog lets the dashboard list sheets with one storage read instead of listing the whole
+bucket and downloading every sheet. Each user has one shard document with the records of their
+sheets, so listing a user's sheets reads one shard and saving a sheet rewrites only its owner's
+shard; writers of different users never contend for the same document. A small directory
+document lists the users with a shard, for listings across all users. The catalog is maintained
+by the repository on every save/delete (see ExpenseSheetRepository.add_listener) and rebuilt from
+a full scan when missing or unreadable.
+
+Rebuild the catalog from the stored sheets:
+
+    python -m app.libs.expense_catalog --rebuild
+"""
+
+import argparse
+import base64
+import datetime
+import heapq
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.libs.expense_storage import (
+    DEFAULT_WRITE_ATTEMPTS,
+    ExpenseSheetRepository,
+    RevisionConflictError,
+    SheetChangeListener,
+    StorageBackend,
+    parallel_map,
+    read_versioned_document,
+    sanitize_storage_key,
+)
+
+CATALOG_KEY_PREFIX = "expense_catalog_user_"
+CATALOG_KEY_SUFFIX = ".json"
+CATALOG_DIRECTORY_KEY = "expense_catalog_users.json"
+CATALOG_FORMAT_VERSION = 1
+
+# Sheet-level fields copied into each catalog record
+CATALOG_FIELDS = (
+    "id", "user_id", "name", "month", "year", "status", "currency", "payment_method_filter",
+    "total_amount", "subtotals", "entry_count", "revision", "created_at", "updated_at",
+)
+
+
+def catalog_record(sheet: BaseModel) -> dict:
+    record = sheet.model_dump(mode='json', include=set(CATALOG_FIELDS))
+    record["entry_date_range"] = _entry_date_range(sheet)
+    return record
+
+def _entry_date_range(sheet: BaseModel) -> Optional[List[str]]:
+    """[first, last] entry date of the sheet (ISO), so reports by date can skip sheets without reading
+    them (see app.libs.expense_analytics). As there, entries without a date count as the first day
+    of the sheet's month. None for a sheet without entries."""
+    if not sheet.entries:
+        return None
+    try:
+        default_date = datetime.date(sheet.year, sheet.month, 1)
+    except (TypeError, ValueError):
+        default_date = datetime.date.min
+    dates = [entry.entry_date or default_date for entry in sheet.entries]
+    return [min(dates).isoformat(), max(dates).isoformat()]
+
+def get_catalog_shard_key(owner: str) -> str:
+    return sanitize_storage_key(f"{CATALOG_KEY_PREFIX}{owner}{CATALOG_KEY_SUFFIX}")
+
+def _owner(record: dict) -> str:
+    """Shard of a sheet record or document: its sanitized user id, or "" for sheets without an owner."""
+    return sanitize_storage_key(record.get("user_id") or "")
+
+
+class InvalidCursorError(ValueError):
+    """The pagination cursor was not produced by encode_cursor."""
+
+
+def _sort_key(record: dict) -> Tuple[str, str]:
+    # updated_at is stored as an ISO-8601 string, which sorts chronologically
+    return (record.get("updated_at") or "", record["id"])
+
+def encode_cursor(record: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(_sort_key(record)).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        updated_at, sheet_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (str(updated_at), str(sheet_id))
+    except Exception as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+def _position(records: List[dict], key: Tuple[str, str]) -> int:
+    """Index of the first record sorting after key, in records kept in pagination order
+    ((updated_at, id) descending): where a page after key starts and where a record with key goes."""
+    low, high = 0, len(records)
+    while low < high:
+        middle = (low + high) // 2
+        if _sort_key(records[middle]) < key:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+class SheetCatalog(SheetChangeListener):
+    """Reads and maintains the catalog shards and their directory.
+
+    Updates are read-modify-write of one shard; they use compare-and-put on the shard's revision
+    and are retried on conflict, so concurrent writers do not lose each other's changes. A shard
+    keeps its records in pagination order, so a page is read off it without sorting. The
+    directory is only written when a user gets their first shard. A user listed in the directory
+    always has a shard, so a missing shard of a listed user means the catalog must be rebuilt.
+    """
+
+    def __init__(self, backend: StorageBackend, repository: ExpenseSheetRepository):
+        self.backend = backend
+        self.repository = repository
+
+    def _read_document(self, key: str) -> Tuple[Optional[dict], Optional[int]]:
+        """Returns (current-format document or None, stored revision for compare-and-put)."""
+        return read_versioned_document(self.backend, key, CATALOG_FORMAT_VERSION)
+
+    def _write_shard(self, owner: str, records: List[dict], expected_revision: Optional[int]) -> bool:
+        """Writes a shard (records in pagination order) if its revision is still expected_revision.
+        Returns False on conflict."""
+        document = {"format_version": CATALOG_FORMAT_VERSION, "revision": (expected_revision or 0) + 1, "user_id": owner, "sheets": records}
+        return self.backend.compare_and_put(get_catalog_shard_key(owner), document, expected_revision)
+
+    def _write_directory(self, owners: List[str], expected_revision: Optional[int]) -> bool:
+        document = {"format_version": CATALOG_FORMAT_VERSION, "revision": (expected_revision or 0) + 1, "user_ids": sorted(owners)}
+        return self.backend.compare_and_put(CATALOG_DIRECTORY_KEY, document, expected_revision)
+
+    def _replace(self, key: str, write) -> None:
+        """Writes a document over whatever revision is stored (used by rebuilds)."""
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            if write(self._read_document(key)[1]):
+                return
+        raise RevisionConflictError(key, None)
+
+    def rebuild(self) -> int:
+        """Rebuilds the catalog from a full storage scan. Returns the number of catalogued sheets."""
+        print("[EXPENSE_CATALOG] Rebuilding sheet catalog from a full storage scan...")
+        shards: Dict[str, List[dict]] = {}
+        for sheet in self.repository.list_all():
+            record = catalog_record(sheet)
+            shards.setdefault(_owner(record), []).append(record)
+        for records in shards.values():
+            records.sort(key=_sort_key, reverse=True)
+        directory, _ = self._read_document(CATALOG_DIRECTORY_KEY)
+        stale_owners = set(directory["user_ids"] if directory is not None else ()) - set(shards)
+        # Shards first: a user listed in the directory must have one
+        for owner, records in shards.items():
+            self._replace(get_catalog_shard_key(owner), lambda revision, owner=owner, records=records: self._write_shard(owner, records, revision))
+        self._replace(CATALOG_DIRECTORY_KEY, lambda revision: self._write_directory(list(shards), revision))
+        for owner in stale_owners:
+            self._delete_quietly(get_catalog_shard_key(owner))
+        count = sum(len(records) for records in shards.values())
+        print(f"[EXPENSE_CATALOG] Sheet catalog rebuilt with {count} sheets of {len(shards)} users.")
+        return count
+
+    def _delete_quietly(self, key: str) -> None:
+        try:
+            if self.backend.get(key) is not None:
+                self.backend.delete(key)
+        except Exception as e:
+            print(f"[EXPENSE_CATALOG] Could not delete {key}: {e}")
+
+    def _load_directory(self) -> dict:
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            directory, _ = self._read_document(CATALOG_DIRECTORY_KEY)
+            if directory is not None:
+                return directory
+            self.rebuild()
+        raise RevisionConflictError(CATALOG_DIRECTORY_KEY, None)
+
+    def _load_shard(self, owner: str) -> List[dict]:
+        """The records of one shard, in pagination order; a user without one has no sheets."""
+        key = get_catalog_shard_key(owner)
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            shard, revision = self._read_document(key)
+            if shard is not None:
+                return shard["sheets"]
+            directory, _ = self._read_document(CATALOG_DIRECTORY_KEY)
+            if directory is not None and revision is None and owner not in directory["user_ids"]:
+                return []
+            # No catalog yet, or an outdated or lost shard
+            self.rebuild()
+        raise RevisionConflictError(key, None)
+
+    def list_user_ids(self) -> List[str]:
+        """Users with sheets in the catalog (their sanitized ids), from the directory (a single read)."""
+        return [owner for owner in self._load_directory()["user_ids"] if owner]
+
+    def _ordered_records(self, user_id: Optional[str], after: Optional[Tuple[str, str]] = None) -> Iterable[dict]:
+        """Records of one user's sheets (one shard read), or of every sheet (the shards merged), in
+        pagination order and starting after the cursor position after."""
+        if user_id is not None:
+            shards = [self._load_shard(_owner({"user_id": user_id}))]
+        else:
+            owners = self._load_directory()["user_ids"]
+            if not owners:
+                return []
+            shards = parallel_map(self._load_shard, owners, thread_name_prefix="catalog-fetch")
+        if after is not None:
+            shards = [records[_position(records, after):] for records in shards]
+        return shards[0] if len(shards) == 1 else heapq.merge(*shards, key=_sort_key, reverse=True)
+
+    def list_records(self, user_id: Optional[str] = None) -> List[dict]:
+        """Returns the catalog records of one user's sheets (one shard read), or of every sheet,
+        most recently updated first."""
+        return [record for record in self._ordered_records(user_id) if user_id is None or record.get("user_id") == user_id]
+
+    def query(
+        self,
+        user_id: Optional[str] = None,
+        year: Optional[int] = None,
+        month: Optional[int] = None,
+        status: Optional[str] = None,
+        payment_method_filter: Optional[str] = None,
+        currency: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Filters the catalog and returns one page of records, most recently updated first.
+
+        Ordering is by (updated_at, id) descending, so it is stable across pages; the returned cursor
+        is None on the last page. Filters left as None are not applied; with a user_id only that
+        user's shard is read.
+        """
+        filters = {
+            "user_id": user_id, "year": year, "month": month, "status": status,
+            "payment_method_filter": payment_method_filter, "currency": currency,
+        }
+        active_filters = [(field, value) for field, value in filters.items() if value is not None]
+        after = decode_cursor(cursor) if cursor else None
+
+        # The records come in page order, so the scan stops one record past the page
+        matches = []
+        for record in self._ordered_records(user_id, after):
+            if all(record.get(field) == value for field, value in active_filters):
+                matches.append(record)
+                if limit is not None and len(matches) > limit:
+                    break
+        if limit is None or len(matches) <= limit:
+            return matches, None
+        page = matches[:limit]
+        return page, encode_cursor(page[-1])
+
+    def _add_to_directory(self, owner: str) -> None:
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            directory, revision = self._read_document(CATALOG_DIRECTORY_KEY)
+            if directory is None:
+                self.rebuild()
+                return
+            if owner in directory["user_ids"]:
+                return
+            if self._write_directory(directory["user_ids"] + [owner], revision):
+                return
+        raise RevisionConflictError(CATALOG_DIRECTORY_KEY, None)
+
+    def _apply(self, owner: str, sheet_id: str, record: Optional[dict]) -> None:
+        key = get_catalog_shard_key(owner)
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            shard, revision = self._read_document(key)
+            if shard is None:
+                directory, _ = self._read_document(CATALOG_DIRECTORY_KEY)
+                if directory is None or revision is not None or owner in directory["user_ids"]:
+                    # No catalog yet, or an outdated or lost shard: the rebuild already reflects this change
+                    self.rebuild()
+                    return
+                if record is None:
+                    return
+                records = []
+            else:
+                records = shard["sheets"]
+            current = next((index for index, existing in enumerate(records) if existing["id"] == sheet_id), None)
+            if current is None and record is None:
+                return
+            if current is not None and record is not None and records[current].get("revision", 0) > record.get("revision", 0):
+                return  # A newer revision of this sheet was already catalogued
+            if current is not None:
+                del records[current]
+            if record is not None:
+                records.insert(_position(records, _sort_key(record)), record)
+            if self._write_shard(owner, records, revision):
+                if shard is None:
+                    self._add_to_directory(owner)
+                return
+        raise RevisionConflictError(key, None)
+
+    def sheet_saved(self, sheet: BaseModel) -> None:
+        record = catalog_record(sheet)
+        self._apply(_owner(record), sheet.id, record)
+
+    def sheet_deleted(self, sheet_id: str, snapshot: Optional[dict] = None) -> None:
+        # Without a snapshot every shard is looked at
+        if snapshot is not None:
+            owners = [_owner(snapshot)]
+        else:
+            owners = [
+                owner for owner in self._load_directory()["user_ids"]
+                if any(record["id"] == sheet_id for record in self._load_shard(owner))
+            ]
+        for owner in owners:
+            self._apply(owner, sheet_id, None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the expense sheet catalog.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the catalog from the stored sheets.")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+    from app.apis.expense_api import sheet_catalog
+    print(f"[EXPENSE_CATALOG] Done: {sheet_catalog.rebuild()} sheets.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Duplicate expense detection through an index of entry fingerprints.
+
+Every entry has up to two fingerprints: one of its content (entry date, merchant name without case
+or accents, and every amount rounded to cents) and, when it has one, one of its Drive receipt. Two
+entries with a fingerprint in common are likely the same expense submitted twice, in the same or
+in different sheets. Each user has one fingerprint index (see app.libs.entry_index), so checking
+new entries costs one lookup per fingerprint and finding all of a user's duplicates reads a single
+document instead of comparing the entries of every sheet pairwise.
+
+Entries without amounts and without a receipt have no fingerprint: empty rows are not duplicates.
+
+Rebuild every index from the stored sheets:
+
+    python -m app.libs.expense_duplicates --rebuild
+
+Configuration (environment variables):
+
+    EXPENSE_DUPLICATES_CACHE_MAX_ENTRIES   default 256 users, 0 disables the cache
+    EXPENSE_DUPLICATES_CACHE_MAX_BYTES     default 64 MiB (measured as encoded JSON size)
+    EXPENSE_DUPLICATES_CACHE_TTL_SECONDS   default 30
+"""
+
+import argparse
+import hashlib
+from typing import Dict, Iterable, List
+
+from app.libs.entry_amounts import AMOUNT_FIELDS
+from app.libs.entry_index import EntryIndexStore
+from app.libs.expense_search import tokenize
+
+DUPLICATES_KEY_PREFIX = "expense_fingerprints_"
+
+# Kinds of fingerprint, the prefix of each
+CONTENT_FINGERPRINT = "content"
+RECEIPT_FINGERPRINT = "receipt"
+
+
+def entry_fingerprints(entry: dict) -> List[str]:
+    """Fingerprints of an entry in its JSON form, as "<kind>:<value>"."""
+    fingerprints = []
+    amounts = [round(entry.get(field) or 0.0, 2) for field in AMOUNT_FIELDS]
+    if any(amounts):
+        entry_date = entry.get("entry_date")
+        content = "|".join([str(entry_date)[:10] if entry_date else "", " ".join(tokenize(entry.get("merchant_name"))), *map(repr, amounts)])
+        fingerprints.append(f"{CONTENT_FINGERPRINT}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}")
+    if entry.get("receipt_google_drive_id"):
+        fingerprints.append(f"{RECEIPT_FINGERPRINT}:{entry['receipt_google_drive_id']}")
+    return fingerprints
+
+
+class ExpenseDuplicates(EntryIndexStore):
+    key_prefix = DUPLICATES_KEY_PREFIX
+    log_prefix = "[EXPENSE_DUPLICATES]"
+    cache_env_prefix = "EXPENSE_DUPLICATES_CACHE"
+    entry_fields = ("entry_date", "merchant_name", "receipt_google_drive_id", *AMOUNT_FIELDS)
+
+    def entry_record(self, sheet_id: str, entry: dict) -> dict:
+        entry_date = entry.get("entry_date")
+        return {
+            "sheet_id": sheet_id,
+            "entry_date": str(entry_date)[:10] if entry_date else None,
+            "merchant_name": entry.get("merchant_name"),
+            "daily_total": entry.get("daily_total") or 0.0,
+            "fingerprints": entry_fingerprints(entry),
+        }
+
+    def entry_terms(self, record: dict) -> Iterable[str]:
+        return record["fingerprints"]
+
+    def find_duplicates(self, user_id: str, entries: List[dict]) -> Dict[str, List[dict]]:
+        """Other entries of the user sharing a fingerprint with each of entries (JSON form, with "id").
+        Entries already saved are not reported as duplicates of themselves.
+
+        Meant for the request that saved entries: the index is read without writing the queued
+        changes, whose records (those of the entries just saved among them) take the place of the
+        stored records of their sheets.
+
+        Returns {entry id: [{"entry_id", "sheet_id", "entry_date", "merchant_name", "daily_total",
+        "matched_on"}]} for the entries with duplicates; matched_on lists the kinds of fingerprint shared.
+        """
+        queued_sheet_ids, queued = self.queued_records(user_id)
+        index = self.load(user_id, flush=False)
+        queued_terms: Dict[str, List[str]] = {}
+        for entry_id, record in queued.items():
+            for fingerprint in set(record["fingerprints"]):
+                queued_terms.setdefault(fingerprint, []).append(entry_id)
+
+        duplicates: Dict[str, List[dict]] = {}
+        for entry in entries:
+            matches: Dict[str, List[str]] = {}
+            for fingerprint in entry_fingerprints(entry):
+                stored = (
+                    entry_id for entry_id in index.terms.get(fingerprint, ())
+                    if entry_id not in queued and index.entries[entry_id]["sheet_id"] not in queued_sheet_ids
+                )
+                for entry_id in [*stored, *queued_terms.get(fingerprint, ())]:
+                    if entry_id != entry["id"]:
+                        matches.setdefault(entry_id, []).append(fingerprint.split(":", 1)[0])
+            if matches:
+                duplicates[entry["id"]] = [
+                    {"entry_id": entry_id, **_describe(queued.get(entry_id) or index.entries[entry_id]), "matched_on": kinds}
+                    for entry_id, kinds in matches.items()
+                ]
+        return duplicates
+
+    def duplicate_groups(self, user_id: str) -> List[dict]:
+        """Every set of the user's entries sharing a fingerprint, largest first.
+        Each group is {"matched_on": kind, "entries": [...]}, entries described as in find_duplicates.
+        """
+        index = self.load(user_id)
+        groups = [
+            {
+                "matched_on": fingerprint.split(":", 1)[0],
+                "entries": sorted(
+                    ({"entry_id": entry_id, **_describe(index.entries[entry_id])} for entry_id in entry_ids),
+                    key=lambda entry: (entry["entry_date"] or "", entry["sheet_id"], entry["entry_id"]),
+                ),
+            }
+            for fingerprint, entry_ids in index.terms.items() if len(entry_ids) > 1
+        ]
+        groups.sort(key=lambda group: (-len(group["entries"]), group["entries"][0]["entry_date"] or ""))
+        return groups
+
+
+def _describe(record: dict) -> dict:
+    return {field: record.get(field) for field in ("sheet_id", "entry_date", "merchant_name", "daily_total")}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the expense entry fingerprint indexes.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild every index from the stored sheets.")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+    from app.apis.expense_api import sheet_duplicates
+    print(f"[EXPENSE_DUPLICATES] Done: {sheet_duplicates.rebuild()} users.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Schema versions of stored expense sheets and the migration runner that upgrades them.
+
+Every stored sheet document carries schema_version. Documents below SHEET_SCHEMA_VERSION are
+upgraded in memory when read (upgrade_sheet_document, applied by the repository), so the models
+need no compatibility validators and current documents are parsed without extra work. The runner
+rewrites stored sheets at the current version so that in-memory upgrade stops being needed:
+
+    python -m app.libs.expense_migrations                 # migrate, resuming an interrupted run
+    python -m app.libs.expense_migrations --dry-run       # count the sheets that need migrating
+    python -m app.libs.expense_migrations --restart       # ignore the saved progress
+
+Versions:
+
+    0  legacy: entries may lack daily_total/km_amount and have purchase_date instead of entry_date
+    1  consistent km_amount, daily_total and total_amount (see app.libs.expense_reconciliation)
+    2  every entry has entry_date; payment_method_filter is upper case
+    3  subtotals and entry_count are stored (see app.libs.sheet_totals)
+"""
+
+import argparse
+import bisect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from app.libs.expense_reconciliation import reconcile_sheet_document
+from app.libs.expense_storage import DEFAULT_FETCH_CONCURRENCY, ExpenseSheetRepository, decode_document
+from app.libs.sheet_totals import compute_sheet_totals
+
+SHEET_SCHEMA_VERSION = 3
+
+# Progress of the last interrupted run; must not match the expense_sheet_ key prefix
+MIGRATION_PROGRESS_KEY = "expense_migration_progress.json"
+DEFAULT_MIGRATION_BATCH_SIZE = 64
+
+
+def _upgrade_to_v1(document: dict, default_km_rate: float) -> None:
+    reconcile_sheet_document(document, default_km_rate)
+
+def _upgrade_to_v2(document: dict, default_km_rate: float) -> None:
+    for entry in document.get("entries") or []:
+        if entry.get("entry_date") is None and entry.get("purchase_date") is not None:
+            entry["entry_date"] = entry["purchase_date"]
+    payment_method_filter = document.get("payment_method_filter")
+    if isinstance(payment_method_filter, str):
+        document["payment_method_filter"] = payment_method_filter.strip().upper()
+
+def _upgrade_to_v3(document: dict, default_km_rate: float) -> None:
+    document.update(compute_sheet_totals(document.get("entries") or []))
+
+# (version reached, upgrade) in order
+SHEET_UPGRADES: List[Tuple[int, Callable[[dict, float], None]]] = [
+    (1, _upgrade_to_v1),
+    (2, _upgrade_to_v2),
+    (3, _upgrade_to_v3),
+]
+
+
+def upgrade_sheet_document(document: dict, default_km_rate: float) -> dict:
+    """Applies the upgrades a stored sheet document is missing, in place, and returns it.
+
+    schema_version is left as stored: it only changes when the upgraded sheet is rewritten in full
+    by the runner, because later writes of a sheet only store the entries they change.
+    """
+    version = document.get("schema_version") or 0
+    if version >= SHEET_SCHEMA_VERSION:
+        return document
+    for target_version, upgrade in SHEET_UPGRADES:
+        if version < target_version:
+            upgrade(document, default_km_rate)
+    return document
+
+
+def _set_current_version(sheet) -> None:
+    sheet.schema_version = SHEET_SCHEMA_VERSION
+
+def _migrate_sheet(repository: ExpenseSheetRepository, sheet_id: str, dry_run: bool) -> str:
+    """Migrates one sheet. Returns the outcome: migrated, current, missing or failed."""
+    try:
+        # The repository upgrades the document while loading it; rewriting it stores the upgrade
+        sheet = repository.get(sheet_id)
+        if sheet is None:
+            return "missing"
+        if sheet.schema_version >= SHEET_SCHEMA_VERSION:
+            return "current"
+        if not dry_run:
+            repository.update(sheet_id, _set_current_version, rewrite=True)
+        return "migrated"
+    except Exception as e:
+        print(f"[EXPENSE_MIGRATIONS] Could not migrate sheet {sheet_id}: {e}")
+        return "failed"
+
+
+def run_migrations(
+    repository: ExpenseSheetRepository,
+    dry_run: bool = False,
+    batch_size: int = DEFAULT_MIGRATION_BATCH_SIZE,
+    max_workers: int = DEFAULT_FETCH_CONCURRENCY,
+    restart: bool = False,
+) -> Dict[str, int]:
+    """Upgrades every stored sheet below SHEET_SCHEMA_VERSION, streaming them in parallel batches.
+
+    Sheets are processed in id order and the last id of each finished batch is saved, so an
+    interrupted run resumes after it (unless restart). Writes are revision-checked, so the runner
+    can run alongside the app. Returns the number of sheets per outcome.
+    """
+    backend = repository.backend
+    progress = None if restart or dry_run else decode_document(backend.get(MIGRATION_PROGRESS_KEY), MIGRATION_PROGRESS_KEY)
+    if progress is not None and progress.get("target_version") != SHEET_SCHEMA_VERSION:
+        progress = None
+    counts = dict(progress["counts"]) if progress else {"migrated": 0, "current": 0, "missing": 0, "failed": 0}
+
+    sheet_ids = sorted(repository.list_sheet_ids())
+    if progress:
+        sheet_ids = sheet_ids[bisect.bisect_right(sheet_ids, progress["last_sheet_id"]):]
+        print(f"[EXPENSE_MIGRATIONS] Resuming after sheet {progress['last_sheet_id']}, {len(sheet_ids)} sheets left.")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="sheet-migration") as executor:
+        for start in range(0, len(sheet_ids), batch_size):
+            batch = sheet_ids[start:start + batch_size]
+            for outcome in executor.map(lambda sheet_id: _migrate_sheet(repository, sheet_id, dry_run), batch):
+                counts[outcome] += 1
+            if not dry_run:
+                backend.put(MIGRATION_PROGRESS_KEY, {"target_version": SHEET_SCHEMA_VERSION, "last_sheet_id": batch[-1], "counts": counts})
+            done = start + len(batch)
+            rate = done / max(time.monotonic() - started, 1e-9)
+            print(f"[EXPENSE_MIGRATIONS] {done}/{len(sheet_ids)} sheets ({rate:.0f}/s): {counts}")
+
+    if not dry_run and backend.get(MIGRATION_PROGRESS_KEY):
+        # Finished: the next run starts from the beginning again
+        backend.delete(MIGRATION_PROGRESS_KEY)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=f"Upgrade stored expense sheets to schema version {SHEET_SCHEMA_VERSION}.")
+    parser.add_argument("--dry-run", action="store_true", help="Count the sheets that need migrating without saving them.")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress of an interrupted run.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_FETCH_CONCURRENCY)
+    args = parser.parse_args()
+    from app.apis.expense_api import sheet_repository
+    counts = run_migrations(sheet_repository, dry_run=args.dry_run, batch_size=args.batch_size, max_workers=args.workers, restart=args.restart)
+    print(f"[EXPENSE_MIGRATIONS] Done: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Reconciliation of legacy expense sheet amounts (the upgrade to schema version 1).
+
+Sheets written before daily_total existed have entries without daily_total/km_amount and a
+total_amount that does not match their entries. reconcile_sheet_document fills in the missing
+entry amounts and recomputes total_amount. It works on stored documents (dicts) and is applied by
+app.libs.expense_migrations, both in memory when a legacy sheet is read and permanently by the
+migration runner:
+
+    python -m app.libs.expense_migrations [--dry-run]
+"""
+
+ENTRY_AMOUNT_FIELDS = (
+    "parking_amount", "taxi_amount", "transport_amount", "hotel_amount",
+    "lunch_amount", "dinner_amount", "miscellaneous_amount",
+)
+
+
+def reconcile_entry_document(entry: dict, default_km_rate: float) -> bool:
+    """Fills in km_amount/daily_total of an entry saved before they were calculated. Returns True if it changed."""
+    if entry.get("daily_total") is not None:
+        return False
+    if entry.get("km_amount") is None:
+        km_rate = entry["km_rate"] if entry.get("km_rate") is not None else default_km_rate
+        entry["km_amount"] = entry["kilometers"] * km_rate if entry.get("kilometers") else 0.0
+    entry["daily_total"] = sum(entry.get(field) or 0.0 for field in ENTRY_AMOUNT_FIELDS) + entry["km_amount"]
+    return True
+
+
+def reconcile_sheet_document(document: dict, default_km_rate: float) -> bool:
+    """Makes the amounts of a sheet document consistent, in place. Returns True if any amount changed."""
+    entries = document.get("entries") or []
+    changed = False
+    for entry in entries:
+        changed = reconcile_entry_document(entry, default_km_rate) or changed
+    expected_total = sum(entry["daily_total"] for entry in entries if entry.get("daily_total") is not None)
+    if document.get("total_amount") != expected_total:
+        document["total_amount"] = expected_total
+        changed = True
+    return changed
+
+
+def main() -> None:
+    # Kept so the original command keeps working; the migration runner includes the reconciliation
+    from app.libs.expense_migrations import main as run_migrations_main
+    run_migrations_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Materialized monthly rollups: what each user's sheets add up to per (year, month) and currency.
+
+Each user has one rollup document holding, for every month, the stored totals of each of the
+user's sheets of that month (see app.libs.sheet_totals) and their sum per currency. The repository
+keeps it up to date on every sheet write and delete (see ExpenseSheetRepository.add_listener); a
+user's sheets never change owner, so moving a sheet to another month is one compare-and-put of one
+document. Month-end reports read one small document per user instead of every sheet. A missing
+or unreadable rollup is rebuilt from the user's records in the sheet catalog.
+
+Rebuild all rollups from the stored sheets:
+
+    python -m app.libs.expense_rollups --rebuild
+"""
+
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from app.libs.expense_catalog import SheetCatalog
+from app.libs.expense_storage import (
+    DEFAULT_WRITE_ATTEMPTS,
+    ExpenseSheetRepository,
+    RevisionConflictError,
+    SheetChangeListener,
+    StorageBackend,
+    list_key_ids,
+    parallel_map,
+    read_versioned_document,
+    sanitize_storage_key,
+)
+from app.libs.sheet_totals import SUBTOTAL_FIELDS
+
+ROLLUP_KEY_PREFIX = "expense_rollup_"
+ROLLUP_KEY_SUFFIX = ".json"
+ROLLUP_FORMAT_VERSION = 1
+
+# Sheet-level fields copied into the rollup for each sheet
+ROLLUP_SHEET_FIELDS = ("id", "name", "status", "currency", "total_amount", "subtotals", "entry_count", "revision")
+
+
+def get_rollup_storage_key(user_id: str) -> str:
+    return sanitize_storage_key(f"{ROLLUP_KEY_PREFIX}{user_id}{ROLLUP_KEY_SUFFIX}")
+
+def month_key(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}"
+
+
+def rollup_sheet_record(sheet: BaseModel) -> dict:
+    return sheet.model_dump(mode='json', include=set(ROLLUP_SHEET_FIELDS))
+
+def _sheet_record_from_document(document: dict) -> dict:
+    """Rollup record of a stored sheet document or a catalog record."""
+    record = {field: document.get(field) for field in ROLLUP_SHEET_FIELDS}
+    record["subtotals"] = {field: (document.get("subtotals") or {}).get(field) or 0.0 for field in SUBTOTAL_FIELDS}
+    record["total_amount"] = record["total_amount"] or 0.0
+    record["entry_count"] = record["entry_count"] or 0
+    return record
+
+def summarize_month(sheets: Dict[str, dict]) -> dict:
+    """Sums the sheet records of one month per currency."""
+    totals: Dict[str, dict] = {}
+    for record in sheets.values():
+        currency_totals = totals.setdefault(record.get("currency") or "", {
+            "sheet_count": 0, "entry_count": 0, "total_amount": 0.0, "subtotals": dict.fromkeys(SUBTOTAL_FIELDS, 0.0),
+        })
+        currency_totals["sheet_count"] += 1
+        currency_totals["entry_count"] += record.get("entry_count") or 0
+        currency_totals["total_amount"] += record.get("total_amount") or 0.0
+        for field in SUBTOTAL_FIELDS:
+            currency_totals["subtotals"][field] += (record.get("subtotals") or {}).get(field) or 0.0
+    return {"sheets": sheets, "totals": totals}
+
+
+def _summarize_months(sheets: List[dict]) -> Dict[str, dict]:
+    """Groups sheet documents (or catalog records) of one user by month and summarizes each month."""
+    months: Dict[str, Dict[str, dict]] = {}
+    for sheet in sheets:
+        months.setdefault(month_key(sheet["year"], sheet["month"]), {})[sheet["id"]] = _sheet_record_from_document(sheet)
+    return {key: summarize_month(records) for key, records in months.items()}
+
+
+class ExpenseRollups(SheetChangeListener):
+    """Reads and maintains the per-user rollup documents.
+
+    Updates are read-modify-write of one document, with compare-and-put on its revision and retries
+    on conflict. A sheet record is only replaced by one of a newer sheet revision, so updates that
+    arrive out of order cannot undo each other.
+    """
+
+    def __init__(self, backend: StorageBackend, repository: ExpenseSheetRepository, catalog: SheetCatalog):
+        self.backend = backend
+        self.repository = repository
+        self.catalog = catalog
+
+    def _read_document(self, user_id: str) -> Tuple[Optional[dict], Optional[int]]:
+        """Returns (current-format document or None, stored revision for compare-and-put)."""
+        return read_versioned_document(self.backend, get_rollup_storage_key(user_id), ROLLUP_FORMAT_VERSION)
+
+    def _write_document(self, user_id: str, months: Dict[str, dict], expected_revision: Optional[int]) -> bool:
+        key = get_rollup_storage_key(user_id)
+        if not months:
+            return expected_revision is None or self.backend.compare_and_delete(key, expected_revision)
+        document = {"format_version": ROLLUP_FORMAT_VERSION, "revision": (expected_revision or 0) + 1, "user_id": user_id, "months": months}
+        return self.backend.compare_and_put(key, document, expected_revision)
+
+    def _months_from_catalog(self, user_id: str) -> Dict[str, dict]:
+        """Builds the months of one user from the sheet catalog (a single read), which already
+        reflects the write being rolled up: the catalog is notified first."""
+        records, _ = self.catalog.query(user_id=user_id)
+        return _summarize_months(records)
+
+    def _apply(self, user_id: str, sheet_id: str, month: Optional[str], record: Optional[dict]) -> None:
+        """Moves the sheet's record to month (removes it when record is None)."""
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            document, revision = self._read_document(user_id)
+            if document is None:
+                # Missing or unreadable: rebuilt from the catalog, which already reflects this change
+                if self._write_document(user_id, self._months_from_catalog(user_id), revision):
+                    return
+                continue
+            months = document["months"]
+            current_month = next((key for key, value in months.items() if sheet_id in value["sheets"]), None)
+            if current_month is not None:
+                current = months[current_month]["sheets"][sheet_id]
+                if record is not None and current.get("revision", 0) > record.get("revision", 0):
+                    return  # A newer revision of this sheet was already rolled up
+                sheets = dict(months[current_month]["sheets"])
+                del sheets[sheet_id]
+                if sheets:
+                    months[current_month] = summarize_month(sheets)
+                else:
+                    del months[current_month]
+            elif record is None:
+                return
+            if record is not None:
+                sheets = dict(months[month]["sheets"]) if month in months else {}
+                sheets[sheet_id] = record
+                months[month] = summarize_month(sheets)
+            if self._write_document(user_id, months, revision):
+                return
+        raise RevisionConflictError(get_rollup_storage_key(user_id), None)
+
+    def sheet_saved(self, sheet: BaseModel) -> None:
+        if sheet.user_id:
+            self._apply(sheet.user_id, sheet.id, month_key(sheet.year, sheet.month), rollup_sheet_record(sheet))
+
+    def sheet_deleted(self, sheet_id: str, snapshot: Optional[dict] = None) -> None:
+        if snapshot is None:
+            print(f"[EXPENSE_ROLLUPS] Owner of deleted sheet {sheet_id} is unknown; run a rebuild to drop it from the rollups.")
+            return
+        if snapshot.get("user_id"):
+            self._apply(snapshot["user_id"], sheet_id, None, None)
+
+    def get_month(self, user_id: str, year: int, month: int) -> Optional[dict]:
+        """Returns the rollup of one user's month ({"sheets", "totals"}), or None if the user has no sheets in it."""
+        document, _ = self._read_document(user_id)
+        months = self._months_from_catalog(user_id) if document is None else document["months"]
+        return months.get(month_key(year, month))
+
+    def list_user_ids(self) -> List[str]:
+        """Users with a rollup document (the sanitized user id of each key). Lists the whole bucket,
+        so only rebuilds use it."""
+        return list_key_ids(self.backend, ROLLUP_KEY_PREFIX, ROLLUP_KEY_SUFFIX)
+
+    def get_month_for_all_users(self, year: int, month: int) -> Dict[str, dict]:
+        """Returns {user_id: month rollup} for every user with sheets in the month. The users come from
+        the sheet catalog's directory (one read, no bucket listing); their rollups are read in parallel."""
+        key = month_key(year, month)
+
+        def read(user_id: str) -> Tuple[str, Optional[dict]]:
+            document, _ = self._read_document(user_id)
+            if document is None:
+                return user_id, self._months_from_catalog(user_id).get(key)
+            return document["user_id"], document["months"].get(key)
+
+        user_ids = self.catalog.list_user_ids()
+        return {user_id: rollup for user_id, rollup in parallel_map(read, user_ids, thread_name_prefix="rollup-fetch") if rollup is not None}
+
+    def rebuild(self) -> int:
+        """Rebuilds every rollup from a full scan of the stored sheets. Returns the number of users."""
+        print("[EXPENSE_ROLLUPS] Rebuilding monthly rollups from a full storage scan...")
+        users: Dict[str, List[dict]] = {}
+        for document in self.repository.get_documents(self.repository.list_sheet_ids()):
+            if document.get("user_id"):
+                users.setdefault(document["user_id"], []).append(document)
+        stale_user_ids = set(self.list_user_ids()) - {sanitize_storage_key(user_id) for user_id in users}
+        for user_id, documents in users.items():
+            self._replace(user_id, _summarize_months(documents))
+        for user_id in stale_user_ids:
+            self._replace(user_id, {})
+        print(f"[EXPENSE_ROLLUPS] Monthly rollups rebuilt for {len(users)} users.")
+        return len(users)
+
+    def _replace(self, user_id: str, months: Dict[str, dict]) -> None:
+        for _ in range(DEFAULT_WRITE_ATTEMPTS):
+            if self._write_document(user_id, months, self._read_document(user_id)[1]):
+                return
+        raise RevisionConflictError(get_rollup_storage_key(user_id), None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the monthly expense rollups.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild every rollup from the stored sheets.")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+    from app.apis.expense_api import sheet_rollups
+    print(f"[EXPENSE_ROLLUPS] Done: {sheet_rollups.rebuild()} users.")
+
+
+if __name__ == "__main__":
+    main()
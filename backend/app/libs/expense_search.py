@@ -0,0 +1,134 @@
+"""Full-text search over the merchant, project, company and location of a user's expense entries.
+
+Each user has one inverted index (see app.libs.entry_index): a short record of every entry (the
+searched texts, entry date, daily total and the categories it has amounts in), the entries of each
+sheet and, per token, the ids of the entries containing it. Tokens are accent- and case-insensitive
+("Café" and "cafe" are the same token) and the terms are stored sorted, so every query word matches
+the terms it is a prefix of with a binary search. The index follows every sheet write and delete
+(see ExpenseSheetRepository.add_listener) in the background; a write only logs the entries of the
+saved sheet that changed. A query reads one index, usually from an in-process cache, and never
+loads a sheet:
+
+    search.search(user_id, "repsol park", date_from=..., category="parking_amount")
+
+Rebuild every index from the stored sheets:
+
+    python -m app.libs.expense_search --rebuild
+
+Configuration (environment variables):
+
+    EXPENSE_SEARCH_CACHE_MAX_ENTRIES   default 256 users, 0 disables the cache
+    EXPENSE_SEARCH_CACHE_MAX_BYTES     default 64 MiB (measured as encoded JSON size)
+    EXPENSE_SEARCH_CACHE_TTL_SECONDS   default 30
+"""
+
+import argparse
+import bisect
+import datetime
+import re
+import unicodedata
+from typing import Iterable, List, Optional, Set
+
+from app.libs.entry_index import EntryIndex, EntryIndexStore
+from app.libs.sheet_totals import SUBTOTAL_FIELDS
+
+SEARCH_KEY_PREFIX = "expense_search_"
+
+# Entry fields whose text is indexed
+SEARCH_FIELDS = ("merchant_name", "project", "company", "location")
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lower-case words of text without accents: "Peaje Cádiz-Sur" -> ["peaje", "cadiz", "sur"]."""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return _TOKEN_PATTERN.findall("".join(char for char in decomposed if not unicodedata.combining(char)))
+
+
+def _prefix_matches(index: EntryIndex, prefix: str) -> Set[str]:
+    vocabulary = index.vocabulary
+    entry_ids: Set[str] = set()
+    for position in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+        term = vocabulary[position]
+        if not term.startswith(prefix):
+            break
+        entry_ids.update(index.terms[term])
+    return entry_ids
+
+def match(index: EntryIndex, query: str) -> Set[str]:
+    """Ids of the entries with, for every word of query, a word starting with it."""
+    entry_ids: Optional[Set[str]] = None
+    for prefix in sorted(set(tokenize(query)), key=len, reverse=True):
+        matches = _prefix_matches(index, prefix)
+        entry_ids = matches if entry_ids is None else entry_ids & matches
+        if not entry_ids:
+            break
+    return entry_ids or set()
+
+
+class ExpenseSearch(EntryIndexStore):
+    key_prefix = SEARCH_KEY_PREFIX
+    log_prefix = "[EXPENSE_SEARCH]"
+    cache_env_prefix = "EXPENSE_SEARCH_CACHE"
+    entry_fields = ("entry_date", "daily_total", *SEARCH_FIELDS, *SUBTOTAL_FIELDS)
+
+    def entry_record(self, sheet_id: str, entry: dict) -> dict:
+        entry_date = entry.get("entry_date")
+        return {
+            "sheet_id": sheet_id,
+            "entry_date": str(entry_date)[:10] if entry_date else None,
+            **{field: entry.get(field) for field in SEARCH_FIELDS},
+            "daily_total": entry.get("daily_total") or 0.0,
+            "categories": [field for field in SUBTOTAL_FIELDS if entry.get(field)],
+        }
+
+    def entry_terms(self, record: dict) -> Iterable[str]:
+        return (token for field in SEARCH_FIELDS for token in tokenize(record.get(field)))
+
+    def search(
+        self,
+        user_id: str,
+        query: str,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+        category: Optional[str] = None,
+    ) -> List[dict]:
+        """Entries of the user matching every word of query as a prefix, newest first. Each result is
+        the entry's index record plus its "entry_id". Entries without a date are left out of date ranges.
+        """
+        if category is not None and category not in SUBTOTAL_FIELDS:
+            raise ValueError(f"Unknown category: {category}. Expected one of {list(SUBTOTAL_FIELDS)}.")
+        index = self.load(user_id)
+        first = date_from.isoformat() if date_from is not None else None
+        last = date_to.isoformat() if date_to is not None else None
+        results = []
+        for entry_id in match(index, query):
+            record = index.entries[entry_id]
+            entry_date = record.get("entry_date")
+            if (first is not None or last is not None) and entry_date is None:
+                continue
+            if (first is not None and entry_date < first) or (last is not None and entry_date > last):
+                continue
+            if category is not None and category not in record["categories"]:
+                continue
+            results.append({"entry_id": entry_id, **record})
+        results.sort(key=lambda result: (result.get("entry_date") or "", result["entry_id"]), reverse=True)
+        return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Maintain the expense entry search indexes.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild every index from the stored sheets.")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.print_help()
+        return
+    from app.apis.expense_api import sheet_search
+    print(f"[EXPENSE_SEARCH] Done: {sheet_search.rebuild()} users.")
+
+
+if __name__ == "__main__":
+    main()
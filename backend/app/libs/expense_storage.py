@@ -0,0 +1,932 @@
+"""Storage layer for expense sheets.
+
+Usage:
+
+    from app.libs.expense_storage import ExpenseSheetRepository, get_storage_backend
+
+    repository = ExpenseSheetRepository(get_storage_backend(), ExpenseSheet)
+    sheet = repository.get(sheet_id)  # None if the sheet does not exist
+    repository.save(sheet)
+
+The backend is selected with the EXPENSE_STORAGE_BACKEND environment variable:
+
+    databutton  (default) db.storage.json, as used in production
+    memory      process-local dict, for benchmarks and load tests without network
+    filesystem  one JSON file per key under EXPENSE_STORAGE_DIR (default ./.expense_storage)
+
+Documents are always written as JSON objects, encoded by the storage codec where the backend
+stores bytes (see app.libs.storage_codec); db.storage.json encodes them itself.
+
+Storage format of a sheet:
+
+    expense_sheet_{id}.json     snapshot: the full sheet as of some revision (the original format)
+    expense_sheetlog_{id}.json  log: the latest sheet-level fields ("header") and the entry
+                                events written since the snapshot
+
+Writes only rewrite the log, so adding or editing an entry costs O(events since the snapshot)
+instead of O(entries). Every EXPENSE_SHEET_LOG_COMPACT_EVENTS events the full sheet is written as
+a new snapshot and the log is truncated. Reads fold the snapshot and the log's newer events.
+Sheets without a log (written before the log existed) are read as plain snapshots.
+"""
+
+import os
+import re
+import tempfile
+import threading
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+from app.libs import metrics
+from app.libs.expense_cache import SheetCache
+from app.libs.storage_codec import get_codec
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the filesystem backend then locks per process only
+    fcntl = None
+
+SHEET_KEY_PREFIX = "expense_sheet_"
+SHEET_KEY_SUFFIX = ".json"
+# Must not start with SHEET_KEY_PREFIX, or the log would be listed as a sheet
+SHEET_LOG_KEY_PREFIX = "expense_sheetlog_"
+SHEET_LOG_FORMAT_VERSION = 1
+JOURNAL_KEY_PREFIX = "expense_journal_"
+
+# Parallel reads used by bulk loads (listings, catalog rebuilds, reports)
+DEFAULT_FETCH_CONCURRENCY = int(os.environ.get("EXPENSE_STORAGE_FETCH_CONCURRENCY", "16"))
+# Attempts of a read-modify-write before a revision conflict is reported to the caller
+DEFAULT_WRITE_ATTEMPTS = int(os.environ.get("EXPENSE_STORAGE_WRITE_ATTEMPTS", "5"))
+# Journals younger than this may belong to a batch that is still being applied
+WRITE_BATCH_RECOVERY_MIN_AGE_SECONDS = float(os.environ.get("EXPENSE_WRITE_BATCH_RECOVERY_MIN_AGE_SECONDS", "60"))
+# How often each worker looks for abandoned journals; 0 disables the background recovery
+WRITE_BATCH_RECOVERY_INTERVAL_SECONDS = float(os.environ.get("EXPENSE_WRITE_BATCH_RECOVERY_INTERVAL_SECONDS", "300"))
+# Entry events kept in a sheet's log before it is compacted into a new snapshot. Each write costs
+# O(events in the log) and each compaction O(entries), so ~sqrt(2 * entries per sheet) balances them.
+DEFAULT_LOG_COMPACT_EVENTS = max(1, int(os.environ.get("EXPENSE_SHEET_LOG_COMPACT_EVENTS", "32")))
+
+
+# --- Helper functions for storage keys ---
+def sanitize_storage_key(key: str) -> str:
+    """Sanitize storage key to only allow alphanumeric and ._- symbols"""
+    return re.sub(r'[^a-zA-Z0-9._-]', '', key)
+
+def get_expense_sheet_storage_key(sheet_id: str) -> str:
+    """Returns the db.storage key for an expense sheet."""
+    return sanitize_storage_key(f"{SHEET_KEY_PREFIX}{sheet_id}{SHEET_KEY_SUFFIX}")
+
+def get_expense_sheet_log_storage_key(sheet_id: str) -> str:
+    """Returns the db.storage key for the entry log of an expense sheet."""
+    return sanitize_storage_key(f"{SHEET_LOG_KEY_PREFIX}{sheet_id}{SHEET_KEY_SUFFIX}")
+
+
+class SheetStorageError(Exception):
+    """Base class for errors raised by the expense sheet storage layer."""
+
+
+class CorruptSheetError(SheetStorageError):
+    """A stored document exists but cannot be decoded into a JSON object."""
+
+
+class SheetNotFoundError(SheetStorageError):
+    """The sheet to update does not exist (or was deleted while updating it)."""
+
+
+class RevisionConflictError(SheetStorageError):
+    """The stored revision differs from the one the write was based on."""
+
+    def __init__(self, sheet_id: str, expected_revision: Optional[int], current_revision: Optional[int] = None):
+        self.sheet_id = sheet_id
+        self.expected_revision = expected_revision
+        self.current_revision = current_revision
+        super().__init__(f"Revision conflict on sheet {sheet_id}: expected {expected_revision}, found {current_revision}.")
+
+
+def decode_document(raw: Any, key: str) -> Optional[dict]:
+    """Normalizes a raw value read from storage into a dict.
+
+    Backends return either the decoded document (dict) or its encoded bytes/str, which are decoded
+    with the storage codec. Older handlers also stored sheets as a JSON string inside JSON
+    (model_dump_json), which arrives here as str; all writes now store the canonical dict form.
+    Returns None for empty values.
+    """
+    if not raw:
+        return None
+    if isinstance(raw, dict):
+        return raw
+    if isinstance(raw, (str, bytes)):
+        try:
+            decoded = get_codec().decode(raw)
+            if isinstance(decoded, str):
+                # Legacy JSON-in-JSON read from a backend that stores bytes
+                decoded = get_codec().decode(decoded)
+        except ValueError as e:
+            print(f"[EXPENSE_STORAGE] Error decoding JSON for {key}: {e}. Content: {raw[:500]!r}")
+            raise CorruptSheetError(f"Invalid JSON format for {key}.") from e
+        if isinstance(decoded, dict):
+            return decoded
+        print(f"[EXPENSE_STORAGE] Decoded JSON for {key} is not an object: {type(decoded)}")
+        raise CorruptSheetError(f"Unexpected document type for {key}.")
+    print(f"[EXPENSE_STORAGE] Warning: Unexpected data type for {key}: {type(raw)}")
+    raise CorruptSheetError(f"Unexpected data type for {key}.")
+
+
+def document_revision(document: Optional[dict]) -> Optional[int]:
+    """Revision stored in a document; None if the document does not exist, 0 for legacy documents."""
+    if document is None:
+        return None
+    return int(document.get("revision") or 0)
+
+
+# --- Sheet log ---
+def sheet_entry_events(previous_entries: List[BaseModel], entries: List[BaseModel], revision: int) -> Optional[List[dict]]:
+    """Events that turn previous_entries into entries, tagged with revision. Only changed entries are serialised.
+
+    "put" replaces the entry with the same id in place, or appends it if it is new; "delete" removes
+    it. Returns None if the change cannot be expressed that way (surviving entries were reordered).
+    """
+    before = {entry.id: entry for entry in previous_entries}
+    after_ids = {entry.id for entry in entries}
+    events = [
+        {"revision": revision, "op": "delete", "entry_id": entry_id}
+        for entry_id in before if entry_id not in after_ids
+    ]
+    events.extend(
+        {"revision": revision, "op": "put", "entry": entry.model_dump(mode='json')}
+        for entry in entries if before.get(entry.id) != entry
+    )
+    folded_order = [entry_id for entry_id in before if entry_id in after_ids]
+    folded_order.extend(entry.id for entry in entries if entry.id not in before)
+    if folded_order != [entry.id for entry in entries]:
+        return None
+    return events
+
+def apply_sheet_entry_events(entries: List[dict], events: List[dict]) -> List[dict]:
+    """Applies entry events (see sheet_entry_events) to a list of entry documents."""
+    by_id = {entry["id"]: entry for entry in entries}
+    for event in events:
+        op = event["op"]
+        if op == "put":
+            by_id[event["entry"]["id"]] = event["entry"]
+        elif op == "delete":
+            by_id.pop(event["entry_id"], None)
+        elif op == "replace":
+            by_id = {entry["id"]: entry for entry in event["entries"]}
+        else:
+            raise ValueError(f"Unknown sheet log event '{op}'")
+    return list(by_id.values())  # dicts keep insertion order, so puts of existing ids stay in place
+
+def fold_sheet_document(snapshot: dict, log: Optional[dict], key: str) -> dict:
+    """Returns the current sheet document: the snapshot plus the log events newer than it."""
+    snapshot_revision = document_revision(snapshot)
+    if log is None or document_revision(log) <= snapshot_revision:
+        return snapshot
+    if log.get("format_version") != SHEET_LOG_FORMAT_VERSION or log.get("base_revision", 0) > snapshot_revision:
+        # The log builds on a snapshot that is not stored; the events in between are missing
+        raise CorruptSheetError(f"Sheet log {key} does not continue snapshot revision {snapshot_revision}.")
+    events = [event for event in log.get("events", []) if event["revision"] > snapshot_revision]
+    document = dict(log["header"])
+    document["entries"] = apply_sheet_entry_events(snapshot.get("entries") or [], events)
+    document["revision"] = log["revision"]
+    return document
+
+
+# --- Storage backends ---
+# Serializes compare-and-put calls on the same key within this process
+_CAS_LOCK_STRIPES = [threading.Lock() for _ in range(64)]
+
+class StorageBackend:
+    """Minimal key/value interface over JSON documents."""
+
+    name = "abstract"
+
+    def get(self, key: str) -> Any:
+        """Returns the raw stored value, or None if the key does not exist."""
+        raise NotImplementedError
+
+    def put(self, key: str, document: dict) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def list_keys(self) -> List[str]:
+        raise NotImplementedError
+
+    def compare_and_put(self, key: str, document: dict, expected_revision: Optional[int]) -> bool:
+        """Writes document only if the stored document's revision equals expected_revision
+        (None: the key must not exist). Returns False, without writing, on mismatch.
+
+        This default is atomic among callers in this process only. db.storage has no conditional
+        write, so across workers it narrows the race window rather than closing it.
+        """
+        with self._key_lock(key):
+            current_revision = document_revision(decode_document(self.get(key), key))
+            if current_revision != expected_revision:
+                return False
+            self.put(key, document)
+            return True
+
+    def compare_and_delete(self, key: str, expected_revision: int) -> bool:
+        """Deletes key only if the stored document's revision equals expected_revision."""
+        with self._key_lock(key):
+            if document_revision(decode_document(self.get(key), key)) != expected_revision:
+                return False
+            self.delete(key)
+            return True
+
+    @contextmanager
+    def _key_lock(self, key: str) -> Iterator[None]:
+        """Serialises conditional writes of one key."""
+        with _CAS_LOCK_STRIPES[hash(key) % len(_CAS_LOCK_STRIPES)]:
+            yield
+
+
+class DatabuttonStorageBackend(StorageBackend):
+    """db.storage.json, imported lazily so the other backends work without the SDK."""
+
+    name = "databutton"
+
+    def __init__(self):
+        import databutton as db
+        self._json = db.storage.json
+
+    def get(self, key: str) -> Any:
+        return self._json.get(key, default=None)
+
+    def put(self, key: str, document: dict) -> None:
+        self._json.put(key, document)
+
+    def delete(self, key: str) -> None:
+        self._json.delete(key)
+
+    def list_keys(self) -> List[str]:
+        return [f.name for f in self._json.list()]
+
+
+class InMemoryStorageBackend(StorageBackend):
+    """Process-local backend. Values are kept encoded so callers never share mutable state."""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key: str, document: dict) -> None:
+        encoded = get_codec().encode(document)
+        with self._lock:
+            self._data[key] = encoded
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key not in self._data:
+                raise FileNotFoundError(key)
+            del self._data[key]
+
+    def list_keys(self) -> List[str]:
+        with self._lock:
+            return list(self._data)
+
+
+class FileSystemStorageBackend(StorageBackend):
+    """One JSON file per key in a local directory. Writes are atomic (temp file + rename)."""
+
+    name = "filesystem"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, sanitize_storage_key(key))
+
+    def get(self, key: str) -> Any:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, document: dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(get_codec().encode(document))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def delete(self, key: str) -> None:
+        os.remove(self._path(key))
+
+    def list_keys(self) -> List[str]:
+        return [name for name in os.listdir(self.root) if not name.startswith((".tmp_", ".lock_"))]
+
+    @contextmanager
+    def _key_lock(self, key: str) -> Iterator[None]:
+        with super()._key_lock(key):
+            if fcntl is None:
+                yield
+                return
+            # An advisory lock file per key makes the check-and-write atomic across processes too
+            with open(os.path.join(self.root, f".lock_{sanitize_storage_key(key)}"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_BACKEND_FACTORIES: Dict[str, Callable[[], StorageBackend]] = {
+    "databutton": DatabuttonStorageBackend,
+    "memory": InMemoryStorageBackend,
+    "filesystem": lambda: FileSystemStorageBackend(os.environ.get("EXPENSE_STORAGE_DIR", ".expense_storage")),
+}
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+def get_storage_backend() -> StorageBackend:
+    """Returns the process-wide backend selected by EXPENSE_STORAGE_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            backend_name = os.environ.get("EXPENSE_STORAGE_BACKEND", "databutton").lower()
+            factory = _BACKEND_FACTORIES.get(backend_name)
+            if factory is None:
+                raise ValueError(f"Unknown EXPENSE_STORAGE_BACKEND '{backend_name}'. Expected one of {sorted(_BACKEND_FACTORIES)}.")
+            _backend = factory()
+            print(f"[EXPENSE_STORAGE] Using '{_backend.name}' storage backend.")
+        return _backend
+
+
+# --- Bulk reads and derived documents ---
+T = TypeVar("T")
+R = TypeVar("R")
+
+def parallel_map(function: Callable[[T], R], items: List[T], max_workers: Optional[int] = None, thread_name_prefix: str = "storage-fetch") -> List[R]:
+    """Calls function on every item with at most max_workers (default EXPENSE_STORAGE_FETCH_CONCURRENCY)
+    calls in flight, for storage round-trips. Returns the results in the order of items."""
+    max_workers = max(1, min(max_workers or DEFAULT_FETCH_CONCURRENCY, len(items)))
+    if max_workers == 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix) as executor:
+        return list(executor.map(function, items))
+
+
+def list_key_ids(backend: StorageBackend, prefix: str, suffix: str) -> List[str]:
+    """The part between prefix and suffix of every stored key that has both (e.g. the sanitized user
+    id of each per-user document). Lists the whole bucket."""
+    return [key[len(prefix):-len(suffix)] for key in backend.list_keys() if key.startswith(prefix) and key.endswith(suffix)]
+
+
+def read_versioned_document(backend: StorageBackend, key: str, format_version: int, raw: Any = None) -> Tuple[Optional[dict], Optional[int]]:
+    """Reads a document derived from the sheets (catalog, rollup, index), which can be rebuilt from them.
+
+    Returns (document, stored revision for compare-and-put). The document is None when it is missing,
+    of another format_version, or unreadable; an unreadable one is deleted so a rebuild can take its
+    key. raw is the stored value, if the caller has already read it.
+    """
+    if raw is None:
+        raw = backend.get(key)
+    try:
+        document = decode_document(raw, key)
+    except CorruptSheetError as e:
+        print(f"[EXPENSE_STORAGE] Document {key} is unreadable, it will be rebuilt: {e}")
+        backend.delete(key)
+        return None, None
+    revision = document_revision(document)
+    if document is None or document.get("format_version") != format_version:
+        return None, revision
+    return document, revision
+
+
+# --- Write batches ---
+def _undo_write(backend: StorageBackend, write: dict) -> bool:
+    """Restores the document a batch write replaced, unless someone else has written the key since."""
+    written_revision = document_revision(write["document"])
+    if write["previous"] is None:
+        undone = backend.compare_and_delete(write["key"], written_revision)
+    else:
+        undone = backend.compare_and_put(write["key"], write["previous"], written_revision)
+    if not undone:
+        print(f"[EXPENSE_STORAGE] CRITICAL: Cannot roll back {write['key']}: it was modified after the batch wrote it.")
+    return undone
+
+def _write_state(backend: StorageBackend, write: dict) -> str:
+    """'applied' (the key holds the batch's document), 'superseded' (the batch's document was written
+    and later writes have replaced it), 'pending' (the key still holds the revision the write expects)
+    or 'foreign' (someone else wrote the key instead)."""
+    current = decode_document(backend.get(write["key"]), write["key"])
+    if current == write["document"]:
+        return "applied"
+    current_revision = document_revision(current)
+    if current_revision == write["expected_revision"]:
+        return "pending"
+    written_revision = document_revision(write["document"])
+    if current_revision is None or written_revision is None or current_revision <= written_revision:
+        return "foreign"
+    # A later revision. While a sheet log still holds the events of the written revision they show
+    # whose write that revision was; once it has been compacted away, the later writes are taken to
+    # build on the batch's, as the revisions say.
+    written_events = [event for event in write["document"].get("events") or [] if event.get("revision") == written_revision]
+    if written_events and (current.get("base_revision") or 0) < written_revision:
+        current_events = [event for event in current.get("events") or [] if event.get("revision") == written_revision]
+        return "superseded" if current_events == written_events else "foreign"
+    return "superseded"
+
+class WriteBatch:
+    """Compare-and-put of several documents as a unit, e.g. both sheets of an entry move.
+
+    A journal document listing every write (with the document it replaces) is stored first; the
+    writes are then issued concurrently. If any of them loses its compare-and-put, the ones that
+    succeeded are rolled back and RevisionConflictError is raised. The journal is deleted once the
+    batch is fully applied or rolled back, so a journal left in storage marks a batch interrupted
+    by a crash; recover_write_batches completes or rolls those back.
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        self._writes: List[dict] = []
+
+    def compare_and_put(self, key: str, document: dict, expected_revision: Optional[int], previous: Optional[dict], sheet_id: Optional[str] = None) -> None:
+        """Adds a write of document, conditional on expected_revision. previous is the document it replaces;
+        sheet_id, the sheet the key belongs to, is what a conflict on it is reported against."""
+        self._writes.append({"key": key, "document": document, "expected_revision": expected_revision, "previous": previous, "sheet_id": sheet_id})
+
+    def commit(self) -> None:
+        if not self._writes:
+            return
+        journal_key = f"{JOURNAL_KEY_PREFIX}{uuid.uuid4().hex}{SHEET_KEY_SUFFIX}"
+        self.backend.put(journal_key, {"created_at": time.time(), "writes": self._writes})
+
+        def apply(write: dict) -> Any:
+            try:
+                return self.backend.compare_and_put(write["key"], write["document"], write["expected_revision"])
+            except Exception as e:
+                return e
+
+        results = parallel_map(apply, self._writes, thread_name_prefix="write-batch")
+        if all(result is True for result in results):
+            self.backend.delete(journal_key)
+            metrics.increment("write_batches.committed")
+            return
+
+        # Raises (and keeps the journal for recovery) if storage fails while rolling back
+        for write, result in zip(self._writes, results):
+            if result is True:
+                _undo_write(self.backend, write)
+        self.backend.delete(journal_key)
+        metrics.increment("write_batches.rolled_back")
+        error = next((result for result in results if isinstance(result, Exception)), None)
+        if error is not None:
+            raise error
+        failed = next(write for write, result in zip(self._writes, results) if result is not True)
+        raise RevisionConflictError(failed.get("sheet_id") or failed["key"], failed["expected_revision"])
+
+def recover_write_batches(backend: StorageBackend, min_age_seconds: float = WRITE_BATCH_RECOVERY_MIN_AGE_SECONDS) -> Dict[str, int]:
+    """Finishes batches whose writer died mid-commit, as recorded by their journals.
+
+    A batch is completed if none of its keys was written by anyone else instead of the batch: the
+    writes still pending are applied. It is rolled back if one of its writes never landed and another
+    writer took that key, unless a write of the batch that did land has been overwritten since, in
+    which case neither is safe: the journal is kept and the batch reported as unresolved.
+    Returns the number of batches completed, rolled back and unresolved.
+    """
+    counts = {"completed": 0, "rolled_back": 0, "unresolved": 0}
+    for journal_key in backend.list_keys():
+        if not journal_key.startswith(JOURNAL_KEY_PREFIX):
+            continue
+        try:
+            journal = decode_document(backend.get(journal_key), journal_key)
+            if journal is None or time.time() - journal.get("created_at", 0) < min_age_seconds:
+                continue
+            writes = journal["writes"]
+            states = [_write_state(backend, write) for write in writes]
+            if "foreign" not in states:
+                if not all(
+                    backend.compare_and_put(write["key"], write["document"], write["expected_revision"])
+                    for write, state in zip(writes, states) if state == "pending"
+                ):
+                    print(f"[EXPENSE_STORAGE] Write batch {journal_key} changed while it was being completed, will retry.")
+                    continue
+                counts["completed"] += 1
+                print(f"[EXPENSE_STORAGE] Completed interrupted write batch {journal_key}.")
+            elif "superseded" in states:
+                # Rolling back would undo later writes, completing would overwrite someone else's
+                counts["unresolved"] += 1
+                print(f"[EXPENSE_STORAGE] CRITICAL: Interrupted write batch {journal_key} can be neither completed nor rolled back; keeping its journal for manual repair.")
+                continue
+            else:
+                for write, state in zip(writes, states):
+                    if state == "applied":
+                        _undo_write(backend, write)
+                counts["rolled_back"] += 1
+                print(f"[EXPENSE_STORAGE] Rolled back interrupted write batch {journal_key}.")
+            backend.delete(journal_key)
+        except Exception as e:
+            print(f"[EXPENSE_STORAGE] Recovering write batch {journal_key} failed, will retry: {e}")
+    metrics.increment("write_batches.recovered_completed", counts["completed"])
+    metrics.increment("write_batches.recovered_rolled_back", counts["rolled_back"])
+    metrics.increment("write_batches.recovered_unresolved", counts["unresolved"])
+    return counts
+
+_recovery_thread: Optional[threading.Thread] = None
+
+def start_write_batch_recovery(backend: StorageBackend, interval_seconds: float = WRITE_BATCH_RECOVERY_INTERVAL_SECONDS) -> None:
+    """Runs recover_write_batches now and then every interval_seconds in a daemon thread (once per process)."""
+    global _recovery_thread
+    if interval_seconds <= 0 or _recovery_thread is not None:
+        return
+
+    def run() -> None:
+        while True:
+            try:
+                recover_write_batches(backend)
+            except Exception as e:
+                print(f"[EXPENSE_STORAGE] Write batch recovery failed: {e}")
+            time.sleep(interval_seconds)
+
+    _recovery_thread = threading.Thread(target=run, name="write-batch-recovery", daemon=True)
+    _recovery_thread.start()
+
+
+# --- Repository ---
+def _encoded_size(raw: Any, document: dict) -> int:
+    """Approximate stored size of a document, used to bound the cache in bytes."""
+    if isinstance(raw, (str, bytes)):
+        return len(raw)
+    return len(get_codec().encode(document))
+
+def _estimated_sheet_size(header: dict, entries: List[BaseModel]) -> int:
+    """Encoded size of a sheet extrapolated from one entry, so appends need not serialise the whole sheet."""
+    if not entries:
+        return len(get_codec().encode(header))
+    return len(get_codec().encode(header)) + len(entries) * len(entries[-1].model_dump_json())
+
+SheetT = TypeVar("SheetT", bound=BaseModel)
+
+class SheetChangeListener:
+    """Receives a callback after every successful sheet write. Used to maintain derived documents."""
+
+    def sheet_saved(self, sheet: BaseModel) -> None:
+        pass
+
+    def sheet_deleted(self, sheet_id: str, snapshot: Optional[dict] = None) -> None:
+        """snapshot is the last stored snapshot of the sheet (its sheet-level fields may predate the
+        latest writes), or None if it was unreadable."""
+        pass
+
+class ExpenseSheetRepository(Generic[SheetT]):
+    """Loads and stores expense sheets as validated models. All sheet I/O goes through here."""
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        sheet_model: Type[SheetT],
+        cache: Optional[SheetCache] = None,
+        log_compact_events: Optional[int] = None,
+        upgrade_document: Optional[Callable[[dict], dict]] = None,
+    ):
+        """upgrade_document is applied to every stored document before it is parsed (see expense_migrations)."""
+        self.backend = backend
+        self.sheet_model = sheet_model
+        self.upgrade_document = upgrade_document
+        self.log_compact_events = log_compact_events or DEFAULT_LOG_COMPACT_EVENTS
+        self.cache = cache if cache is not None and cache.enabled else None
+        self._listeners: List[SheetChangeListener] = []
+
+    def add_listener(self, listener: SheetChangeListener) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, method: str, *args) -> None:
+        # The sheet write already succeeded; derived documents can be rebuilt, so failures are only logged
+        for listener in self._listeners:
+            try:
+                getattr(listener, method)(*args)
+            except Exception as e:
+                print(f"[EXPENSE_STORAGE] {type(listener).__name__}.{method} failed: {e}")
+
+    def get(self, sheet_id: str) -> Optional[SheetT]:
+        """Returns the sheet, or None if it does not exist. Raises CorruptSheetError for unreadable data.
+
+        Cached sheets are shared between readers and must not be mutated; writes go through update(),
+        which changes a private copy.
+        """
+        if self.cache is not None:
+            cached = self.cache.get(sheet_id)
+            if cached is not None:
+                return cached
+        document, size = self._read_document(sheet_id)
+        if document is None:
+            return None
+        sheet = self.sheet_model(**document)
+        if self.cache is not None:
+            self.cache.put(sheet_id, sheet, size)
+        return sheet
+
+    def _read_document(self, sheet_id: str) -> Tuple[Optional[dict], int]:
+        """Returns (folded and upgraded document or None, encoded size of the stored documents)."""
+        storage_key = get_expense_sheet_storage_key(sheet_id)
+        raw = self.backend.get(storage_key)
+        snapshot = decode_document(raw, storage_key)
+        if snapshot is None:
+            return None, 0
+        log_key = get_expense_sheet_log_storage_key(sheet_id)
+        raw_log = self.backend.get(log_key)
+        log = decode_document(raw_log, log_key)
+        document = fold_sheet_document(snapshot, log, log_key)
+        if self.upgrade_document is not None:
+            document = self.upgrade_document(document)
+        if self.cache is None:
+            return document, 0
+        return document, _encoded_size(raw, snapshot) + (_encoded_size(raw_log, log) if log is not None else 0)
+
+    def get_document(self, sheet_id: str) -> Optional[dict]:
+        """Returns the sheet as a stored document (upgraded like get) without parsing it into the model.
+
+        For read-only aggregation over many sheets, where building models would dominate the cost
+        (see app.libs.entry_amounts). The document is not cached and is the caller's to modify.
+        """
+        return self._read_document(sheet_id)[0]
+
+    def exists(self, sheet_id: str) -> bool:
+        return bool(self.backend.get(get_expense_sheet_storage_key(sheet_id)))
+
+    def _write(self, sheet: SheetT, expected_revision: Optional[int], previous: Optional[SheetT] = None) -> None:
+        sheet.revision = (expected_revision or 0) + 1
+        try:
+            if expected_revision is None:
+                size = self._write_snapshot(sheet)
+            else:
+                size = self._append_to_log(sheet, expected_revision, previous)
+        except Exception:
+            sheet.revision = expected_revision or 0
+            if self.cache is not None:
+                # The cached copy may be what a stale write was based on
+                self.cache.invalidate(sheet.id)
+            raise
+        if self.cache is not None:
+            self.cache.put(sheet.id, sheet, size)
+        self._notify("sheet_saved", sheet)
+
+    def _write_snapshot(self, sheet: SheetT) -> int:
+        document = sheet.model_dump(mode='json')
+        if not self.backend.compare_and_put(get_expense_sheet_storage_key(sheet.id), document, None):
+            metrics.increment("sheet_writes.conflicts")
+            raise RevisionConflictError(sheet.id, None)
+        return _encoded_size(None, document)
+
+    def _append_to_log(self, sheet: SheetT, expected_revision: Optional[int], previous: Optional[SheetT]) -> int:
+        """Commits the write by compare-and-put on the sheet's log; compacts the log when it is long."""
+        write = self._prepare_log_write(sheet, expected_revision, previous)
+        if not self.backend.compare_and_put(write["key"], write["document"], write["expected_revision"]):
+            metrics.increment("sheet_writes.conflicts")
+            raise RevisionConflictError(sheet.id, expected_revision)
+        return self._log_written(sheet, write)
+
+    def _prepare_log_write(self, sheet: SheetT, expected_revision: Optional[int], previous: Optional[SheetT]) -> dict:
+        """Builds the new log document of the sheet. Returns the write as {key, document, expected_revision, previous}."""
+        log_key = get_expense_sheet_log_storage_key(sheet.id)
+        previous_log = log = decode_document(self.backend.get(log_key), log_key)
+        if log is None:
+            # First write since the sheet was created (or written in the snapshot-only format)
+            base_revision, events, log_expected_revision = expected_revision, [], None
+        else:
+            if document_revision(log) != expected_revision:
+                metrics.increment("sheet_writes.conflicts")
+                raise RevisionConflictError(sheet.id, expected_revision, document_revision(log))
+            base_revision, events, log_expected_revision = log["base_revision"], log["events"], expected_revision
+
+        header = sheet.model_dump(mode='json', exclude={"entries"})
+        new_events = None
+        if previous is not None:
+            new_events = sheet_entry_events(previous.entries, sheet.entries, sheet.revision)
+        if new_events is None:
+            new_events = [{"revision": sheet.revision, "op": "replace", "entries": [entry.model_dump(mode='json') for entry in sheet.entries]}]
+        log = {
+            "format_version": SHEET_LOG_FORMAT_VERSION,
+            "revision": sheet.revision,
+            "base_revision": base_revision,
+            "header": header,
+            "events": events + new_events,
+        }
+        return {"key": log_key, "document": log, "expected_revision": log_expected_revision, "previous": previous_log, "new_events": new_events}
+
+    def _log_written(self, sheet: SheetT, write: dict) -> int:
+        """Follow-up of a committed log write: compacts the log when it is long. Returns the sheet's cache size."""
+        log, new_events = write["document"], write["new_events"]
+        metrics.increment("sheet_writes.log_events", len(new_events))
+        if len(log["events"]) >= self.log_compact_events or (new_events and new_events[0]["op"] == "replace"):
+            self._compact(sheet, log)
+        return _estimated_sheet_size(log["header"], sheet.entries)
+
+    def _compact(self, sheet: SheetT, log: dict) -> None:
+        """Writes the sheet committed in log as the new snapshot, then truncates the log.
+        Either step may lose a race with another writer; the folded sheet is correct either way.
+        """
+        sheet_id = sheet.id
+        storage_key = get_expense_sheet_storage_key(sheet_id)
+        log_key = get_expense_sheet_log_storage_key(sheet_id)
+        revision = log["revision"]
+        try:
+            stored_revision = document_revision(decode_document(self.backend.get(storage_key), storage_key))
+            if stored_revision is None or stored_revision >= revision:
+                return
+            snapshot = sheet.model_dump(mode='json')
+            if not self.backend.compare_and_put(storage_key, snapshot, stored_revision):
+                return
+            truncated = {**log, "base_revision": revision, "events": []}
+            self.backend.compare_and_put(log_key, truncated, revision)
+            metrics.increment("sheet_writes.compactions")
+        except Exception as e:
+            # The write is already committed in the log; compaction is retried by the next write
+            print(f"[EXPENSE_STORAGE] Compacting the log of sheet {sheet_id} failed: {e}")
+
+    def create(self, sheet: SheetT) -> None:
+        """Stores a new sheet. Raises RevisionConflictError if a sheet with that id already exists."""
+        self._write(sheet, None)
+
+    def save(self, sheet: SheetT, previous: Optional[SheetT] = None) -> None:
+        """Stores the sheet if nobody else wrote it since it was loaded (compare-and-swap on revision)
+        and increments its revision. Raises RevisionConflictError otherwise.
+        previous is the sheet as loaded; when given, only the changed entries are written to the log.
+        The saved instance is cached, so it must not be mutated afterwards.
+        """
+        self._write(sheet, sheet.revision, previous)
+
+    def _get_expected(self, sheet_id: str, expected_revision: Optional[int]) -> SheetT:
+        """The sheet to base a write on, checked against expected_revision (e.g. from an If-Match header).
+
+        A cached sheet may lag behind storage, so a mismatch is only reported as RevisionConflictError
+        once the sheet has been re-read from storage and still differs.
+        """
+        sheet = self.get(sheet_id)
+        if sheet is not None and expected_revision is not None and sheet.revision != expected_revision and self.cache is not None:
+            self.cache.invalidate(sheet_id)
+            sheet = self.get(sheet_id)
+        if sheet is None:
+            raise SheetNotFoundError(sheet_id)
+        if expected_revision is not None and sheet.revision != expected_revision:
+            raise RevisionConflictError(sheet_id, expected_revision, sheet.revision)
+        return sheet
+
+    def update(
+        self,
+        sheet_id: str,
+        mutate: Callable[[SheetT], R],
+        expected_revision: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        rewrite: bool = False,
+    ) -> Tuple[SheetT, R]:
+        """Read-modify-write of one sheet with optimistic concurrency.
+
+        mutate(sheet) changes a private copy of the sheet in place and may raise to abort. On a revision
+        conflict the sheet is reloaded and mutate is applied again, up to max_attempts times, so mutate
+        must only depend on the sheet it is given. When expected_revision is given (e.g. from an If-Match
+        header) a mismatch is reported immediately instead of retried. rewrite=True stores the whole
+        sheet as a new snapshot instead of only the changed entries (used by migrations).
+        Returns the saved sheet and mutate's return value. Raises SheetNotFoundError if the sheet is missing.
+        """
+        attempts = max_attempts or DEFAULT_WRITE_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            previous = self._get_expected(sheet_id, expected_revision)
+            sheet = previous.model_copy(deep=True)
+            result = mutate(sheet)
+            try:
+                self.save(sheet, None if rewrite else previous)
+                return sheet, result
+            except RevisionConflictError:
+                if expected_revision is not None or attempt == attempts:
+                    raise
+                print(f"[EXPENSE_STORAGE] Revision conflict on sheet {sheet_id}, retrying ({attempt}/{attempts})")
+                metrics.increment("sheet_writes.retries")
+                time.sleep(random.uniform(0, 0.01 * attempt))
+        raise RevisionConflictError(sheet_id, expected_revision)
+
+    def update_many(
+        self,
+        mutations: Dict[str, Callable[[SheetT], Any]],
+        expected_revisions: Optional[Dict[str, int]] = None,
+        max_attempts: Optional[int] = None,
+    ) -> Dict[str, Tuple[SheetT, Any]]:
+        """Read-modify-write of several sheets, committed together as one WriteBatch.
+
+        Like update(), but for {sheet_id: mutate}. The mutations run in order on private copies, so a
+        later one may use what an earlier one captured (e.g. the entry removed from the origin of a
+        move). Either all sheets are written or none: a conflict on any of them rolls the batch back
+        and the whole read-modify-write is retried, unless the conflicting sheet is one of
+        expected_revisions. Returns {sheet_id: (saved sheet, mutate result)}.
+        """
+        expected_revisions = expected_revisions or {}
+        attempts = max_attempts or DEFAULT_WRITE_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            loaded: Dict[str, SheetT] = {}
+            for sheet_id in mutations:
+                loaded[sheet_id] = self._get_expected(sheet_id, expected_revisions.get(sheet_id))
+            results: Dict[str, Tuple[SheetT, Any]] = {}
+            for sheet_id, mutate in mutations.items():
+                sheet = loaded[sheet_id].model_copy(deep=True)
+                results[sheet_id] = (sheet, mutate(sheet))
+
+            batch = WriteBatch(self.backend)
+            writes: Dict[str, dict] = {}
+            try:
+                for sheet_id, (sheet, _) in results.items():
+                    sheet.revision = loaded[sheet_id].revision + 1
+                    writes[sheet_id] = self._prepare_log_write(sheet, loaded[sheet_id].revision, loaded[sheet_id])
+                    write = writes[sheet_id]
+                    batch.compare_and_put(write["key"], write["document"], write["expected_revision"], write["previous"], sheet_id)
+                batch.commit()
+            except RevisionConflictError as e:
+                if self.cache is not None:
+                    for sheet_id in mutations:
+                        self.cache.invalidate(sheet_id)
+                # A pinned sheet was written by someone else: report it, like update() does
+                if e.sheet_id in expected_revisions or attempt == attempts:
+                    raise
+                print(f"[EXPENSE_STORAGE] Revision conflict on sheets {list(mutations)}, retrying ({attempt}/{attempts})")
+                metrics.increment("sheet_writes.retries")
+                time.sleep(random.uniform(0, 0.01 * attempt))
+                continue
+
+            for sheet_id, (sheet, _) in results.items():
+                size = self._log_written(sheet, writes[sheet_id])
+                if self.cache is not None:
+                    self.cache.put(sheet_id, sheet, size)
+                self._notify("sheet_saved", sheet)
+            return results
+        raise RevisionConflictError(",".join(mutations), None)
+
+    def delete(self, sheet_id: str) -> bool:
+        """Deletes the sheet. Returns False if it did not exist."""
+        storage_key = get_expense_sheet_storage_key(sheet_id)
+        if self.cache is not None:
+            self.cache.invalidate(sheet_id)
+        raw = self.backend.get(storage_key)
+        if not raw:
+            return False
+        try:
+            snapshot = decode_document(raw, storage_key)
+        except CorruptSheetError:
+            snapshot = None
+        try:
+            self.backend.delete(storage_key)
+        except FileNotFoundError:
+            return False
+        log_key = get_expense_sheet_log_storage_key(sheet_id)
+        try:
+            # Without its snapshot the log is unreachable, so a failure here only leaves garbage behind
+            if self.backend.get(log_key):
+                self.backend.delete(log_key)
+        except Exception as e:
+            print(f"[EXPENSE_STORAGE] Could not delete the log of sheet {sheet_id}: {e}")
+        self._notify("sheet_deleted", sheet_id, snapshot)
+        return True
+
+    def list_sheet_ids(self) -> List[str]:
+        return list_key_ids(self.backend, SHEET_KEY_PREFIX, SHEET_KEY_SUFFIX)
+
+    def get_many(self, sheet_ids: List[str], max_workers: Optional[int] = None) -> List[SheetT]:
+        """Fetches and parses sheets in parallel, keeping the order of sheet_ids.
+
+        At most max_workers (default EXPENSE_STORAGE_FETCH_CONCURRENCY) reads are in flight, so a bulk
+        load costs roughly len(sheet_ids) / max_workers storage round-trips instead of one per sheet.
+        Missing sheets are omitted; unreadable sheets are logged and skipped.
+        """
+        def load(sheet_id: str) -> Optional[SheetT]:
+            try:
+                return self.get(sheet_id)
+            except Exception as e:
+                # Log errors for this specific sheet but continue with others
+                print(f"[EXPENSE_STORAGE] Error processing expense sheet {sheet_id}: {e}")
+                return None
+
+        return [sheet for sheet in parallel_map(load, sheet_ids, max_workers, "sheet-fetch") if sheet is not None]
+
+    def get_documents(self, sheet_ids: List[str]) -> List[dict]:
+        """Like get_many, but returns the stored documents (see get_document)."""
+        def load(sheet_id: str) -> Optional[dict]:
+            try:
+                return self.get_document(sheet_id)
+            except Exception as e:
+                print(f"[EXPENSE_STORAGE] Error reading expense sheet {sheet_id}: {e}")
+                return None
+
+        return [document for document in parallel_map(load, sheet_ids, thread_name_prefix="sheet-fetch") if document is not None]
+
+    def list_all(self, sheet_ids: Optional[List[str]] = None) -> List[SheetT]:
+        """Loads every stored sheet (or the given ones). Unreadable sheets are logged and skipped."""
+        return self.get_many(self.list_sheet_ids() if sheet_ids is None else sheet_ids)
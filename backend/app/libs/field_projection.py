@@ -0,0 +1,77 @@
+"""Sparse field projections for API reads (the `fields=` query parameter).
+
+A projection is a comma-separated list of field names; a dotted name selects fields of a nested
+model, also inside lists ("name,total_amount,entries.id,entries.daily_total"). It is parsed into
+a Pydantic include spec, so model_dump serializes only the selected fields:
+
+    projection = parse_field_projection("name,entries.daily_total", ExpenseSheet)
+    sheet.model_dump(mode='json', include=projection)
+
+project_document applies the same spec to an already serialized document (a catalog record), so
+reads that the catalog can answer need no model at all.
+"""
+
+import inspect
+import typing
+from typing import Any, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+
+def _nested_model(annotation: Any) -> Tuple[Optional[Type[BaseModel]], bool]:
+    """(model, is_list) of a field annotation such as Optional[Model] or List[Model]; (None, False) for scalars."""
+    origin = typing.get_origin(annotation)
+    if origin is typing.Union:
+        arguments = [argument for argument in typing.get_args(annotation) if argument is not type(None)]
+        return _nested_model(arguments[0]) if len(arguments) == 1 else (None, False)
+    if origin in (list, tuple, set):
+        model, _ = _nested_model(typing.get_args(annotation)[0])
+        return model, model is not None
+    if inspect.isclass(annotation) and issubclass(annotation, BaseModel):
+        return annotation, False
+    return None, False
+
+
+def _add_path(projection: Dict[str, Any], model: Type[BaseModel], parts: list, path: str) -> None:
+    name, rest = parts[0], parts[1:]
+    field = model.model_fields.get(name)
+    if field is None:
+        raise ValueError(f"Unknown field '{path}'. Expected some of {list(model.model_fields)}.")
+    if not rest:
+        projection[name] = True
+        return
+    nested, is_list = _nested_model(field.annotation)
+    if nested is None:
+        raise ValueError(f"Field '{name}' has no subfields (in '{path}').")
+    selection = projection.setdefault(name, {})
+    if selection is True:
+        return  # The whole field is selected already
+    if is_list:
+        selection = selection.setdefault("__all__", {})
+    _add_path(selection, nested, rest, path)
+
+
+def parse_field_projection(fields: str, model: Type[BaseModel]) -> Dict[str, Any]:
+    """Pydantic include spec of a `fields=` value for model. Raises ValueError for unknown fields."""
+    projection: Dict[str, Any] = {}
+    for path in fields.split(","):
+        path = path.strip()
+        if path:
+            _add_path(projection, model, path.split("."), path)
+    if not projection:
+        raise ValueError("fields must name at least one field.")
+    return projection
+
+
+def project_document(document: Any, projection: Dict[str, Any]) -> Any:
+    """Applies an include spec to a serialized document (dicts and lists)."""
+    if isinstance(document, list):
+        item_projection = projection.get("__all__", projection)
+        return [project_document(item, item_projection) for item in document]
+    if not isinstance(document, dict):
+        return document
+    projected = {}
+    for name, selection in projection.items():
+        if name in document:
+            projected[name] = document[name] if selection is True else project_document(document[name], selection)
+    return projected
@@ -0,0 +1,51 @@
+"""In-process metrics: monotonically increasing counters and value summaries (count/sum/min/max).
+
+Usage:
+
+    from app.libs import metrics
+
+    metrics.increment("sheet_cache.hits")
+    metrics.observe("sheet_locks.wait_seconds", waited)
+
+The current values are served by GET /routes/metrics (see app/apis/metrics_api). They are per
+worker process and reset on restart.
+"""
+
+import threading
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_summaries: Dict[str, Dict[str, float]] = {}
+
+
+def increment(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float) -> None:
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            _summaries[name] = {"count": 1, "sum": value, "min": value, "max": value}
+        else:
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+
+
+def snapshot() -> dict:
+    with _lock:
+        summaries = {
+            name: {**summary, "avg": summary["sum"] / summary["count"]}
+            for name, summary in _summaries.items()
+        }
+        return {"counters": dict(_counters), "summaries": summaries}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
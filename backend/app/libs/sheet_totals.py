@@ -0,0 +1,123 @@
+"""Running totals of an expense sheet: total_amount, per-category subtotals and entry_count.
+
+The totals are stored on the sheet and updated by O(1) deltas whenever an entry is added, updated,
+deleted or moved (add_entry_to_totals / remove_entry_from_totals), so the dashboard and the export
+footer read them instead of summing the entries. compute_sheet_totals recomputes them from the
+entries of a stored document; it is the upgrade to schema version 3 and the reference the stored
+totals are verified against:
+
+    python -m app.libs.sheet_totals            # report sheets whose stored totals do not match
+    python -m app.libs.sheet_totals --repair   # and rewrite them with recomputed totals
+"""
+
+import argparse
+from typing import Any, Dict, List, Tuple
+
+from app.libs.entry_amounts import AMOUNT_FIELDS, AmountColumns, EntryAmounts
+from app.libs.expense_storage import ExpenseSheetRepository
+
+# Fields of sheet.subtotals; the sum of daily_total is total_amount
+SUBTOTAL_FIELDS = tuple(field for field in AMOUNT_FIELDS if field != "daily_total")
+# Rounding error that adding and subtracting deltas may accumulate
+TOTALS_TOLERANCE = 1e-6
+
+
+def _apply_entry(sheet, entry, sign: int) -> None:
+    amounts = EntryAmounts.from_entry(entry)
+    subtotals = sheet.subtotals
+    for field in SUBTOTAL_FIELDS:
+        setattr(subtotals, field, getattr(subtotals, field) + sign * getattr(amounts, field))
+    sheet.total_amount += sign * amounts.daily_total
+    sheet.entry_count += sign
+    if sheet.entry_count == 0:
+        # Nothing left to sum; drop the accumulated rounding error
+        for field in SUBTOTAL_FIELDS:
+            setattr(subtotals, field, 0.0)
+        sheet.total_amount = 0.0
+
+def add_entry_to_totals(sheet, entry) -> None:
+    """Adds an entry's amounts to the sheet totals. Call after the entry's amounts are final."""
+    _apply_entry(sheet, entry, 1)
+
+def remove_entry_from_totals(sheet, entry) -> None:
+    """Removes an entry's amounts from the sheet totals. To update an entry, remove it before
+    changing its amounts and add it again afterwards."""
+    _apply_entry(sheet, entry, -1)
+
+
+def recompute_totals(sheet) -> None:
+    """Recomputes the totals of a sheet model from all of its entries, O(entries)."""
+    totals = AmountColumns.from_entries(sheet.entries).totals()
+    sheet.total_amount = totals.pop("daily_total")
+    sheet.subtotals = type(sheet.subtotals)(**totals)
+    sheet.entry_count = len(sheet.entries)
+
+def amount_totals(sheet) -> Dict[str, float]:
+    """Stored sums of every amount field (AMOUNT_FIELDS) of a sheet model, without reading its entries."""
+    return {**sheet.subtotals.model_dump(), "daily_total": sheet.total_amount}
+
+
+def compute_sheet_totals(entries: List[dict]) -> dict:
+    """Totals of stored entry documents, keyed like the sheet fields that hold them."""
+    totals = AmountColumns.from_documents(entries).totals()
+    return {"total_amount": totals.pop("daily_total"), "subtotals": totals, "entry_count": len(entries)}
+
+def sheet_totals_mismatches(document: dict) -> Dict[str, Tuple[Any, Any]]:
+    """Compares the stored totals of a sheet document with its entries.
+    Returns {field: (stored, expected)} for every total that does not match.
+    """
+    expected = compute_sheet_totals(document.get("entries") or [])
+    stored_subtotals = document.get("subtotals") or {}
+    checks = [
+        ("total_amount", document.get("total_amount"), expected["total_amount"]),
+        ("entry_count", document.get("entry_count"), expected["entry_count"]),
+    ]
+    checks.extend((f"subtotals.{field}", stored_subtotals.get(field), expected["subtotals"][field]) for field in SUBTOTAL_FIELDS)
+    return {
+        field: (stored, value) for field, stored, value in checks
+        if stored is None or abs(stored - value) > TOTALS_TOLERANCE
+    }
+
+def assert_sheet_totals(document: dict) -> None:
+    """Raises AssertionError if the stored totals of a sheet document do not match its entries."""
+    mismatches = sheet_totals_mismatches(document)
+    if mismatches:
+        raise AssertionError(f"Totals of sheet {document.get('id')} do not match its entries: {mismatches}")
+
+
+def verify_sheet_totals(repository: ExpenseSheetRepository, repair: bool = False) -> Dict[str, int]:
+    """Checks the stored totals of every sheet, rewriting wrong ones if repair.
+    Returns the number of sheets per outcome: ok, mismatched, repaired, failed.
+    """
+    counts = {"ok": 0, "mismatched": 0, "repaired": 0, "failed": 0}
+    for sheet_id in repository.list_sheet_ids():
+        try:
+            document = repository.get_document(sheet_id)
+            if document is None:
+                continue
+            mismatches = sheet_totals_mismatches(document)
+            if not mismatches:
+                counts["ok"] += 1
+                continue
+            counts["mismatched"] += 1
+            print(f"[SHEET_TOTALS] Sheet {sheet_id} totals do not match its entries: {mismatches}")
+            if repair:
+                repository.update(sheet_id, recompute_totals)
+                counts["repaired"] += 1
+        except Exception as e:
+            print(f"[SHEET_TOTALS] Could not verify sheet {sheet_id}: {e}")
+            counts["failed"] += 1
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Verify the stored totals of every expense sheet against its entries.")
+    parser.add_argument("--repair", action="store_true", help="Rewrite sheets whose totals do not match.")
+    args = parser.parse_args()
+    from app.apis.expense_api import sheet_repository
+    counts = verify_sheet_totals(sheet_repository, repair=args.repair)
+    print(f"[SHEET_TOTALS] Done: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Codec for the canonical on-disk encoding of storage documents.
+
+Canonical encoding: every stored document is a JSON object, written as compact UTF-8 JSON.
+Documents are never stored as a JSON-encoded string inside JSON (the form older handlers produced
+with model_dump_json); decode_document in expense_storage still reads that legacy form.
+
+The codec is selected with EXPENSE_STORAGE_CODEC:
+
+    auto    (default) orjson if it is installed, otherwise json
+    orjson  orjson (fails at startup if it is not installed)
+    json    the standard library
+
+Both codecs produce the same JSON, so the choice can change at any time without migrating data.
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional, Type
+
+try:
+    import orjson
+except ImportError:  # Optional; the standard library codec is used instead
+    orjson = None
+
+
+class StorageCodec:
+    name = "abstract"
+
+    def encode(self, document: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: Any) -> Any:
+        """Decodes str or bytes. Raises ValueError for invalid JSON."""
+        raise NotImplementedError
+
+
+class JsonCodec(StorageCodec):
+    name = "json"
+
+    def encode(self, document: Any) -> bytes:
+        return json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def decode(self, data: Any) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(StorageCodec):
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("EXPENSE_STORAGE_CODEC=orjson requires the orjson package.")
+
+    def encode(self, document: Any) -> bytes:
+        return orjson.dumps(document)
+
+    def decode(self, data: Any) -> Any:
+        return orjson.loads(data)
+
+
+_CODECS: Dict[str, Type[StorageCodec]] = {"json": JsonCodec, "orjson": OrjsonCodec}
+_codec: Optional[StorageCodec] = None
+
+def get_codec() -> StorageCodec:
+    """Returns the process-wide codec selected by EXPENSE_STORAGE_CODEC."""
+    global _codec
+    if _codec is None:
+        codec_name = os.environ.get("EXPENSE_STORAGE_CODEC", "auto").lower()
+        if codec_name == "auto":
+            codec_name = "orjson" if orjson is not None else "json"
+        codec_class = _CODECS.get(codec_name)
+        if codec_class is None:
+            raise ValueError(f"Unknown EXPENSE_STORAGE_CODEC '{codec_name}'. Expected one of {sorted(_CODECS)} or 'auto'.")
+        _codec = codec_class()
+    return _codec
@@ -0,0 +1,107 @@
+"""Benchmark of the columnar analytics engine at 1M entries.
+
+Stores synthetic sheets in the in-memory backend and times a report grouped by company and month
+over a one-year date range:
+
+    python-loop   grouping the stored entry documents with a dict in plain Python (the baseline;
+                  parsing them into models first would be slower still)
+    columns cold  ExpenseAnalytics with an empty cache: load, convert and reduce every sheet with
+                  entries in the range (the catalog's entry_date_range skips the others)
+    columns warm  ExpenseAnalytics again, with every sheet's columns cached at its revision
+
+Run from the backend directory:
+
+    python benchmarks/analytics_benchmark.py [--sheets 2000] [--entries-per-sheet 500]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.libs.entry_amounts import AMOUNT_FIELDS  # noqa: E402
+from app.libs.expense_analytics import ExpenseAnalytics  # noqa: E402
+from app.libs.expense_cache import SheetCache  # noqa: E402
+from app.libs.expense_storage import ExpenseSheetRepository, InMemoryStorageBackend, get_expense_sheet_storage_key  # noqa: E402
+
+COMPANIES = [f"Company {index}" for index in range(200)]
+PROJECTS = [f"Project {index}" for index in range(50)]
+LOCATIONS = ["Madrid", "Zaragoza", "Bilbao", "Sevilla", "Valencia"]
+
+
+def make_sheet(index: int, entry_count: int) -> dict:
+    year, month = 2020 + index % 6, index % 12 + 1
+    entries = []
+    for _ in range(entry_count):
+        amounts = {field: round(random.uniform(0, 60), 2) if random.random() < 0.3 else 0.0 for field in AMOUNT_FIELDS}
+        amounts["daily_total"] = round(sum(amounts.values()), 2)
+        entries.append({
+            "entry_date": f"{year}-{month:02d}-{random.randint(1, 28):02d}",
+            "company": random.choice(COMPANIES),
+            "project": random.choice(PROJECTS),
+            "location": random.choice(LOCATIONS),
+            **amounts,
+        })
+    return {
+        "id": f"sheet-{index}", "user_id": f"user-{index % 40}", "currency": "EUR",
+        "year": year, "month": month, "revision": 1, "schema_version": 3, "entries": entries,
+    }
+
+
+def python_loop(repository: ExpenseSheetRepository, records, date_from: datetime.date, date_to: datetime.date) -> dict:
+    groups = {}
+    first, last = date_from.isoformat(), date_to.isoformat()
+    for record in records:
+        for entry in repository.get_document(record["id"])["entries"]:
+            if not first <= entry["entry_date"] <= last:
+                continue
+            totals = groups.setdefault((entry["company"], entry["entry_date"][:7]), dict.fromkeys(AMOUNT_FIELDS, 0.0))
+            for field in AMOUNT_FIELDS:
+                totals[field] += entry[field] or 0.0
+    return groups
+
+
+def timed(label: str, function):
+    started = time.perf_counter()
+    result = function()
+    print(f"{label:<14} {time.perf_counter() - started:8.2f} s")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark cross-sheet analytics.")
+    parser.add_argument("--sheets", type=int, default=2000)
+    parser.add_argument("--entries-per-sheet", type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(42)
+    backend = InMemoryStorageBackend()
+    # Only get_document is used, which does not parse documents into the model
+    repository = ExpenseSheetRepository(backend, dict)
+    records = []
+    for index in range(args.sheets):
+        document = make_sheet(index, args.entries_per_sheet)
+        backend.put(get_expense_sheet_storage_key(document["id"]), document)
+        dates = [entry["entry_date"] for entry in document["entries"]]
+        records.append({"id": document["id"], "revision": document["revision"], "entry_date_range": [min(dates), max(dates)] if dates else None})
+    print(f"{args.sheets} sheets, {args.sheets * args.entries_per_sheet:,} entries")
+
+    date_from, date_to = datetime.date(2023, 1, 1), datetime.date(2023, 12, 31)
+    expected = timed("python-loop", lambda: python_loop(repository, records, date_from, date_to))
+    analytics = ExpenseAnalytics(repository, SheetCache(max_entries=args.sheets, max_bytes=2 * 1024 ** 3, ttl_seconds=float("inf")))
+    timed("columns cold", lambda: analytics.aggregate(records, group_by=["company", "month"], date_from=date_from, date_to=date_to))
+    result = timed("columns warm", lambda: analytics.aggregate(records, group_by=["company", "month"], date_from=date_from, date_to=date_to))
+
+    assert len(result["groups"]) == len(expected)
+    for group in result["groups"]:
+        key = (group["key"]["company"], group["key"]["month"])
+        assert abs(group["totals"]["daily_total"] - expected[key]["daily_total"]) < 1e-6
+    print(f"{result['entry_count']:,} entries in range, {len(result['groups'])} groups, results match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark of the storage codecs on expense sheet documents.
+
+Compares encode/decode time and encoded size of the standard library codec and orjson for
+synthetic sheets, and the size of the legacy JSON-in-JSON form (model_dump_json stored as a JSON
+string) that the canonical encoding replaces. Run from the backend directory:
+
+    python benchmarks/codec_benchmark.py [--entries 1000] [--repeat 50]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# The models are imported from the API module: keep it off real storage
+os.environ.setdefault("EXPENSE_STORAGE_BACKEND", "memory")
+os.environ.setdefault("EXPENSE_WRITE_BATCH_RECOVERY_INTERVAL_SECONDS", "0")
+
+from app.apis.expense_api import ExpenseEntry, ExpenseSheet  # noqa: E402
+from app.libs.sheet_totals import recompute_totals  # noqa: E402
+from app.libs.storage_codec import JsonCodec, OrjsonCodec, StorageCodec, orjson  # noqa: E402
+
+SHEET_ID = str(uuid.uuid4())
+
+
+def make_entry(index: int) -> ExpenseEntry:
+    kilometers = random.choice([0.0, 0.0, 12.5, 48.0, 130.0])
+    amounts = {
+        field: round(random.uniform(0, 60), 2) if random.random() < 0.4 else 0.0
+        for field in ("parking_amount", "taxi_amount", "transport_amount", "hotel_amount", "lunch_amount", "dinner_amount", "miscellaneous_amount")
+    }
+    km_amount = round(kilometers * 0.26, 2)
+    return ExpenseEntry(
+        expense_sheet_id=SHEET_ID,
+        entry_date=datetime.date(2025, 3, index % 28 + 1),
+        merchant_name=f"Visita cliente {index} - Almacén Zaragoza",
+        project=random.choice(["CRM", "ERP", None]),
+        company="Expense Flow S.L.",
+        location=random.choice(["Madrid", "Zaragoza", "Bilbao"]),
+        payment_method=random.choice(["TARJETA", "EFECTIVO"]),
+        kilometers=kilometers,
+        km_rate=0.26,
+        km_amount=km_amount,
+        **amounts,
+        daily_total=round(sum(amounts.values()) + km_amount, 2),
+        created_at=datetime.datetime(2025, 3, 1, 9, 30),
+        updated_at=datetime.datetime(2025, 3, 2, 18, 15),
+    )
+
+
+def make_sheet(entry_count: int) -> dict:
+    """A sheet document as the repository stores it."""
+    sheet = ExpenseSheet(
+        id=SHEET_ID,
+        user_id="benchmark-user",
+        name="Marzo 2025",
+        month=3,
+        year=2025,
+        currency="EUR",
+        entries=[make_entry(index) for index in range(entry_count)],
+        revision=7,
+        schema_version=3,
+        created_at=datetime.datetime(2025, 3, 1, 9, 0),
+        updated_at=datetime.datetime(2025, 3, 31, 19, 0),
+    )
+    recompute_totals(sheet)
+    return sheet.model_dump(mode='json')
+
+
+def measure_ms(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def run(codec: StorageCodec, document: dict, repeat: int) -> None:
+    encoded = codec.encode(document)
+    encode_ms = measure_ms(lambda: codec.encode(document), repeat)
+    decode_ms = measure_ms(lambda: codec.decode(encoded), repeat)
+    print(f"{codec.name:<8} encode {encode_ms:8.2f} ms   decode {decode_ms:8.2f} ms   size {len(encoded):>10,} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare storage codecs on synthetic expense sheets.")
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(42)
+    document = make_sheet(args.entries)
+    print(f"Sheet with {args.entries} entries, median of {args.repeat} runs")
+
+    codecs = [JsonCodec()] + ([OrjsonCodec()] if orjson is not None else [])
+    for codec in codecs:
+        run(codec, document, args.repeat)
+    if orjson is None:
+        print("orjson    not installed, skipped")
+
+    # The legacy form: the sheet serialised to a string, stored as a JSON string
+    legacy = json.dumps(json.dumps(document))
+    legacy_decode_ms = measure_ms(lambda: json.loads(json.loads(legacy)), args.repeat)
+    print(f"legacy   decode {legacy_decode_ms:8.2f} ms (double)          size {len(legacy.encode()):>10,} bytes")
+
+
+if __name__ == "__main__":
+    main()
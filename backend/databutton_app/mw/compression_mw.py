@@ -0,0 +1,227 @@
+"""Negotiated gzip/brotli compression of HTTP responses.
+
+Expense sheets (entries with long Drive links) and the base64 Excel exports are JSON that
+compresses several times over. Responses are compressed with the encoding the client prefers in
+Accept-Encoding, among those configured; brotli is only offered when the brotli package is
+installed. Responses smaller than the threshold, already encoded, or of media types that are
+compressed already (the receipts ZIP, images, video, audio, PDF) are sent as they are. Streamed
+responses are compressed chunk by chunk. A strong ETag is made weak on a compressed response, whose
+bytes differ from the uncompressed one's; the expense API accepts weak tags in If-Match and
+If-None-Match alike.
+
+Configuration (environment variables):
+
+    RESPONSE_COMPRESSION_ENCODINGS       default "br,gzip", in order of preference; empty disables compression
+    RESPONSE_COMPRESSION_MIN_BYTES       default 1024
+    RESPONSE_COMPRESSION_GZIP_LEVEL      default 6 (1-9)
+    RESPONSE_COMPRESSION_BROTLI_QUALITY  default 4 (0-11)
+
+Metrics (see app.libs.metrics): http_compression.<encoding>.responses, .bytes_in and .bytes_out
+counters, and http_compression.<encoding>.ratio (compressed / original size) and .cpu_seconds
+summaries per compressed response; http_compression.skipped.<reason> counters.
+"""
+
+import os
+import time
+import zlib
+from typing import Any, Callable
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.libs import metrics
+
+try:
+    import brotli
+except ImportError:  # Optional; only gzip is offered without it
+    brotli = None
+
+# Media types that are compressed already; compressing them again costs CPU for no gain
+INCOMPRESSIBLE_MEDIA_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-7z-compressed",
+    "application/x-rar-compressed", "application/x-bzip2", "application/pdf", "application/octet-stream",
+    "text/event-stream",
+}
+INCOMPRESSIBLE_MEDIA_PREFIXES = ("image/", "video/", "audio/", "font/woff")
+
+
+def parse_accept_encoding(header: str | None) -> dict[str, float]:
+    """{coding: q} of an Accept-Encoding header: "br;q=1.0, gzip;q=0.5" -> {"br": 1.0, "gzip": 0.5}."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, parameters = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for parameter in parameters.split(";"):
+            name, _, value = parameter.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def negotiate_encoding(header: str | None, encodings: list[str]) -> str | None:
+    """The encoding of encodings (in server preference order) with the highest q, or None."""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def is_compressible(content_type: str | None) -> bool:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type not in INCOMPRESSIBLE_MEDIA_TYPES and not media_type.startswith(INCOMPRESSIBLE_MEDIA_PREFIXES)
+
+
+class _Compressor:
+    """Streaming compressor of one response."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=brotli_quality)
+            self._process: Callable[[bytes], bytes] = compressor.process
+            self._finish: Callable[[], bytes] = compressor.finish
+        else:
+            compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._process = compressor.compress
+            self._finish = compressor.flush
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def _timed(self, function: Callable[..., bytes], *args: Any) -> bytes:
+        started = time.thread_time()
+        data = function(*args)
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_out += len(data)
+        return data
+
+    def process(self, data: bytes) -> bytes:
+        self.bytes_in += len(data)
+        return self._timed(self._process, data)
+
+    def finish(self) -> bytes:
+        return self._timed(self._finish)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: list[str] | None = None,
+        min_bytes: int | None = None,
+        gzip_level: int | None = None,
+        brotli_quality: int | None = None,
+    ) -> None:
+        self.app = app
+        if encodings is None:
+            encodings = [
+                encoding.strip().lower()
+                for encoding in os.environ.get("RESPONSE_COMPRESSION_ENCODINGS", "br,gzip").split(",")
+                if encoding.strip()
+            ]
+        self.encodings = [encoding for encoding in encodings if encoding == "gzip" or (encoding == "br" and brotli is not None)]
+        self.min_bytes = min_bytes if min_bytes is not None else int(os.environ.get("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+        self.gzip_level = gzip_level if gzip_level is not None else int(os.environ.get("RESPONSE_COMPRESSION_GZIP_LEVEL", "6"))
+        self.brotli_quality = brotli_quality if brotli_quality is not None else int(os.environ.get("RESPONSE_COMPRESSION_BROTLI_QUALITY", "4"))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressedResponse(self, encoding, send).send)
+
+
+class _CompressedResponse:
+    """Wraps the send of one response: holds back the start message until the first body chunk
+    shows whether the response is worth compressing."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start: Message | None = None
+        self.compressor: _Compressor | None = None
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+        if self.compressor is not None:
+            await self._send_compressed(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        headers = MutableHeaders(raw=self.start["headers"])
+        skip_reason = self._skip_reason(headers, body, more_body)
+        if skip_reason is not None:
+            metrics.increment(f"http_compression.skipped.{skip_reason}")
+            self.passthrough = True
+            await self._send(self.start)
+            await self._send(message)
+            return
+
+        self.compressor = _Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag is not None and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+        if "content-length" in headers:
+            del headers["content-length"]
+        if not more_body:
+            # Whole body at once: send it with its compressed length
+            compressed = self.compressor.process(body) + self.compressor.finish()
+            headers["Content-Length"] = str(len(compressed))
+            await self._send(self.start)
+            await self._send({"type": "http.response.body", "body": compressed})
+            self._observe()
+            return
+        await self._send(self.start)
+        await self._send_compressed(message)
+
+    def _skip_reason(self, headers: MutableHeaders, body: bytes, more_body: bool) -> str | None:
+        if self.start["status"] < 200 or self.start["status"] in (204, 304):
+            return "no_content"
+        if "content-encoding" in headers:
+            return "already_encoded"
+        if not is_compressible(headers.get("content-type")):
+            return "media_type"
+        if not more_body and len(body) < self.middleware.min_bytes:
+            return "below_threshold"
+        return None
+
+    async def _send_compressed(self, message: Message) -> None:
+        more_body = message.get("more_body", False)
+        data = self.compressor.process(message.get("body", b""))
+        if not more_body:
+            data += self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+        if not more_body:
+            self._observe()
+
+    def _observe(self) -> None:
+        compressor = self.compressor
+        prefix = f"http_compression.{self.encoding}"
+        metrics.increment(f"{prefix}.responses")
+        metrics.increment(f"{prefix}.bytes_in", compressor.bytes_in)
+        metrics.increment(f"{prefix}.bytes_out", compressor.bytes_out)
+        if compressor.bytes_in:
+            metrics.observe(f"{prefix}.ratio", compressor.bytes_out / compressor.bytes_in)
+        metrics.observe(f"{prefix}.cpu_seconds", compressor.cpu_seconds)
@@ -7,6 +7,7 @@ from fastapi import FastAPI, APIRouter, Depends
 dotenv.load_dotenv()
 
 from databutton_app.mw.auth_mw import AuthConfig, get_authorized_user
+from databutton_app.mw.compression_mw import CompressionMiddleware
 
 
 def get_router_config() -> dict:
@@ -78,6 +79,8 @@ def create_app() -> FastAPI:
     """Create the app. This is called by uvicorn with the factory option to construct the app object."""
     app = FastAPI()
     app.include_router(import_api_routers())
+    # gzip/brotli for large JSON responses; configured through RESPONSE_COMPRESSION_* variables
+    app.add_middleware(CompressionMiddleware)
 
     for route in app.routes:
         if hasattr(route, "methods"):
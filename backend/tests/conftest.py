@@ -0,0 +1,80 @@
+import os
+
+# Before the API modules are imported: process-local storage, no background recovery thread
+os.environ["EXPENSE_STORAGE_BACKEND"] = "memory"
+os.environ["EXPENSE_WRITE_BATCH_RECOVERY_INTERVAL_SECONDS"] = "0"
+
+import datetime
+
+import pytest
+
+from app.libs.expense_cache import SheetCache
+from app.libs.expense_migrations import SHEET_SCHEMA_VERSION, upgrade_sheet_document
+from app.libs.expense_storage import ExpenseSheetRepository, InMemoryStorageBackend
+
+
+def make_sheet(sheet_id: str = "sheet-1", user_id: str = "user-1", **fields):
+    from app.apis.expense_api import ExpenseSheet
+
+    now = datetime.datetime(2025, 5, 1, 12, 0, 0)
+    return ExpenseSheet(**{
+        "id": sheet_id,
+        "user_id": user_id,
+        "name": f"Sheet {sheet_id}",
+        "month": 5,
+        "year": 2025,
+        "currency": "EUR",
+        "payment_method_filter": "TARJETA",
+        "created_at": now,
+        "updated_at": now,
+        "schema_version": SHEET_SCHEMA_VERSION,
+        **fields,
+    })
+
+
+def make_entry(sheet_id: str = "sheet-1", entry_id: str = None, **fields):
+    from app.apis.expense_api import ExpenseEntry
+
+    fields = {"entry_date": datetime.date(2025, 5, 3), "payment_method": "TARJETA", "parking_amount": 10.0, **fields}
+    entry = ExpenseEntry(**({"id": entry_id} if entry_id else {}), expense_sheet_id=sheet_id, **fields)
+    entry.daily_total = sum(getattr(entry, field) or 0.0 for field in ("parking_amount", "taxi_amount", "transport_amount", "hotel_amount", "lunch_amount", "dinner_amount", "miscellaneous_amount"))
+    return entry
+
+
+@pytest.fixture
+def backend():
+    return InMemoryStorageBackend()
+
+
+@pytest.fixture
+def repository(backend):
+    from app.apis.expense_api import DEFAULT_KM_RATE, ExpenseSheet
+
+    cache = SheetCache(max_entries=64, max_bytes=16 * 1024 * 1024, ttl_seconds=60)
+    return ExpenseSheetRepository(
+        backend,
+        ExpenseSheet,
+        cache=cache,
+        upgrade_document=lambda document: upgrade_sheet_document(document, DEFAULT_KM_RATE),
+    )
+
+
+API_PREFIX = "/routes/expense-management"
+
+
+@pytest.fixture
+def client():
+    """The expense API as user-1, on the process-wide in-memory backend."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    import app.apis.expense_api as expense_api
+    from databutton_app.mw.auth_mw import User, get_authorized_user
+
+    api = FastAPI()
+    api.include_router(expense_api.router, prefix="/routes")
+    api.dependency_overrides[get_authorized_user] = lambda: User(sub="user-1")
+    yield TestClient(api)
+    # Not left to the exit handlers, which run after thread pools are shut down
+    expense_api.sheet_search.flush()
+    expense_api.sheet_duplicates.flush()
@@ -0,0 +1,101 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from databutton_app.mw import compression_mw
+from databutton_app.mw.compression_mw import CompressionMiddleware, negotiate_encoding
+
+BODY = json.dumps({"entries": [{"merchant_name": "Repsol", "receipt": "https://drive.google.com/file/d/abc"}] * 200}).encode()
+
+
+@pytest.fixture
+def client():
+    api = FastAPI()
+
+    @api.get("/json")
+    def json_body(size: int = len(BODY)):
+        return Response(BODY[:size], media_type="application/json", headers={"ETag": '"sheet-1.3"'})
+
+    @api.get("/zip")
+    def zip_body():
+        return Response(BODY, media_type="application/zip")
+
+    @api.get("/encoded")
+    def encoded_body():
+        return Response(gzip.compress(BODY), media_type="application/json", headers={"Content-Encoding": "gzip"})
+
+    @api.get("/stream")
+    def stream_body():
+        return StreamingResponse(iter([BODY[:100], BODY[100:]]), media_type="application/json")
+
+    api.add_middleware(CompressionMiddleware, encodings=["br", "gzip"], min_bytes=1024)
+    return TestClient(api)
+
+
+def _get(client, path, accept_encoding):
+    return client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+
+def test_negotiation():
+    encodings = ["br", "gzip"]
+    assert negotiate_encoding("gzip, br", encodings) == "br"
+    assert negotiate_encoding("br;q=0.5, gzip", encodings) == "gzip"
+    assert negotiate_encoding("br;q=0, gzip;q=0.1", encodings) == "gzip"
+    assert negotiate_encoding("*;q=0.2, br;q=0", encodings) == "gzip"
+    assert negotiate_encoding("identity", encodings) is None
+    assert negotiate_encoding("gzip;q=0", encodings) is None
+    assert negotiate_encoding(None, encodings) is None
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [("gzip", "gzip"), ("gzip;q=0.5, br", "br")])
+def test_compressed_response(client, accept_encoding, encoding):
+    if encoding == "br" and compression_mw.brotli is None:
+        pytest.skip("brotli is not installed")
+    response = _get(client, "/json", accept_encoding)
+    assert response.headers["Content-Encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) < len(BODY)
+    assert response.content == BODY
+
+
+def test_compressed_response_has_a_weak_etag(client):
+    assert _get(client, "/json", "gzip").headers["ETag"] == 'W/"sheet-1.3"'
+    assert _get(client, "/json", "identity").headers["ETag"] == '"sheet-1.3"'
+
+
+@pytest.mark.parametrize("accept_encoding", ["identity", "gzip;q=0, br;q=0", ""])
+def test_uncompressed_when_not_accepted(client, accept_encoding):
+    response = _get(client, "/json", accept_encoding)
+    assert "Content-Encoding" not in response.headers
+    assert response.content == BODY
+
+
+def test_small_responses_are_not_compressed(client):
+    response = _get(client, "/json?size=1023", "gzip")
+    assert "Content-Encoding" not in response.headers
+    assert response.content == BODY[:1023]
+    assert _get(client, "/json?size=1024", "gzip").headers["Content-Encoding"] == "gzip"
+
+
+def test_incompressible_media_types_are_sent_as_they_are(client):
+    response = _get(client, "/zip", "gzip")
+    assert "Content-Encoding" not in response.headers
+    assert response.content == BODY
+
+
+def test_encoded_responses_are_sent_as_they_are(client):
+    response = _get(client, "/encoded", "br, gzip")
+    # Encoded once by the app, so the client decodes it once
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.content == BODY
+
+
+def test_streamed_response_is_compressed(client):
+    response = _get(client, "/stream", "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert response.content == BODY
@@ -0,0 +1,83 @@
+import uuid
+
+import pytest
+
+from conftest import API_PREFIX
+
+DUPLICATE_ENTRIES_HEADER = "X-Duplicate-Entries"
+
+
+@pytest.fixture
+def sheets(client):
+    """Two sheets of user-1, and a merchant name no other test uses (the API's storage is shared)."""
+    sheet_ids = []
+    for name in ("origin", "destination"):
+        response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": name, "month": 5, "year": 2025, "currency": "EUR", "payment_method_filter": "TARJETA"})
+        assert response.status_code == 201
+        sheet_ids.append(response.json()["id"])
+    return sheet_ids, f"Shop {uuid.uuid4().hex}"
+
+
+def _entry(merchant_name, amount=12.5):
+    return {"entry_date": "2025-05-02", "payment_method": "TARJETA", "merchant_name": merchant_name, "parking_amount": amount}
+
+
+def _add(client, sheet_id, entry):
+    response = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries", json=entry)
+    assert response.status_code == 201
+    return response
+
+
+def _entry_ids(client, sheet_id):
+    return [entry["id"] for entry in client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}").json()["entries"]]
+
+
+def _duplicates(response):
+    header = response.headers.get(DUPLICATE_ENTRIES_HEADER)
+    return header.split(", ") if header else []
+
+
+def test_single_entry_create(client, sheets):
+    (origin, _), merchant = sheets
+    assert _duplicates(_add(client, origin, _entry(merchant))) == []
+    first = _entry_ids(client, origin)[0]
+    assert _duplicates(_add(client, origin, _entry(merchant))) == [f"{origin}/{first}"]
+
+
+def test_batch_create(client, sheets):
+    (origin, destination), merchant = sheets
+    _add(client, destination, _entry(merchant))
+    existing = _entry_ids(client, destination)[0]
+
+    response = client.post(f"{API_PREFIX}/expense-sheets/{origin}/entries/batch", json={"entries": [_entry(merchant), _entry(merchant, 1.0)]})
+    assert response.status_code == 200
+    assert _duplicates(response) == [f"{destination}/{existing}"]
+    assert [len(result["duplicates"] or []) for result in response.json()["results"]] == [1, 0]
+
+
+def test_entry_update_and_move(client, sheets):
+    (origin, destination), merchant = sheets
+    _add(client, origin, _entry(merchant))
+    _add(client, origin, _entry(merchant, 1.0))
+    first, second = _entry_ids(client, origin)
+
+    response = client.put(f"{API_PREFIX}/expense-sheets/{origin}/entries/{second}", json={"parking_amount": 12.5})
+    assert _duplicates(response) == [f"{origin}/{first}"]
+    response = client.put(f"{API_PREFIX}/expense-sheets/{origin}/entries/{second}", json={"new_sheet_id": destination})
+    assert _duplicates(response) == [f"{origin}/{first}"]
+
+
+def test_batch_update_and_move(client, sheets):
+    (origin, destination), merchant = sheets
+    for amount in (12.5, 1.0, 2.0):
+        _add(client, origin, _entry(merchant, amount))
+    first, second, third = _entry_ids(client, origin)
+
+    updates = [{"entry_id": second, "parking_amount": 12.5}, {"entry_id": third, "new_sheet_id": destination}]
+    response = client.patch(f"{API_PREFIX}/expense-sheets/{origin}/entries/batch", json={"updates": updates})
+    assert response.status_code == 200
+    assert _duplicates(response) == [f"{origin}/{first}"]
+
+    # A moved entry is still checked against the sheet it left
+    response = client.patch(f"{API_PREFIX}/expense-sheets/{origin}/entries/batch", json={"updates": [{"entry_id": second, "new_sheet_id": destination}]})
+    assert _duplicates(response) == [f"{origin}/{first}"]
@@ -0,0 +1,56 @@
+import pytest
+
+from app.libs.entry_amounts import AMOUNT_FIELDS, AmountColumns, EntryAmounts
+
+from app.libs.expense_storage import decode_document, get_expense_sheet_storage_key
+
+from conftest import make_entry, make_sheet
+
+
+def _entries():
+    return [
+        make_entry(entry_id="a", parking_amount=0.1, kilometers=10.0, km_amount=1.4),
+        make_entry(entry_id="b", parking_amount=None, taxi_amount=0.2, hotel_amount=80.0),
+        make_entry(entry_id="c", miscellaneous_amount=3.5),
+    ]
+
+
+def test_columns_from_models_and_documents_agree():
+    entries = _entries()
+    from_entries = AmountColumns.from_entries(entries)
+    from_documents = AmountColumns.from_documents(entry.model_dump(mode='json') for entry in entries)
+
+    expected = {field: sum(getattr(entry, field) or 0.0 for entry in entries) for field in AMOUNT_FIELDS}
+    assert from_entries.totals() == from_documents.totals() == expected
+    # Missing amounts are 0.0
+    assert from_entries.row(1) == from_documents.row(1) == EntryAmounts.from_entry(entries[1])
+    assert from_entries.row(1).parking_amount == 0.0
+    assert EntryAmounts.from_document({"daily_total": 2.0}) == EntryAmounts(*([0.0] * 9), 2.0)
+
+
+def test_columns_as_a_sequence_of_rows():
+    entries = _entries()
+    columns = AmountColumns.from_entries(entries[:2])
+    columns.extend(AmountColumns.from_entries(entries[2:]))
+    assert len(columns) == 3
+    assert list(columns) == [EntryAmounts.from_entry(entry) for entry in entries]
+    assert list(columns.column("hotel_amount")) == [0.0, 80.0, 0.0]
+
+    columns.append(EntryAmounts.from_document({"taxi_amount": 1.0, "daily_total": 1.0}))
+    assert len(columns) == 4
+    assert columns.totals()["taxi_amount"] == pytest.approx(1.2)
+    assert len(AmountColumns.from_documents([])) == 0
+
+
+def test_repository_document_includes_logged_entries(backend, repository):
+    repository.create(make_sheet())
+    for entry in _entries():
+        repository.update("sheet-1", lambda sheet, entry=entry: sheet.entries.append(entry))
+    key = get_expense_sheet_storage_key("sheet-1")
+    # The entries are in the log, not yet in the stored snapshot
+    assert len(decode_document(backend.get(key), key)["entries"]) < 3
+
+    document = repository.get_document("sheet-1")
+    assert [entry["id"] for entry in document["entries"]] == ["a", "b", "c"]
+    assert AmountColumns.from_documents(document["entries"]).totals() == AmountColumns.from_entries(repository.get("sheet-1").entries).totals()
+    assert repository.get_document("missing") is None
@@ -0,0 +1,56 @@
+import uuid
+
+from conftest import API_PREFIX
+
+
+def _create_sheet(client, entries=3):
+    response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": "Batch", "month": 5, "year": 2025, "currency": "EUR", "payment_method_filter": "TARJETA"})
+    assert response.status_code == 201
+    sheet_id = response.json()["id"]
+    batch = {"entries": [{"entry_date": "2025-05-02", "payment_method": "TARJETA", "parking_amount": float(index + 1)} for index in range(entries)]}
+    assert client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries/batch", json=batch).status_code == 200
+    sheet = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}").json()
+    return sheet_id, [entry["id"] for entry in sheet["entries"]], sheet["revision"]
+
+
+def test_batch_create_is_one_write(client):
+    sheet_id, _, revision = _create_sheet(client, entries=0)
+    merchant = f"Shop{uuid.uuid4().hex}"
+    entries = [{"entry_date": "2025-05-02", "payment_method": "TARJETA", "merchant_name": merchant, "taxi_amount": amount} for amount in (1.5, 2.0, 4.25)]
+    entries.insert(1, {"entry_date": "not a date", "payment_method": "TARJETA"})
+
+    response = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries/batch", json={"entries": entries})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["revision"], body["created_count"], body["invalid_count"], body["total_amount"]) == (revision + 1, 3, 1, 7.75)
+    assert [result["status"] for result in body["results"]] == ["created", "invalid", "created", "created"]
+
+    sheet = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}").json()
+    assert (sheet["revision"], sheet["entry_count"], sheet["subtotals"]["taxi_amount"]) == (revision + 1, 3, 7.75)
+    summary = next(item for item in client.get(f"{API_PREFIX}/expense-sheets/summary").json()["items"] if item["id"] == sheet_id)
+    assert (summary["revision"], summary["entry_count"], summary["total_amount"]) == (revision + 1, 3, 7.75)
+    hits = client.get(f"{API_PREFIX}/search", params={"q": merchant}).json()
+    assert sorted(hit["daily_total"] for hit in hits["items"]) == [1.5, 2.0, 4.25]
+    assert {hit["sheet_id"] for hit in hits["items"]} == {sheet_id}
+
+
+def test_batch_delete(client):
+    sheet_id, entry_ids, _ = _create_sheet(client)
+    response = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries/batch-delete", json={"entry_ids": entry_ids[:2]})
+    assert response.status_code == 200
+    assert [entry["id"] for entry in response.json()["entries"]] == entry_ids[2:]
+    assert response.json()["total_amount"] == 3.0
+
+
+def test_batch_delete_with_a_missing_entry_deletes_nothing(client):
+    sheet_id, entry_ids, revision = _create_sheet(client)
+    response = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries/batch-delete", json={"entry_ids": [entry_ids[0], "missing"]})
+    assert response.status_code == 404
+    assert client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}").json()["revision"] == revision
+
+
+def test_empty_batches_are_rejected_without_writing(client):
+    sheet_id, _, revision = _create_sheet(client)
+    assert client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries/batch-delete", json={"entry_ids": []}).status_code == 422
+    assert client.patch(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries/batch", json={"updates": []}).status_code == 422
+    assert client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}").json()["revision"] == revision
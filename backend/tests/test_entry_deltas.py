@@ -0,0 +1,81 @@
+import pytest
+
+from conftest import API_PREFIX
+
+MINIMAL = {"Prefer": "return=minimal"}
+
+
+@pytest.fixture
+def sheets(client):
+    sheet_ids = []
+    for name in ("origin", "destination"):
+        response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": name, "month": 5, "year": 2025, "currency": "EUR", "payment_method_filter": "TARJETA"})
+        assert response.status_code == 201
+        sheet_ids.append(response.json()["id"])
+    return sheet_ids
+
+
+def _entry(amount):
+    return {"entry_date": "2025-05-02", "payment_method": "TARJETA", "parking_amount": amount}
+
+
+def _entries_url(sheet_id):
+    return f"{API_PREFIX}/expense-sheets/{sheet_id}/entries"
+
+
+def test_full_sheet_by_default(client, sheets):
+    origin, _ = sheets
+    response = client.post(_entries_url(origin), json=_entry(5.0))
+    assert response.status_code == 201
+    assert "Preference-Applied" not in response.headers
+    assert [entry["parking_amount"] for entry in response.json()["entries"]] == [5.0]
+
+    # The query parameter wins over the header
+    response = client.post(f"{_entries_url(origin)}?response_mode=full", json=_entry(1.0), headers=MINIMAL)
+    assert "Preference-Applied" not in response.headers
+    assert len(response.json()["entries"]) == 2
+
+
+def test_create_and_update_deltas(client, sheets):
+    origin, _ = sheets
+    client.post(_entries_url(origin), json=_entry(5.0))
+
+    response = client.post(_entries_url(origin), json=_entry(2.5), headers=MINIMAL)
+    assert response.status_code == 201
+    assert response.headers["Preference-Applied"] == "return=minimal"
+    delta = response.json()
+    assert "entries" not in delta
+    assert (delta["sheet_id"], delta["revision"], delta["total_amount"], delta["entry_count"]) == (origin, 3, 7.5, 2)
+    assert delta["subtotals"]["parking_amount"] == 7.5
+    assert delta["entry"]["parking_amount"] == 2.5
+    assert (delta["deleted_entry_id"], delta["moved_from"]) == (None, None)
+
+    entry_id = delta["entry"]["id"]
+    delta = client.put(f"{_entries_url(origin)}/{entry_id}?response_mode=minimal", json={"parking_amount": 4.0}).json()
+    assert (delta["entry"]["id"], delta["entry"]["parking_amount"], delta["total_amount"]) == (entry_id, 4.0, 9.0)
+
+
+def test_move_delta(client, sheets):
+    origin, destination = sheets
+    entry_id = client.post(_entries_url(origin), json=_entry(5.0), headers=MINIMAL).json()["entry"]["id"]
+    client.post(_entries_url(origin), json=_entry(1.0))
+
+    response = client.put(f"{_entries_url(origin)}/{entry_id}", json={"new_sheet_id": destination}, headers=MINIMAL)
+    assert response.status_code == 200
+    assert response.headers["Preference-Applied"] == "return=minimal"
+    delta = response.json()
+    assert (delta["sheet_id"], delta["total_amount"], delta["entry_count"]) == (destination, 5.0, 1)
+    assert (delta["entry"]["id"], delta["entry"]["expense_sheet_id"]) == (entry_id, destination)
+    assert (delta["moved_from"]["sheet_id"], delta["moved_from"]["total_amount"], delta["moved_from"]["entry_count"]) == (origin, 1.0, 1)
+
+
+def test_delete_delta(client, sheets):
+    origin, _ = sheets
+    entry_id = client.post(_entries_url(origin), json=_entry(5.0), headers=MINIMAL).json()["entry"]["id"]
+
+    response = client.delete(f"{_entries_url(origin)}/{entry_id}", headers=MINIMAL)
+    assert response.status_code == 200
+    assert response.headers["Preference-Applied"] == "return=minimal"
+    delta = response.json()
+    assert (delta["entry"], delta["deleted_entry_id"]) == (None, entry_id)
+    assert (delta["sheet_id"], delta["total_amount"], delta["entry_count"]) == (origin, 0.0, 0)
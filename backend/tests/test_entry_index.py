@@ -0,0 +1,161 @@
+import pytest
+
+from app.libs.expense_catalog import SheetCatalog
+from app.libs.expense_duplicates import ExpenseDuplicates
+from app.libs.expense_search import ExpenseSearch
+from app.libs.expense_storage import decode_document
+
+from conftest import make_entry, make_sheet
+
+
+@pytest.fixture
+def catalog(backend, repository):
+    catalog = SheetCatalog(backend, repository)
+    repository.add_listener(catalog)
+    return catalog
+
+
+@pytest.fixture
+def search(backend, repository, catalog):
+    # Nothing is written by the background writer while a test runs
+    search = ExpenseSearch(backend, repository, catalog, log_compact_changes=4, update_delay_seconds=3600)
+    repository.add_listener(search)
+    return search
+
+
+@pytest.fixture
+def duplicates(backend, repository, catalog):
+    duplicates = ExpenseDuplicates(backend, repository, catalog, update_delay_seconds=3600)
+    repository.add_listener(duplicates)
+    yield duplicates
+    # Not left to the exit handler, which runs after thread pools are shut down
+    duplicates.flush()
+
+
+def _log(backend, search, user_id="alice"):
+    key = search.log_storage_key(user_id)
+    return decode_document(backend.get(key), key)
+
+
+def _add(sheet_id, entry_id, **fields):
+    return lambda sheet: sheet.entries.append(make_entry(sheet_id, entry_id, **fields))
+
+
+def _hits(search, query, user_id="alice"):
+    return sorted((hit["sheet_id"], hit["entry_id"]) for hit in search.search(user_id, query))
+
+
+def test_writes_are_queued_until_read(backend, repository, search):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", "e1", merchant_name="Repsol")]))
+    assert backend.get(search.storage_key("alice")) is None
+    assert backend.get(search.log_storage_key("alice")) is None
+
+    assert _hits(search, "reps") == [("a1", "e1")]
+
+
+def test_log_holds_only_changed_entries(backend, repository, search):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", f"e{index}", merchant_name="Repsol") for index in range(3)]))
+    search.flush()
+    repository.update("a1", _add("a1", "e3", merchant_name="Cepsa"))
+    search.flush()
+
+    changes = _log(backend, search)["changes"]
+    assert [(change["sheet_id"], list(change["entries"]), change["removed"]) for change in changes] == [("a1", ["e3"], [])]
+    assert _hits(search, "cepsa") == [("a1", "e3")]
+
+
+def test_queued_writes_share_one_log_write(backend, repository, search):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("a2", user_id="alice"))
+    search.flush()
+    writes = []
+    compare_and_put = backend.compare_and_put
+    backend.compare_and_put = lambda key, *args: writes.append(key) or compare_and_put(key, *args)
+
+    repository.update("a1", _add("a1", "e1", merchant_name="Repsol"))
+    repository.update("a1", _add("a1", "e2", merchant_name="Repsol"))
+    repository.update("a2", _add("a2", "e3", merchant_name="Repsol"))
+    search.flush()
+    assert writes.count(search.log_storage_key("alice")) == 1
+    assert _hits(search, "repsol") == [("a1", "e1"), ("a1", "e2"), ("a2", "e3")]
+
+
+def test_log_is_compacted(backend, repository, search):
+    repository.create(make_sheet("a1", user_id="alice"))
+    search.flush()
+    for index in range(4):
+        repository.update("a1", _add("a1", f"e{index}", merchant_name=f"Shop{index}"))
+        search.flush()
+
+    assert _log(backend, search)["changes"] == []
+    key = search.storage_key("alice")
+    assert sorted(decode_document(backend.get(key), key)["entries"]) == ["e0", "e1", "e2", "e3"]
+    assert _hits(search, "shop2") == [("a1", "e2")]
+
+
+def test_updated_moved_and_removed_entries(repository, search):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", "e1", merchant_name="Repsol"), make_entry("a1", "e2", merchant_name="Cepsa")]))
+    repository.create(make_sheet("a2", user_id="alice"))
+    search.flush()
+
+    def rename(sheet):
+        sheet.entries[0].merchant_name = "Galp"
+
+    repository.update("a1", rename)
+    moved = repository.get("a1").entries[1]
+    repository.update_many({
+        "a1": lambda sheet: setattr(sheet, "entries", sheet.entries[:1]),
+        "a2": lambda sheet: sheet.entries.append(moved.model_copy(update={"expense_sheet_id": "a2"})),
+    })
+    assert _hits(search, "repsol") == []
+    assert _hits(search, "galp") == [("a1", "e1")]
+    assert _hits(search, "cepsa") == [("a2", "e2")]
+
+    repository.delete("a2")
+    assert _hits(search, "cepsa") == []
+    assert search.rebuild() == 1
+    assert _hits(search, "galp") == [("a1", "e1")]
+
+
+def test_unreadable_log_rebuilds_the_index(backend, repository, search):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", "e1", merchant_name="Repsol")]))
+    search.flush()
+    repository.update("a1", _add("a1", "e2", merchant_name="Cepsa"))
+    search.flush()
+    # The change to e2 is only in the log
+    backend._data[search.log_storage_key("alice")] = b"{not json"
+
+    assert _hits(search, "cepsa") == [("a1", "e2")]
+    assert backend.get(search.log_storage_key("alice")) is None
+
+
+def test_index_is_dropped_with_the_last_sheet(backend, repository, search):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", "e1", merchant_name="Repsol")]))
+    search.flush()
+    repository.delete("a1")
+    search.flush()
+    assert backend.get(search.storage_key("alice")) is None
+    assert backend.get(search.log_storage_key("alice")) is None
+
+
+def test_duplicates_see_entries_saved_before_the_check(repository, duplicates):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", "e1", merchant_name="Repsol")]))
+    repository.create(make_sheet("a2", user_id="alice", entries=[make_entry("a2", "e2", merchant_name="repsol")]))
+
+    found = duplicates.find_duplicates("alice", [entry.model_dump(mode='json') for entry in repository.get("a2").entries])
+    assert [(duplicate["sheet_id"], duplicate["entry_id"]) for duplicate in found["e2"]] == [("a1", "e1")]
+
+
+def test_duplicate_check_reads_the_queued_changes_without_writing_them(backend, repository, duplicates):
+    repository.create(make_sheet("a1", user_id="alice", entries=[make_entry("a1", "e1", merchant_name="Repsol")]))
+    duplicates.flush()
+    stored_log = backend.get(duplicates.log_storage_key("alice"))
+
+    # Only queued: e1 no longer matches what the stored index says
+    repository.update("a1", lambda sheet: setattr(sheet.entries[0], "merchant_name", "Cepsa"))
+    repository.create(make_sheet("a2", user_id="alice", entries=[make_entry("a2", "e2", merchant_name="Repsol"), make_entry("a2", "e3", merchant_name="Cepsa")]))
+    found = duplicates.find_duplicates("alice", [entry.model_dump(mode='json') for entry in repository.get("a2").entries])
+
+    assert "e2" not in found
+    assert [(duplicate["sheet_id"], duplicate["entry_id"]) for duplicate in found["e3"]] == [("a1", "e1")]
+    assert backend.get(duplicates.log_storage_key("alice")) == stored_log
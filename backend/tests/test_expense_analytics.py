@@ -0,0 +1,81 @@
+import datetime
+
+import pytest
+
+from app.libs.expense_analytics import ExpenseAnalytics, build_entry_block
+from app.libs.expense_catalog import catalog_record
+
+from conftest import make_entry, make_sheet
+
+
+@pytest.fixture
+def records(repository):
+    sheets = [
+        make_sheet("may", entries=[
+            make_entry("may", company="Acme", entry_date=datetime.date(2025, 4, 28), parking_amount=4.0),
+            make_entry("may", company="Acme", parking_amount=10.0),
+            make_entry("may", company="Other", entry_date=None, taxi_amount=7.5, parking_amount=None),
+        ]),
+        make_sheet("june", month=6, entries=[make_entry("june", company="Acme", entry_date=datetime.date(2025, 6, 2), lunch_amount=12.0, parking_amount=None)]),
+        make_sheet("empty", month=7),
+    ]
+    for sheet in sheets:
+        repository.create(sheet)
+    return [catalog_record(sheet) for sheet in sheets]
+
+
+def test_entry_date_range_of_catalog_records(records):
+    # The undated entry counts as the first day of the sheet's month
+    assert [record["entry_date_range"] for record in records] == [["2025-04-28", "2025-05-03"], ["2025-06-02", "2025-06-02"], None]
+
+
+def test_block_columns(repository):
+    repository.create(make_sheet(entries=[make_entry(company="Acme"), make_entry(entry_date=None, company=None)]))
+    block = build_entry_block(repository.get_document("sheet-1"))
+    assert block.amounts.shape[1] == 2
+    assert block.days.tolist() == [datetime.date(2025, 5, 3).toordinal(), datetime.date(2025, 5, 1).toordinal()]
+    assert [block.labels["company"][code] for code in block.codes["company"]] == ["Acme", None]
+    assert [block.labels["month"][code] for code in block.codes["month"]] == ["2025-05", "2025-05"]
+
+
+def test_block_of_legacy_entries_without_some_fields():
+    block = build_entry_block({"year": 2025, "month": 5, "entries": [{"parking_amount": 3.0}, {"entry_date": "2025-05-09", "company": "Acme"}]})
+    assert block.amounts.sum() == 3.0
+    assert [block.labels["company"][code] for code in block.codes["company"]] == [None, "Acme"]
+
+
+def test_aggregate_groups(repository, records):
+    result = ExpenseAnalytics(repository).aggregate(records, group_by=["company", "month"])
+    assert result["sheet_count"] == 3
+    assert result["entry_count"] == 4
+    assert result["totals"]["parking_amount"] == 14.0
+    assert [(group["key"]["company"], group["key"]["month"], group["entry_count"]) for group in result["groups"]] == [
+        ("Acme", "2025-04", 1), ("Acme", "2025-05", 1), ("Acme", "2025-06", 1), ("Other", "2025-05", 1),
+    ]
+
+
+def test_aggregate_skips_sheets_outside_the_date_range(repository, records):
+    loaded = []
+    get_document = repository.get_document
+    repository.get_document = lambda sheet_id: loaded.append(sheet_id) or get_document(sheet_id)
+
+    result = ExpenseAnalytics(repository).aggregate(records, date_from=datetime.date(2025, 4, 1), date_to=datetime.date(2025, 5, 1))
+    assert loaded == ["may"]
+    assert result["entry_count"] == 2  # The April entry and the undated one
+    assert result["totals"]["parking_amount"] == 4.0
+    assert result["totals"]["taxi_amount"] == 7.5
+
+
+def test_aggregate_filters_and_cache(repository, records):
+    from app.libs.expense_cache import SheetCache
+
+    analytics = ExpenseAnalytics(repository, SheetCache(max_entries=16, max_bytes=1024 * 1024, ttl_seconds=float("inf")))
+    first = analytics.aggregate(records, group_by=["month"], filters={"company": "Acme"})
+    again = analytics.aggregate(records, group_by=["month"], filters={"company": "Acme"})
+    assert first == again
+    assert first["entry_count"] == 3
+
+
+def test_unknown_dimension(repository, records):
+    with pytest.raises(ValueError):
+        ExpenseAnalytics(repository).aggregate(records, group_by=["merchant"])
@@ -0,0 +1,58 @@
+import pytest
+
+from app.libs.expense_catalog import SheetCatalog
+from app.libs.expense_rollups import ExpenseRollups, get_rollup_storage_key
+from app.libs.sheet_totals import add_entry_to_totals
+
+from conftest import make_entry, make_sheet
+
+
+@pytest.fixture
+def rollups(backend, repository):
+    catalog = SheetCatalog(backend, repository)
+    repository.add_listener(catalog)
+    rollups = ExpenseRollups(backend, repository, catalog)
+    repository.add_listener(rollups)
+    return rollups
+
+
+def _add_entry(amount):
+    def add(sheet):
+        entry = make_entry(sheet.id, parking_amount=amount)
+        sheet.entries.append(entry)
+        add_entry_to_totals(sheet, entry)
+
+    return add
+
+
+def test_rollup_follows_writes(repository, rollups):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.update("a1", _add_entry(5.0))
+    month = rollups.get_month("alice", 2025, 5)
+    assert month["totals"]["EUR"]["subtotals"]["parking_amount"] == 5.0
+    assert month["totals"]["EUR"]["sheet_count"] == 1
+
+    # Moving the sheet to another month moves its record
+    repository.update("a1", lambda sheet: setattr(sheet, "month", 6))
+    assert rollups.get_month("alice", 2025, 5) is None
+    assert rollups.get_month("alice", 2025, 6)["totals"]["EUR"]["entry_count"] == 1
+
+    repository.delete("a1")
+    assert rollups.get_month("alice", 2025, 6) is None
+
+
+def test_all_users_without_listing_the_bucket(backend, repository, rollups):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("b1", user_id="bob"))
+    repository.create(make_sheet("c1", user_id="carol", month=6))
+    repository.update("b1", _add_entry(2.0))
+    # A missing rollup is computed from the catalog
+    backend.delete(get_rollup_storage_key("alice"))
+
+    def list_keys():
+        raise AssertionError("the bucket must not be listed")
+
+    backend.list_keys = list_keys
+    months = rollups.get_month_for_all_users(2025, 5)
+    assert sorted(months) == ["alice", "bob"]
+    assert months["bob"]["totals"]["EUR"]["total_amount"] == 2.0
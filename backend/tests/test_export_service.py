@@ -0,0 +1,64 @@
+import asyncio
+import base64
+import importlib
+import io
+import sys
+
+import pytest
+
+pytest.importorskip("databutton")
+openpyxl = pytest.importorskip("openpyxl")
+
+from app.libs.expense_storage import get_expense_sheet_storage_key
+
+
+@pytest.fixture
+def fallback_export(monkeypatch):
+    """export_service as imported when app.apis.expense_api cannot be: with its placeholder models
+    and its own repository."""
+    import app.apis
+
+    monkeypatch.setitem(sys.modules, "app.apis.expense_api", None)
+    monkeypatch.delitem(sys.modules, "app.apis.export_service", raising=False)
+    if hasattr(app.apis, "export_service"):
+        monkeypatch.delattr(app.apis, "export_service")
+    module = importlib.import_module("app.apis.export_service")
+    monkeypatch.delitem(sys.modules, "app.apis.export_service")
+    return module
+
+
+def _legacy_document(sheet_id):
+    # Stored before totals were kept on the sheet: no subtotals, entry_count or schema_version
+    return {
+        "id": sheet_id,
+        "user_id": "user-1",
+        "name": "Mayo",
+        "month": 5,
+        "year": 2025,
+        "currency": "EUR",
+        "payment_method_filter": "TARJETA",
+        "status": "pending_validation",
+        "created_at": "2025-05-01T12:00:00",
+        "updated_at": "2025-05-01T12:00:00",
+        "entries": [
+            {"id": f"e{index}", "entry_date": "2025-05-02", "parking_amount": 5.0, "kilometers": 10.0, "created_at": "2025-05-01T12:00:00", "updated_at": "2025-05-01T12:00:00"}
+            for index in range(3)
+        ],
+    }
+
+
+def test_export_through_the_fallback_repository(fallback_export):
+    assert fallback_export.ActualExpenseSheet.__module__ == "app.apis.export_service"
+    repository = fallback_export.sheet_repository
+    repository.backend.put(get_expense_sheet_storage_key("fallback-1"), _legacy_document("fallback-1"))
+
+    sheet = repository.get("fallback-1")
+    assert sheet.entry_count == 3
+    assert sheet.subtotals.km_amount == pytest.approx(4.2)
+
+    response = asyncio.run(fallback_export.export_expense_sheet_to_excel(fallback_export.ExportSheetRequest(sheet_id="fallback-1")))
+    workbook = openpyxl.load_workbook(io.BytesIO(base64.b64decode(response.file_content_base64)))
+    values = [value for row in workbook.active.iter_rows(values_only=True) for value in row if isinstance(value, (int, float))]
+    # The footer holds the totals of the three entries
+    assert 15.0 in values
+    assert pytest.approx(19.2) in values
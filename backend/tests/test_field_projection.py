@@ -0,0 +1,78 @@
+import pytest
+
+from app.libs.field_projection import parse_field_projection, project_document
+
+from conftest import API_PREFIX, make_entry, make_sheet
+
+
+def _sheet_model():
+    from app.apis.expense_api import ExpenseSheet
+
+    return ExpenseSheet
+
+
+def test_parse_nested_and_list_fields():
+    projection = parse_field_projection("name, entries.id,entries.daily_total,subtotals.parking_amount", _sheet_model())
+    assert projection == {
+        "name": True,
+        "entries": {"__all__": {"id": True, "daily_total": True}},
+        "subtotals": {"parking_amount": True},
+    }
+
+
+def test_whole_field_wins_over_subfields():
+    assert parse_field_projection("entries,entries.id", _sheet_model()) == {"entries": True}
+
+
+@pytest.mark.parametrize("fields", ["nope", "name.x", "entries.nope", " , "])
+def test_invalid_projections(fields):
+    with pytest.raises(ValueError):
+        parse_field_projection(fields, _sheet_model())
+
+
+def test_project_document_matches_model_dump():
+    sheet = make_sheet(entries=[make_entry(), make_entry()])
+    projection = parse_field_projection("name,entries.id,subtotals.parking_amount", _sheet_model())
+    assert project_document(sheet.model_dump(mode='json'), projection) == sheet.model_dump(mode='json', include=projection)
+
+
+def _create_sheet(client):
+    response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": "Projected", "month": 5, "year": 2025, "currency": "EUR", "payment_method_filter": "TARJETA"})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def test_projected_sheet_has_its_own_etag(client):
+    sheet_id = _create_sheet(client)
+    full = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}")
+    projected = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", params={"fields": "name,total_amount"})
+    reordered = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", params={"fields": "total_amount,name"})
+
+    assert projected.json() == {"name": "Projected", "total_amount": 0.0}
+    assert full.headers["ETag"] != projected.headers["ETag"]
+    assert projected.headers["ETag"] == reordered.headers["ETag"]
+    # A cached full sheet does not satisfy a projected read, nor the other way round
+    assert client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", params={"fields": "name"}, headers={"If-None-Match": full.headers["ETag"]}).status_code == 200
+    assert client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", headers={"If-None-Match": projected.headers["ETag"]}).status_code == 200
+    assert client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", params={"fields": "name,total_amount"}, headers={"If-None-Match": projected.headers["ETag"]}).status_code == 304
+
+
+def test_projected_etag_works_as_if_match(client):
+    sheet_id = _create_sheet(client)
+    projected = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", params={"fields": "name"})
+    entry = {"entry_date": "2025-05-02", "payment_method": "TARJETA", "parking_amount": 3.0}
+
+    added = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries", json=entry, headers={"If-Match": projected.headers["ETag"]})
+    assert added.status_code == 201
+    stale = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries", json=entry, headers={"If-Match": projected.headers["ETag"]})
+    assert stale.status_code == 412
+
+
+def test_projected_listing_has_its_own_etag(client):
+    _create_sheet(client)
+    full = client.get(f"{API_PREFIX}/expense-sheets")
+    projected = client.get(f"{API_PREFIX}/expense-sheets", params={"fields": "id,name"})
+
+    assert full.headers["ETag"] != projected.headers["ETag"]
+    assert client.get(f"{API_PREFIX}/expense-sheets", params={"fields": "id,name"}, headers={"If-None-Match": full.headers["ETag"]}).status_code == 200
+    assert client.get(f"{API_PREFIX}/expense-sheets", params={"fields": "name,id"}, headers={"If-None-Match": projected.headers["ETag"]}).status_code == 304
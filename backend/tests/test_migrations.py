@@ -0,0 +1,112 @@
+import uuid
+
+import pytest
+
+from app.libs.expense_migrations import MIGRATION_PROGRESS_KEY, SHEET_SCHEMA_VERSION, run_migrations, upgrade_sheet_document
+from app.libs.expense_storage import decode_document, get_expense_sheet_log_storage_key, get_expense_sheet_storage_key
+from app.libs.sheet_totals import assert_sheet_totals
+
+from conftest import API_PREFIX
+
+KM_RATE = 0.14
+
+
+def _legacy_document(sheet_id="legacy-1"):
+    return {
+        "id": sheet_id,
+        "user_id": "user-1",
+        "name": "Legacy",
+        "month": 5,
+        "year": 2025,
+        "currency": "EUR",
+        "payment_method_filter": " tarjeta ",
+        "total_amount": 999.0,
+        "created_at": "2025-05-01T12:00:00",
+        "updated_at": "2025-05-01T12:00:00",
+        "entries": [
+            {"id": "a", "expense_sheet_id": sheet_id, "purchase_date": "2025-05-04", "parking_amount": 5.0, "kilometers": 100.0},
+            {"id": "b", "expense_sheet_id": sheet_id, "entry_date": "2025-05-06", "taxi_amount": 7.5},
+        ],
+    }
+
+
+def _stored(backend, sheet_id):
+    key = get_expense_sheet_storage_key(sheet_id)
+    return decode_document(backend.get(key), key)
+
+
+def test_legacy_document_is_upgraded_in_memory():
+    document = upgrade_sheet_document(_legacy_document(), KM_RATE)
+
+    first, second = document["entries"]
+    assert first["entry_date"] == "2025-05-04"
+    assert first["km_amount"] == pytest.approx(14.0)
+    assert first["daily_total"] == pytest.approx(19.0)
+    assert document["payment_method_filter"] == "TARJETA"
+    assert document["total_amount"] == pytest.approx(26.5)
+    assert document["entry_count"] == 2
+    assert_sheet_totals(document)
+    # Only a rewrite by the runner stores the new version
+    assert "schema_version" not in document
+
+
+def test_current_document_is_left_alone():
+    document = {**_legacy_document(), "schema_version": SHEET_SCHEMA_VERSION}
+    assert upgrade_sheet_document(document, KM_RATE)["total_amount"] == 999.0
+
+
+def test_repository_reads_legacy_sheets_upgraded(backend, repository):
+    backend.put(get_expense_sheet_storage_key("legacy-1"), _legacy_document())
+    sheet = repository.get("legacy-1")
+    assert sheet.schema_version == 0
+    assert [str(entry.entry_date) for entry in sheet.entries] == ["2025-05-04", "2025-05-06"]
+    assert sheet.subtotals.km_amount == pytest.approx(14.0)
+
+
+def test_api_read_of_legacy_sheet_does_not_write(client):
+    import app.apis.expense_api as expense_api
+
+    backend = expense_api.sheet_repository.backend
+    sheet_id = f"legacy-{uuid.uuid4().hex}"
+    key = get_expense_sheet_storage_key(sheet_id)
+    backend.put(key, _legacy_document(sheet_id))
+    stored = backend.get(key)
+
+    response = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}")
+    assert response.status_code == 200
+    sheet = response.json()
+    assert sheet["total_amount"] == pytest.approx(26.5)
+    assert (sheet["schema_version"], sheet["revision"]) == (0, 0)
+    assert response.headers["ETag"] == f'"{sheet_id}.0"'
+    # Reconciled in the response only; the stored sheet is left to the migration runner
+    assert backend.get(key) == stored
+    assert backend.get(get_expense_sheet_log_storage_key(sheet_id)) is None
+
+
+def test_runner_rewrites_legacy_sheets(backend, repository):
+    for index in range(3):
+        backend.put(get_expense_sheet_storage_key(f"legacy-{index}"), _legacy_document(f"legacy-{index}"))
+
+    assert run_migrations(repository, dry_run=True)["migrated"] == 3
+    assert _stored(backend, "legacy-0").get("schema_version") is None
+
+    assert run_migrations(repository, batch_size=2) == {"migrated": 3, "current": 0, "missing": 0, "failed": 0}
+    stored = _stored(backend, "legacy-1")
+    assert stored["schema_version"] == SHEET_SCHEMA_VERSION
+    assert stored["entries"][0]["entry_date"] == "2025-05-04"
+    assert_sheet_totals(stored)
+    assert backend.get(MIGRATION_PROGRESS_KEY) is None
+
+    assert run_migrations(repository)["current"] == 3
+
+
+def test_interrupted_run_resumes_after_the_last_batch(backend, repository):
+    for index in range(3):
+        backend.put(get_expense_sheet_storage_key(f"legacy-{index}"), _legacy_document(f"legacy-{index}"))
+    counts = {"migrated": 1, "current": 0, "missing": 0, "failed": 0}
+    backend.put(MIGRATION_PROGRESS_KEY, {"target_version": SHEET_SCHEMA_VERSION, "last_sheet_id": "legacy-0", "counts": counts})
+
+    assert run_migrations(repository)["migrated"] == 3
+    # The sheet before the saved progress was not read again
+    assert _stored(backend, "legacy-0").get("schema_version") is None
+    assert _stored(backend, "legacy-2")["schema_version"] == SHEET_SCHEMA_VERSION
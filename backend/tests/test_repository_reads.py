@@ -0,0 +1,59 @@
+import threading
+import time
+
+from app.libs.expense_storage import ExpenseSheetRepository, InMemoryStorageBackend, get_expense_sheet_storage_key
+
+from conftest import make_sheet
+
+
+class SlowBackend(InMemoryStorageBackend):
+    """Reads take 10 ms; records how many were in flight at once."""
+
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+    def get(self, key):
+        with self._counter_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.01)
+            return super().get(key)
+        finally:
+            with self._counter_lock:
+                self.in_flight -= 1
+
+
+def _repository(backend):
+    from app.apis.expense_api import ExpenseSheet
+
+    return ExpenseSheetRepository(backend, ExpenseSheet)
+
+
+def test_get_many_keeps_order_and_skips_missing_and_unreadable_sheets(backend):
+    repository = _repository(backend)
+    for sheet_id in ("s1", "s2", "s3"):
+        repository.create(make_sheet(sheet_id))
+    backend._data[get_expense_sheet_storage_key("s2")] = b"{not json"
+
+    sheets = repository.get_many(["s3", "missing", "s2", "s1"])
+    assert [sheet.id for sheet in sheets] == ["s3", "s1"]
+
+
+def test_get_many_reads_in_parallel_up_to_the_limit():
+    backend = SlowBackend()
+    repository = _repository(backend)
+    sheet_ids = [f"s{index}" for index in range(12)]
+    for sheet_id in sheet_ids:
+        repository.create(make_sheet(sheet_id))
+
+    backend.max_in_flight = 0
+    assert [sheet.id for sheet in repository.get_many(sheet_ids, max_workers=4)] == sheet_ids
+    assert backend.max_in_flight == 4
+
+    backend.max_in_flight = 0
+    assert len(repository.get_many(sheet_ids, max_workers=1)) == 12
+    assert backend.max_in_flight == 1
@@ -0,0 +1,129 @@
+import datetime
+
+import pytest
+
+from app.libs.expense_catalog import (
+    CATALOG_DIRECTORY_KEY,
+    SheetCatalog,
+    get_catalog_shard_key,
+)
+from app.libs.expense_storage import decode_document
+
+from conftest import make_sheet
+
+
+@pytest.fixture
+def catalog(backend, repository):
+    catalog = SheetCatalog(backend, repository)
+    repository.add_listener(catalog)
+    return catalog
+
+
+def _ids(records):
+    return sorted(record["id"] for record in records)
+
+
+def test_saves_update_only_the_owners_shard(backend, repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("b1", user_id="bob"))
+    bob_shard = backend.get(get_catalog_shard_key("bob"))
+
+    repository.create(make_sheet("a2", user_id="alice"))
+    assert backend.get(get_catalog_shard_key("bob")) == bob_shard
+    assert _ids(catalog.query(user_id="alice")[0]) == ["a1", "a2"]
+    assert _ids(catalog.query(user_id="bob")[0]) == ["b1"]
+    assert _ids(catalog.query()[0]) == ["a1", "a2", "b1"]
+    assert catalog.list_user_ids() == ["alice", "bob"]
+
+
+def test_user_listing_reads_one_shard(backend, repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("b1", user_id="bob"))
+    reads = []
+    original_get = backend.get
+    backend.get = lambda key: reads.append(key) or original_get(key)
+
+    catalog.query(user_id="alice")
+    assert reads == [get_catalog_shard_key("alice")]
+
+
+def test_user_without_sheets(repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    assert catalog.query(user_id="carol") == ([], None)
+
+
+def test_delete_removes_the_record(repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("a2", user_id="alice"))
+    repository.delete("a1")
+    assert _ids(catalog.query(user_id="alice")[0]) == ["a2"]
+
+
+def test_missing_catalog_is_rebuilt(backend, repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("b1", user_id="bob"))
+    for key in (CATALOG_DIRECTORY_KEY, get_catalog_shard_key("alice"), get_catalog_shard_key("bob")):
+        backend.delete(key)
+
+    assert _ids(catalog.query(user_id="bob")[0]) == ["b1"]
+    assert _ids(catalog.query()[0]) == ["a1", "b1"]
+
+
+def test_lost_shard_of_a_listed_user_is_rebuilt(backend, repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    backend.delete(get_catalog_shard_key("alice"))
+    assert _ids(catalog.query(user_id="alice")[0]) == ["a1"]
+
+
+def test_unreadable_shard_is_rebuilt(backend, repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    backend._data[get_catalog_shard_key("alice")] = b"{not json"
+    assert _ids(catalog.query(user_id="alice")[0]) == ["a1"]
+
+
+def test_rebuild_drops_stale_shards(backend, repository, catalog):
+    repository.create(make_sheet("a1", user_id="alice"))
+    repository.create(make_sheet("b1", user_id="bob"))
+    # The sheet disappears without the catalog being told
+    backend.delete("expense_sheet_b1.json")
+
+    assert catalog.rebuild() == 1
+    assert catalog.list_user_ids() == ["alice"]
+    assert backend.get(get_catalog_shard_key("bob")) is None
+
+
+def _create_sheets(repository):
+    for index in range(7):
+        updated_at = datetime.datetime(2025, 5, 1) + datetime.timedelta(hours=index)
+        user_id = "alice" if index % 2 else "bob"
+        repository.create(make_sheet(f"s{index}", user_id=user_id, updated_at=updated_at, month=5 if index < 4 else 6))
+
+
+def _pages(catalog, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        records, cursor = catalog.query(cursor=cursor, limit=limit, **filters)
+        pages.append([record["id"] for record in records])
+        if cursor is None:
+            return pages
+
+
+def test_shards_are_kept_in_page_order(backend, repository, catalog):
+    _create_sheets(repository)
+    # A save moves the sheet to the front
+    repository.update("s1", lambda sheet: setattr(sheet, "updated_at", sheet.updated_at.replace(year=2026)))
+    key = get_catalog_shard_key("alice")
+    assert [record["id"] for record in decode_document(backend.get(key), key)["sheets"]] == ["s1", "s5", "s3"]
+
+
+def test_pagination_of_one_user(repository, catalog):
+    _create_sheets(repository)
+    assert _pages(catalog, 2, user_id="bob") == [["s6", "s4"], ["s2", "s0"]]
+    assert _pages(catalog, 1, user_id="alice", month=5) == [["s3"], ["s1"]]
+
+
+def test_pagination_across_users(repository, catalog):
+    _create_sheets(repository)
+    assert _pages(catalog, 3) == [["s6", "s5", "s4"], ["s3", "s2", "s1"], ["s0"]]
+    assert _pages(catalog, 2, month=6) == [["s6", "s5"], ["s4"]]
+    assert [record["id"] for record in catalog.query()[0]] == ["s6", "s5", "s4", "s3", "s2", "s1", "s0"]
@@ -0,0 +1,62 @@
+import uuid
+
+import pytest
+
+from conftest import API_PREFIX
+
+
+@pytest.fixture
+def sheet_id(client):
+    response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": "Cached", "month": 5, "year": 2025, "currency": "EUR", "payment_method_filter": "TARJETA"})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def _add_entry(client, sheet_id):
+    response = client.post(f"{API_PREFIX}/expense-sheets/{sheet_id}/entries", json={"entry_date": "2025-05-02", "payment_method": "TARJETA", "parking_amount": 5.0})
+    assert response.status_code == 201
+
+
+def test_sheet_etag_is_its_revision(client, sheet_id):
+    response = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}")
+    etag = response.headers["ETag"]
+    assert etag == f'"{sheet_id}.1"'
+
+    not_modified = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+    assert not_modified.content == b""
+    # As sent back by a client that got a compressed response
+    assert client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+    _add_entry(client, sheet_id)
+    response = client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == f'"{sheet_id}.2"'
+    assert len(response.json()["entries"]) == 1
+
+
+@pytest.mark.parametrize("path", ["/expense-sheets", "/expense-sheets/summary"])
+def test_listing_etag_changes_with_its_sheets(client, sheet_id, path, monkeypatch):
+    import app.apis.expense_api as expense_api
+
+    params = {"currency": "EUR"}
+    etag = client.get(f"{API_PREFIX}{path}", params=params).headers["ETag"]
+
+    # A matching listing is answered from the catalog, without loading any sheet
+    def fail(*args, **kwargs):
+        raise AssertionError("sheets were loaded")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(expense_api.sheet_repository, "list_all", fail)
+        assert client.get(f"{API_PREFIX}{path}", params=params, headers={"If-None-Match": etag}).status_code == 304
+
+    _add_entry(client, sheet_id)
+    response = client.get(f"{API_PREFIX}{path}", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # Sheets outside the listing do not change its ETag
+    etag = response.headers["ETag"]
+    client.post(f"{API_PREFIX}/expense-sheets", json={"name": "Other", "month": 5, "year": 2025, "currency": uuid.uuid4().hex[:8].upper(), "payment_method_filter": "TARJETA"})
+    assert client.get(f"{API_PREFIX}{path}", params=params, headers={"If-None-Match": etag}).status_code == 304
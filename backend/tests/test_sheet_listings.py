@@ -0,0 +1,45 @@
+import uuid
+
+import pytest
+
+from conftest import API_PREFIX
+
+
+@pytest.fixture
+def currency():
+    """A currency no other test uses, to list only this test's sheets (the API's storage is shared)."""
+    return uuid.uuid4().hex[:8].upper()
+
+
+def _create(client, name, currency):
+    response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": name, "month": 5, "year": 2025, "currency": currency, "payment_method_filter": "TARJETA"})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+def test_summary_listing_has_no_entries(client, currency):
+    older = _create(client, "older", currency)
+    newer = _create(client, "newer", currency)
+    for amount in (5.0, 2.5):
+        client.post(f"{API_PREFIX}/expense-sheets/{older}/entries", json={"entry_date": "2025-05-02", "payment_method": "TARJETA", "parking_amount": amount})
+
+    response = client.get(f"{API_PREFIX}/expense-sheets/summary", params={"currency": currency})
+    assert response.status_code == 200
+    page = response.json()
+    assert page["next_cursor"] is None
+    # Most recently updated first: the entries made "older" the latest change
+    assert [item["id"] for item in page["items"]] == [older, newer]
+    summary = page["items"][0]
+    assert "entries" not in summary
+    assert (summary["entry_count"], summary["total_amount"], summary["revision"]) == (2, 7.5, 3)
+    assert summary["subtotals"]["parking_amount"] == 7.5
+
+
+def test_summary_listing_pages(client, currency):
+    sheet_ids = [_create(client, f"sheet {index}", currency) for index in range(3)]
+
+    first = client.get(f"{API_PREFIX}/expense-sheets/summary", params={"currency": currency, "limit": 2}).json()
+    assert first["next_cursor"]
+    second = client.get(f"{API_PREFIX}/expense-sheets/summary", params={"currency": currency, "limit": 2, "cursor": first["next_cursor"]}).json()
+    assert second["next_cursor"] is None
+    assert [item["id"] for item in first["items"] + second["items"]] == sheet_ids[::-1]
@@ -0,0 +1,124 @@
+import pytest
+
+from app.libs.expense_storage import (
+    CorruptSheetError,
+    ExpenseSheetRepository,
+    decode_document,
+    get_expense_sheet_log_storage_key,
+    get_expense_sheet_storage_key,
+    sheet_entry_events,
+)
+
+from conftest import make_entry, make_sheet
+
+
+@pytest.fixture
+def uncached(backend):
+    """A repository that reads every sheet from storage, compacting logs of 3 events."""
+    from app.apis.expense_api import ExpenseSheet
+
+    return ExpenseSheetRepository(backend, ExpenseSheet, log_compact_events=3)
+
+
+def _stored(backend, key):
+    return decode_document(backend.get(key), key)
+
+
+def _snapshot(backend, sheet_id="sheet-1"):
+    return _stored(backend, get_expense_sheet_storage_key(sheet_id))
+
+
+def _log(backend, sheet_id="sheet-1"):
+    return _stored(backend, get_expense_sheet_log_storage_key(sheet_id))
+
+
+def _add(entry_id, **fields):
+    return lambda sheet: sheet.entries.append(make_entry(sheet.id, entry_id, **fields))
+
+
+def _set_amount(entry_id, amount):
+    def mutate(sheet):
+        next(entry for entry in sheet.entries if entry.id == entry_id).parking_amount = amount
+
+    return mutate
+
+
+def test_entry_events():
+    before = [make_entry(entry_id="a"), make_entry(entry_id="b"), make_entry(entry_id="c")]
+    after = [before[0], before[2].model_copy(update={"parking_amount": 1.0}), make_entry(entry_id="d")]
+    events = sheet_entry_events(before, after, 5)
+    assert [(event["op"], event.get("entry_id") or event["entry"]["id"]) for event in events] == [("delete", "b"), ("put", "c"), ("put", "d")]
+    assert all(event["revision"] == 5 for event in events)
+    # Surviving entries in another order cannot be expressed as puts and deletes
+    assert sheet_entry_events(before, list(reversed(before)), 5) is None
+
+
+def test_writes_only_append_changed_entries_to_the_log(backend, uncached):
+    uncached.create(make_sheet(entries=[make_entry(entry_id="a")]))
+    snapshot = backend.get(get_expense_sheet_storage_key("sheet-1"))
+    uncached.update("sheet-1", _add("b"))
+    uncached.update("sheet-1", _set_amount("a", 3.0))
+
+    assert backend.get(get_expense_sheet_storage_key("sheet-1")) == snapshot
+    log = _log(backend)
+    assert (log["revision"], log["base_revision"]) == (3, 1)
+    assert [(event["revision"], event["op"], event["entry"]["id"]) for event in log["events"]] == [(2, "put", "b"), (3, "put", "a")]
+
+    sheet = uncached.get("sheet-1")
+    assert sheet.revision == 3
+    assert [(entry.id, entry.parking_amount) for entry in sheet.entries] == [("a", 3.0), ("b", 10.0)]
+
+
+def test_log_is_compacted_into_a_snapshot(backend, uncached):
+    uncached.create(make_sheet())
+    for entry_id in ("a", "b", "c"):
+        uncached.update("sheet-1", _add(entry_id))
+
+    assert _snapshot(backend)["revision"] == 4
+    assert [entry["id"] for entry in _snapshot(backend)["entries"]] == ["a", "b", "c"]
+    assert _log(backend)["base_revision"] == 4
+    assert _log(backend)["events"] == []
+
+    uncached.update("sheet-1", lambda sheet: setattr(sheet, "entries", sheet.entries[1:]))
+    assert [(event["op"], event["entry_id"]) for event in _log(backend)["events"]] == [("delete", "a")]
+    assert [entry.id for entry in uncached.get("sheet-1").entries] == ["b", "c"]
+
+
+def test_reordered_entries_are_written_as_a_snapshot(backend, uncached):
+    uncached.create(make_sheet(entries=[make_entry(entry_id="a"), make_entry(entry_id="b")]))
+    uncached.update("sheet-1", lambda sheet: sheet.entries.reverse())
+
+    assert [entry["id"] for entry in _snapshot(backend)["entries"]] == ["b", "a"]
+    assert _log(backend)["events"] == []
+    assert [entry.id for entry in uncached.get("sheet-1").entries] == ["b", "a"]
+
+
+def test_log_written_after_an_unsaved_snapshot_fails_to_fold(backend, uncached):
+    uncached.create(make_sheet())
+    uncached.update("sheet-1", _add("a"))
+    backend.put(get_expense_sheet_log_storage_key("sheet-1"), {**_log(backend), "revision": 5, "base_revision": 4})
+
+    with pytest.raises(CorruptSheetError):
+        uncached.get("sheet-1")
+
+
+def test_sheet_stored_without_a_log(backend, uncached):
+    # Sheets written before the log existed are a lone snapshot
+    backend.put(get_expense_sheet_storage_key("sheet-1"), make_sheet(entries=[make_entry(entry_id="a")], revision=7).model_dump(mode='json'))
+    assert [entry.id for entry in uncached.get("sheet-1").entries] == ["a"]
+
+    uncached.update("sheet-1", _add("b"))
+    assert (_log(backend)["base_revision"], _log(backend)["revision"]) == (7, 8)
+    assert [entry.id for entry in uncached.get("sheet-1").entries] == ["a", "b"]
+
+
+def test_stale_log_under_a_newer_snapshot_is_ignored(backend, uncached):
+    uncached.create(make_sheet())
+    uncached.update("sheet-1", _add("a"))
+    stale_log = _log(backend)
+    for entry_id in ("b", "c"):
+        uncached.update("sheet-1", _add(entry_id))
+    # A compaction that lost the race to truncate the log leaves its old events behind
+    backend.put(get_expense_sheet_log_storage_key("sheet-1"), stale_log)
+
+    assert [entry.id for entry in uncached.get("sheet-1").entries] == ["a", "b", "c"]
@@ -0,0 +1,85 @@
+import pytest
+
+from app.libs.expense_storage import RevisionConflictError, SheetNotFoundError
+
+from conftest import make_entry, make_sheet
+
+
+def _add_entry(sheet):
+    sheet.entries.append(make_entry(sheet.id))
+
+
+def test_save_increments_revision(repository):
+    sheet = make_sheet()
+    repository.create(sheet)
+    assert sheet.revision == 1
+
+    saved, _ = repository.update(sheet.id, _add_entry)
+    assert saved.revision == 2
+    assert repository.get(sheet.id).revision == 2
+
+
+def test_create_conflicts_with_existing_sheet(repository):
+    repository.create(make_sheet())
+    with pytest.raises(RevisionConflictError):
+        repository.create(make_sheet())
+
+
+def test_save_of_stale_copy_conflicts(repository):
+    repository.create(make_sheet())
+    first = repository.get("sheet-1").model_copy(deep=True)
+    second = repository.get("sheet-1").model_copy(deep=True)
+    repository.save(first)
+    with pytest.raises(RevisionConflictError):
+        repository.save(second)
+
+
+def test_update_retries_on_conflict(repository):
+    repository.create(make_sheet())
+    calls = []
+
+    def mutate(sheet):
+        calls.append(sheet.revision)
+        if len(calls) == 1:
+            # Another writer gets in between the read and the write
+            repository.update(sheet.id, _add_entry)
+        _add_entry(sheet)
+
+    saved, _ = repository.update("sheet-1", mutate)
+    assert calls == [1, 2]
+    assert saved.revision == 3
+    assert len(repository.get("sheet-1").entries) == 2
+
+
+def test_update_with_expected_revision(repository):
+    repository.create(make_sheet())
+    saved, _ = repository.update("sheet-1", _add_entry, expected_revision=1)
+    assert saved.revision == 2
+    with pytest.raises(RevisionConflictError) as raised:
+        repository.update("sheet-1", _add_entry, expected_revision=1)
+    assert raised.value.current_revision == 2
+
+
+def test_expected_revision_is_checked_against_storage_not_a_stale_cache(backend, repository):
+    from app.apis.expense_api import ExpenseSheet
+    from app.libs.expense_storage import ExpenseSheetRepository
+
+    repository.create(make_sheet())
+    repository.get("sheet-1")  # Cached at revision 1
+    other_worker = ExpenseSheetRepository(backend, ExpenseSheet)
+    other_worker.update("sheet-1", _add_entry)
+
+    saved, _ = repository.update("sheet-1", _add_entry, expected_revision=2)
+    assert saved.revision == 3
+
+    other_worker.update("sheet-1", _add_entry)
+    results = repository.update_many({"sheet-1": _add_entry}, expected_revisions={"sheet-1": 4})
+    assert results["sheet-1"][0].revision == 5
+    assert len(repository.get("sheet-1").entries) == 4
+
+
+def test_update_of_missing_sheet(repository):
+    with pytest.raises(SheetNotFoundError):
+        repository.update("missing", _add_entry)
+    with pytest.raises(SheetNotFoundError):
+        repository.update("missing", _add_entry, expected_revision=1)
@@ -0,0 +1,96 @@
+import pytest
+
+from app.libs.sheet_totals import (
+    add_entry_to_totals,
+    assert_sheet_totals,
+    recompute_totals,
+    remove_entry_from_totals,
+    verify_sheet_totals,
+)
+
+from conftest import API_PREFIX, make_entry, make_sheet
+
+
+def test_deltas_match_recomputed_totals():
+    sheet = make_sheet()
+    entries = [make_entry(parking_amount=0.1), make_entry(taxi_amount=0.2, parking_amount=None), make_entry(kilometers=10.0, km_amount=1.4)]
+    for entry in entries:
+        sheet.entries.append(entry)
+        add_entry_to_totals(sheet, entry)
+        assert_sheet_totals(sheet.model_dump(mode='json'))
+
+    remove_entry_from_totals(sheet, entries[1])
+    sheet.entries.remove(entries[1])
+    assert_sheet_totals(sheet.model_dump(mode='json'))
+
+    for entry in list(sheet.entries):
+        remove_entry_from_totals(sheet, entry)
+        sheet.entries.remove(entry)
+    assert (sheet.total_amount, sheet.entry_count, sheet.subtotals.parking_amount) == (0.0, 0, 0.0)
+
+
+def test_wrong_totals_are_reported_and_repaired(repository):
+    sheet = make_sheet(entries=[make_entry()])
+    recompute_totals(sheet)
+    repository.create(sheet)
+    repository.create(make_sheet("broken", entries=[make_entry("broken")], total_amount=99.0, entry_count=1))
+    with pytest.raises(AssertionError):
+        assert_sheet_totals(repository.get_document("broken"))
+
+    assert verify_sheet_totals(repository, repair=True) == {"ok": 1, "mismatched": 1, "repaired": 1, "failed": 0}
+    assert_sheet_totals(repository.get_document("broken"))
+    assert verify_sheet_totals(repository) == {"ok": 2, "mismatched": 0, "repaired": 0, "failed": 0}
+
+
+def _entry(**amounts):
+    return {"entry_date": "2025-05-02", "payment_method": "TARJETA", **amounts}
+
+
+@pytest.fixture
+def sheets(client):
+    """Two sheets of user-1, and a check of the stored totals of both."""
+    import app.apis.expense_api as expense_api
+
+    sheet_ids = []
+    for name in ("origin", "destination"):
+        response = client.post(f"{API_PREFIX}/expense-sheets", json={"name": name, "month": 5, "year": 2025, "currency": "EUR", "payment_method_filter": "TARJETA"})
+        assert response.status_code == 201
+        sheet_ids.append(response.json()["id"])
+
+    def check():
+        for sheet_id in sheet_ids:
+            assert_sheet_totals(expense_api.sheet_repository.get_document(sheet_id))
+
+    return sheet_ids, check
+
+
+def _entry_ids(client, sheet_id):
+    return [entry["id"] for entry in client.get(f"{API_PREFIX}/expense-sheets/{sheet_id}").json()["entries"]]
+
+
+def test_totals_follow_every_entry_endpoint(client, sheets):
+    (origin, destination), check = sheets
+    url = f"{API_PREFIX}/expense-sheets/{origin}/entries"
+
+    assert client.post(url, json=_entry(parking_amount=0.1, kilometers=12.5)).status_code == 201
+    check()
+    batch = [_entry(taxi_amount=0.2), _entry(lunch_amount=13.3, dinner_amount=0.7), _entry(hotel_amount=80.0)]
+    assert client.post(f"{url}/batch", json={"entries": batch}).status_code == 200
+    check()
+    first, second, third, fourth = _entry_ids(client, origin)
+
+    assert client.put(f"{url}/{first}", json={"parking_amount": 2.35, "km_rate": 0.2}).status_code == 200
+    check()
+    assert client.put(f"{url}/{second}", json={"new_sheet_id": destination, "taxi_amount": 4.1}).status_code == 200
+    check()
+    updates = [{"entry_id": third, "miscellaneous_amount": 1.1}, {"entry_id": fourth, "new_sheet_id": destination}]
+    assert client.patch(f"{url}/batch", json={"updates": updates}).status_code == 200
+    check()
+    assert client.delete(f"{url}/{first}").status_code == 200
+    check()
+    assert client.post(f"{API_PREFIX}/expense-sheets/{destination}/entries/batch-delete", json={"entry_ids": [second]}).status_code == 200
+    check()
+
+    assert _entry_ids(client, origin) == [third]
+    assert _entry_ids(client, destination) == [fourth]
+    assert client.get(f"{API_PREFIX}/expense-sheets/{destination}").json()["total_amount"] == 80.0
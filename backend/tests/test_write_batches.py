@@ -0,0 +1,228 @@
+import pytest
+
+from app.libs.expense_storage import (
+    JOURNAL_KEY_PREFIX,
+    ExpenseSheetRepository,
+    InMemoryStorageBackend,
+    RevisionConflictError,
+    recover_write_batches,
+)
+
+from conftest import make_entry, make_sheet
+
+
+class Crash(BaseException):
+    """The writer process dying: nothing after it runs, not even rollbacks."""
+
+
+class CrashingBackend(InMemoryStorageBackend):
+    def __init__(self):
+        super().__init__()
+        self.crash_puts = set()
+        self.crash_deletes = set()
+        self.races = {}
+
+    def compare_and_put(self, key, document, expected_revision):
+        if key in self.crash_puts:
+            raise Crash(key)
+        if key in self.races:
+            # Another writer gets in just before this write, once
+            self.races.pop(key)()
+        return super().compare_and_put(key, document, expected_revision)
+
+    def delete(self, key):
+        if key.startswith(tuple(self.crash_deletes)):
+            raise Crash(key)
+        super().delete(key)
+
+
+@pytest.fixture
+def crashing_backend():
+    return CrashingBackend()
+
+
+@pytest.fixture
+def sheets(crashing_backend):
+    from app.apis.expense_api import ExpenseSheet
+
+    repository = ExpenseSheetRepository(crashing_backend, ExpenseSheet)
+    origin, destination = make_sheet("origin"), make_sheet("destination")
+    repository.create(origin)
+    repository.create(destination)
+    repository.update("origin", lambda sheet: sheet.entries.append(make_entry("origin", "moved")))
+    return repository
+
+
+def _move(repository, entry_id="moved", expected_revisions=None):
+    moved = []
+
+    def remove(sheet):
+        moved.append(next(entry for entry in sheet.entries if entry.id == entry_id))
+        sheet.entries = [entry for entry in sheet.entries if entry.id != entry_id]
+
+    def append(sheet):
+        sheet.entries.append(moved[0].model_copy(update={"expense_sheet_id": sheet.id}))
+
+    return repository.update_many({"origin": remove, "destination": append}, expected_revisions=expected_revisions)
+
+
+def _entry_ids(repository):
+    return {sheet_id: [entry.id for entry in repository.get(sheet_id).entries] for sheet_id in ("origin", "destination")}
+
+
+def _journals(backend):
+    return [key for key in backend.list_keys() if key.startswith(JOURNAL_KEY_PREFIX)]
+
+
+def test_batch_commit_moves_entry(sheets, crashing_backend):
+    _move(sheets)
+    assert _entry_ids(sheets) == {"origin": [], "destination": ["moved"]}
+    assert _journals(crashing_backend) == []
+
+
+def test_conflicting_batch_is_rolled_back(sheets, crashing_backend):
+    # The destination is written by someone else between the batch's read and its commit
+    def append(sheet):
+        sheet.entries.append(make_entry("destination", "other"))
+
+    def remove(sheet):
+        sheets.update("destination", append)
+        sheet.entries = []
+
+    with pytest.raises(RevisionConflictError) as raised:
+        sheets.update_many({"destination": remove, "origin": lambda sheet: None}, max_attempts=1)
+    assert raised.value.sheet_id == "destination"
+    assert _entry_ids(sheets) == {"origin": ["moved"], "destination": ["other"]}
+    assert _journals(crashing_backend) == []
+
+
+def test_conflict_on_a_pinned_sheet_is_not_retried(sheets, crashing_backend):
+    # Another writer takes the origin between the batch's checks and its commit
+    crashing_backend.races = {"expense_sheetlog_origin.json": lambda: sheets.update("origin", lambda sheet: sheet.entries.append(make_entry("origin", "other")))}
+    with pytest.raises(RevisionConflictError) as raised:
+        _move(sheets, expected_revisions={"origin": 2})
+    assert raised.value.sheet_id == "origin"
+    assert _entry_ids(sheets) == {"origin": ["moved", "other"], "destination": []}
+
+
+def test_conflict_on_an_unpinned_sheet_is_retried(sheets, crashing_backend):
+    crashing_backend.races = {"expense_sheetlog_destination.json": lambda: sheets.update("destination", lambda sheet: sheet.entries.append(make_entry("destination", "other")))}
+    results = _move(sheets, expected_revisions={"origin": 2})
+    assert results["origin"][0].revision == 3
+    assert _entry_ids(sheets) == {"origin": [], "destination": ["other", "moved"]}
+
+
+def test_crash_before_the_writes_completes_the_batch(sheets, crashing_backend):
+    crashing_backend.crash_puts = {"expense_sheetlog_origin.json", "expense_sheetlog_destination.json"}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_puts = set()
+    assert _entry_ids(sheets) == {"origin": ["moved"], "destination": []}
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["completed"] == 1
+    assert _entry_ids(sheets) == {"origin": [], "destination": ["moved"]}
+    assert _journals(crashing_backend) == []
+
+
+def test_crash_between_the_writes_completes_the_batch(sheets, crashing_backend):
+    crashing_backend.crash_puts = {"expense_sheetlog_destination.json"}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_puts = set()
+    assert _entry_ids(sheets) == {"origin": [], "destination": []}
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["completed"] == 1
+    assert _entry_ids(sheets) == {"origin": [], "destination": ["moved"]}
+
+
+def test_crash_between_the_writes_then_origin_updated(sheets, crashing_backend):
+    crashing_backend.crash_puts = {"expense_sheetlog_destination.json"}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_puts = set()
+    sheets.update("origin", lambda sheet: sheet.entries.append(make_entry("origin", "later")))
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["completed"] == 1
+    assert _entry_ids(sheets) == {"origin": ["later"], "destination": ["moved"]}
+
+
+def test_crash_after_the_writes_completes_the_batch(sheets, crashing_backend):
+    crashing_backend.crash_deletes = {JOURNAL_KEY_PREFIX}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_deletes = set()
+    assert len(_journals(crashing_backend)) == 1
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["completed"] == 1
+    assert _entry_ids(sheets) == {"origin": [], "destination": ["moved"]}
+    assert _journals(crashing_backend) == []
+
+
+def test_crash_after_the_writes_then_both_sheets_updated(sheets, crashing_backend):
+    crashing_backend.crash_deletes = {JOURNAL_KEY_PREFIX}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_deletes = set()
+    # Writes after the batch supersede its documents; recovery must not roll them back
+    sheets.update("origin", lambda sheet: sheet.entries.append(make_entry("origin", "later")))
+    sheets.update("destination", lambda sheet: sheet.entries[0].__setattr__("taxi_amount", 5.0))
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["completed"] == 1
+    assert _entry_ids(sheets) == {"origin": ["later"], "destination": ["moved"]}
+    assert sheets.get("destination").entries[0].taxi_amount == 5.0
+    assert _journals(crashing_backend) == []
+
+
+def test_crash_after_the_writes_survives_compaction(crashing_backend):
+    from app.apis.expense_api import ExpenseSheet
+
+    repository = ExpenseSheetRepository(crashing_backend, ExpenseSheet, log_compact_events=2)
+    repository.create(make_sheet("origin"))
+    repository.create(make_sheet("destination"))
+    repository.update("origin", lambda sheet: sheet.entries.append(make_entry("origin", "moved")))
+    crashing_backend.crash_deletes = {JOURNAL_KEY_PREFIX}
+    with pytest.raises(Crash):
+        _move(repository)
+    crashing_backend.crash_deletes = set()
+    for _ in range(3):
+        repository.update("destination", lambda sheet: sheet.entries.append(make_entry("destination")))
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["completed"] == 1
+    assert "moved" in _entry_ids(repository)["destination"]
+    assert _entry_ids(repository)["origin"] == []
+
+
+def test_batch_that_lost_a_key_is_rolled_back(sheets, crashing_backend):
+    crashing_backend.crash_puts = {"expense_sheetlog_destination.json"}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_puts = set()
+    # Another writer takes the destination before recovery runs
+    sheets.update("destination", lambda sheet: sheet.entries.append(make_entry("destination", "other")))
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["rolled_back"] == 1
+    assert _entry_ids(sheets) == {"origin": ["moved"], "destination": ["other"]}
+    assert _journals(crashing_backend) == []
+
+
+def test_batch_that_can_neither_complete_nor_roll_back_keeps_its_journal(sheets, crashing_backend):
+    crashing_backend.crash_puts = {"expense_sheetlog_destination.json"}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_puts = set()
+    sheets.update("destination", lambda sheet: sheet.entries.append(make_entry("destination", "other")))
+    sheets.update("origin", lambda sheet: sheet.entries.append(make_entry("origin", "later")))
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=0)["unresolved"] == 1
+    assert _entry_ids(sheets) == {"origin": ["later"], "destination": ["other"]}
+    assert len(_journals(crashing_backend)) == 1
+
+
+def test_young_journals_are_left_alone(sheets, crashing_backend):
+    crashing_backend.crash_puts = {"expense_sheetlog_destination.json"}
+    with pytest.raises(Crash):
+        _move(sheets)
+    crashing_backend.crash_puts = set()
+
+    assert recover_write_batches(crashing_backend, min_age_seconds=60) == {"completed": 0, "rolled_back": 0, "unresolved": 0}
+    assert len(_journals(crashing_backend)) == 1